@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import httpx
+
+from bench.common import summarize, use_memory_db
+from bench.harness import PASSWORD, Recorder, checkout, prepare_users
+
+# Latencia del checkout durante una tormenta de /login (bcrypt) y de
+# /products/{barcode} (OpenFoodFacts), con y sin control de admision.
+# Los usuarios del checkout van en lazo cerrado; la tormenta es carga
+# abierta (un request cada 1/rate s, sin esperar respuesta), como clientes
+# que reintentan sin mirar lo que pasa.
+#   cd backend && python -m bench.admission_storm --duration 10 --login-rate 200 --barcode-rate 300
+
+PAYMENT_ROUTES = ("POST /api/cart/checkout", "POST /api/webpay/commit", "GET /api/transactions/{token}")
+
+
+async def storm(client, stop, rate, make_request, results):
+    tasks = []
+    started = time.perf_counter()
+    i = 0
+
+    async def one(request):
+        t = time.perf_counter()
+        response = await request
+        results["samples"].append((time.perf_counter() - t) * 1000)
+        code = response.status_code
+        results["status"][code] = results["status"].get(code, 0) + 1
+
+    while not stop.is_set():
+        # si el loop se atraso, salen de una vez todos los que ya correspondian
+        due = int((time.perf_counter() - started) * rate) + 1
+        while i < due:
+            tasks.append(asyncio.create_task(one(make_request(client, i))))
+            i += 1
+        await asyncio.sleep(max(0.0, started + i / rate - time.perf_counter()))
+    await asyncio.gather(*tasks)
+
+
+async def checkout_users(client, users, deadline, rec):
+    async def virtual_user(vu, rng):
+        while time.perf_counter() < deadline:
+            await checkout(client, rec, vu, rng)
+
+    await asyncio.gather(*(virtual_user(vu, random.Random(vu["n"])) for vu in users))
+
+
+def payment_summary(rec):
+    samples = [ms for label in PAYMENT_ROUTES for ms in rec.samples.get(label, [])]
+    return {**summarize(samples), "errors": sum(rec.errors.get(label, 0) for label in PAYMENT_ROUTES),
+            "routes": {label: summarize(rec.samples.get(label, [])) for label in PAYMENT_ROUTES}}
+
+
+async def run_mode(client, enabled, users, storm_users, args):
+    from services.admission import admission
+
+    admission.enabled = enabled
+    # sin tormenta: referencia del checkout
+    quiet = Recorder()
+    await checkout_users(client, users, time.perf_counter() + args.quiet, quiet)
+
+    def login(client, i):
+        vu = storm_users[i % len(storm_users)]
+        return client.post("/login", data={"username": vu["email"], "password": PASSWORD})
+
+    def barcode(client, i):
+        # codigos distintos (tambien entre modos): cada uno es una llamada a OpenFoodFacts
+        return client.get(f"/products/79{int(enabled)}{args.seed:02d}{i:07d}")
+
+    loud = Recorder()
+    stop = asyncio.Event()
+    login_results = {"samples": [], "status": {}}
+    barcode_results = {"samples": [], "status": {}}
+    storms = [asyncio.create_task(storm(client, stop, args.login_rate, login, login_results)),
+              asyncio.create_task(storm(client, stop, args.barcode_rate, barcode, barcode_results))]
+    await checkout_users(client, users, time.perf_counter() + args.duration, loud)
+    stop.set()
+    await asyncio.gather(*storms)
+
+    return {
+        "checkout_quiet": payment_summary(quiet),
+        "checkout_during_storm": payment_summary(loud),
+        "storm": {
+            "login": {**summarize(login_results["samples"]), "status_codes": login_results["status"]},
+            "barcode": {**summarize(barcode_results["samples"]), "status_codes": barcode_results["status"]},
+        },
+        "admission": admission.get_stats() if enabled else None,
+    }
+
+
+async def main_async(args):
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "bench-client")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench-secret")
+    os.environ.setdefault("RECONCILE_ENABLED", "0")
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    # el objetivo por defecto considera la latencia real de Webpay; aqui Webpay es un stand-in rapido
+    os.environ.setdefault("ADMISSION_PAYMENTS_TARGET", str(args.payments_target / 1000))
+
+    db = use_memory_db()
+    import main
+    from bench import standins
+
+    standins.install(webpay=args.webpay_latency / 1000, off=args.off_latency / 1000)
+    users = await prepare_users(db, args.checkout_users + args.storm_users)
+    checkout_vus, storm_vus = users[:args.checkout_users], users[args.checkout_users:]
+
+    report = {"args": vars(args)}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            # primero sin admision: asi los limites adaptativos parten de cero en la segunda corrida
+            for mode, enabled in (("without_admission", False), ("with_admission", True)):
+                report[mode] = await run_mode(client, enabled, checkout_vus, storm_vus, args)
+    print(json.dumps(report, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=10, help="segundos de tormenta por modo")
+    parser.add_argument("--quiet", type=float, default=3, help="segundos de checkout sin tormenta por modo")
+    parser.add_argument("--checkout-users", type=int, default=10)
+    parser.add_argument("--storm-users", type=int, default=50)
+    parser.add_argument("--login-rate", type=float, default=200, help="logins por segundo")
+    parser.add_argument("--barcode-rate", type=float, default=300, help="codigos de barra por segundo")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--webpay-latency", type=float, default=5, help="ms")
+    parser.add_argument("--off-latency", type=float, default=200, help="ms")
+    parser.add_argument("--payments-target", type=float, default=250, help="ms, latencia objetivo de los pagos")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
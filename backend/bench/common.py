@@ -0,0 +1,31 @@
+import statistics
+
+import database
+
+# Utilidades compartidas por los benchmarks
+
+
+def use_memory_db(name: str = "bench"):
+    """Reemplaza database.db por una base en memoria (mongomock)"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    database.client = AsyncMongoMockClient()
+    database.db = database.client[name]
+    return database.db
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def summarize(samples_ms):
+    if not samples_ms:
+        return {"count": 0}
+    return {
+        "count": len(samples_ms),
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+        "mean_ms": round(statistics.mean(samples_ms), 3),
+    }
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+import database
+from bench.common import summarize, use_memory_db
+
+# Venta relampago: muchos compradores simultaneos sobre un solo producto.
+# Cada comprador tiene 1 unidad en el carrito y hace checkout a la vez; los
+# que consiguen reserva pagan (AUTHORIZED), fallan o abandonan el pago.
+# Se verifica que nunca se venda mas que el stock y que lo no vendido vuelva.
+#   cd backend && python -m bench.flash_sale --buyers 1000 --stock 200 --shards 16 --rounds 3
+# Con --mongo-url se corre contra un Mongo real (la contencion sobre los
+# shards solo se nota ahi; mongomock ejecuta todo en serie).
+
+PRODUCT_ID = "1"
+
+
+class WebpayStandIn:
+    """Transbank falso: crea tokens y en el commit decide el resultado"""
+
+    def __init__(self, fail_rate: float, rng: random.Random):
+        self.fail_rate = fail_rate
+        self.rng = rng
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.002)
+        if request.method == "POST":
+            return httpx.Response(200, json={"token": uuid.uuid4().hex, "url": "https://webpay.local/pay"})
+        failed = self.rng.random() < self.fail_rate
+        return httpx.Response(200, json={"status": "FAILED" if failed else "AUTHORIZED",
+                                         "response_code": -1 if failed else 0})
+
+
+async def checkout(client, cookie):
+    started = time.perf_counter()
+    response = await client.post("/api/cart/checkout", headers={"Cookie": f"access_token={cookie}"})
+    return response, (time.perf_counter() - started) * 1000
+
+
+async def run_round(client, args, cookies, rng):
+    from services import inventory
+
+    await inventory.set_stock(PRODUCT_ID, args.stock, args.shards)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(checkout(client, c) for c in cookies))
+    elapsed = time.perf_counter() - started
+
+    tokens = [r.json()["token"] for r, _ in results if r.status_code == 200]
+    # unos pagan (o fallan) y otros abandonan Webpay sin volver al commit
+    rng.shuffle(tokens)
+    abandoned = tokens[:int(len(tokens) * args.abandon_rate)]
+    await asyncio.gather(*(client.post("/api/webpay/commit", data={"token_ws": t})
+                           for t in tokens[len(abandoned):]))
+    # las reservas de los que abandonaron vencen
+    await database.db["reservations"].update_many({"status": "held"}, {"$set": {"expires_at": datetime(2000, 1, 1)}})
+    expired = await inventory.release_expired(limit=len(cookies))
+
+    statuses = {}
+    for response, _ in results:
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    stock = await inventory.get_stock(PRODUCT_ID)
+    sold = 0
+    async for doc in database.db["reservations"].find({"status": "confirmed"}, {"lines": 1}):
+        sold += sum(line["quantity"] for line in doc["lines"])
+    await database.db["reservations"].delete_many({})
+    return {
+        "checkout_status_codes": statuses,
+        "reserved": len(tokens),
+        "abandoned": len(abandoned),
+        "expired_released": expired,
+        "sold": sold,
+        "available_after": stock["available"],
+        "min_shard": min(stock["shards"]),
+        "oversold": max(0, sold - args.stock),
+        "conserved": sold + stock["available"] == args.stock,
+        "checkouts_per_s": round(len(cookies) / elapsed, 1),
+        "latency": summarize([ms for _, ms in results]),
+    }
+
+
+async def main_async(args):
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        database.client = AsyncIOMotorClient(args.mongo_url)
+        database.db = database.client["flash_sale_bench"]
+        await database.client.drop_database("flash_sale_bench")
+    else:
+        use_memory_db()
+    import main
+    from routes.routes import create_access_token
+    from services.http_clients import http_clients
+
+    rng = random.Random(11)
+    http_clients.set_transport("webpay", httpx.MockTransport(WebpayStandIn(args.fail_rate, rng).handler))
+
+    users = [f"buyer{i}@example.com" for i in range(args.buyers)]
+    await database.db["users"].insert_many([{"email": e, "full_name": "Bench", "google_id": None} for e in users])
+    await database.db["carts"].insert_many([{"_id": e, "items": [{"product_id": PRODUCT_ID, "quantity": 1}]}
+                                            for e in users])
+    cookies = [create_access_token({"sub": e}) for e in users]
+
+    report = {"buyers": args.buyers, "stock": args.stock, "shards": args.shards, "rounds": []}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for _ in range(args.rounds):
+                report["rounds"].append(await run_round(client, args, cookies, rng))
+    print(json.dumps(report, indent=2))
+
+    ok = all(r["oversold"] == 0 and r["conserved"] and r["min_shard"] >= 0
+             and r["reserved"] == min(args.stock, args.buyers) for r in report["rounds"])
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--buyers", type=int, default=1000)
+    parser.add_argument("--stock", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--fail-rate", type=float, default=0.2, help="pagos rechazados por Webpay")
+    parser.add_argument("--abandon-rate", type=float, default=0.1, help="pagos que nunca vuelven al commit")
+    parser.add_argument("--mongo-url", help="Mongo real en vez de mongomock")
+    raise SystemExit(asyncio.run(main_async(parser.parse_args(argv))))
+
+
+if __name__ == "__main__":
+    main()
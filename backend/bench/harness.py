@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.common import summarize, use_memory_db
+
+# Benchmark de la app completa en el mismo proceso: main.app por ASGI, Mongo
+# en memoria y Webpay/Google/OpenFoodFacts falsos con latencia configurable.
+# Escenarios:
+#   browse    catalogo, categorias, busqueda, paginas con cursor y codigos de barra
+#   login     /login + /me
+#   google    callback de OAuth de Google + /me
+#   checkout  carrito -> checkout -> commit de Webpay -> estado de la transaccion
+# Resultado: p50/p95/p99 y req/s por ruta en JSON. Con --baseline se compara
+# contra una corrida anterior y sale con codigo 1 si alguna ruta empeoro.
+#   cd backend && python -m bench.harness --duration 10 --output bench-$(git rev-parse --short HEAD).json
+#   cd backend && python -m bench.harness --baseline bench-old.json
+#   cd backend && python -m bench.harness --compare bench-old.json bench-new.json
+
+SCENARIOS = ("browse", "login", "google", "checkout")
+PASSWORD = "secreto123"
+SEARCH_TERMS = ["pizza", "hambur", "sushi cali", "pasta carbonara", "taco", "ensalada cesar", "postre"]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.enabled = True
+
+    async def call(self, client, label, method, url, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if self.enabled:
+            self.samples.setdefault(label, []).append(elapsed_ms)
+            if response.status_code not in expected:
+                self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+
+def cookie_header(token):
+    return {"Cookie": f"access_token={token}"}
+
+
+# ---- escenarios: cada uno es una iteracion de un usuario virtual ----
+
+async def browse(client, rec, vu, rng):
+    r = await rec.call(client, "GET /products", "GET", "/products", params={"limit": 5})
+    cursor = r.headers.get("x-next-cursor")
+    if cursor:
+        await rec.call(client, "GET /products?cursor", "GET", "/products", params={"limit": 5, "cursor": cursor})
+    await rec.call(client, "GET /products/categories", "GET", "/products/categories")
+    await rec.call(client, "GET /products/category/{category}", "GET",
+                   f"/products/category/{rng.choice(['Pizzas', 'Sushi', 'Tacos', 'Postres'])}")
+    await rec.call(client, "GET /products/search", "GET", "/products/search", params={"q": rng.choice(SEARCH_TERMS)})
+    # pocos codigos distintos: la mayoria sale del cache de OpenFoodFacts
+    barcode = f"7800{rng.randint(0, 50):04d}"
+    await rec.call(client, "GET /products/{barcode}", "GET", f"/products/{barcode}", expected=(200, 404))
+
+
+async def login(client, rec, vu, rng):
+    r = await rec.call(client, "POST /login", "POST", "/login",
+                       data={"username": vu["email"], "password": PASSWORD})
+    token = r.cookies.get("access_token")
+    await rec.call(client, "GET /me", "GET", "/me", headers=cookie_header(token))
+
+
+async def google(client, rec, vu, rng):
+    r = await rec.call(client, "GET /auth/google/callback", "GET", "/auth/google/callback",
+                       params={"code": f"user-{vu['n']}"}, expected=(307,))
+    location = httpx.URL(r.headers["location"])
+    await rec.call(client, "GET /me", "GET", "/me", headers=cookie_header(location.params["access_token"]))
+
+
+async def checkout(client, rec, vu, rng):
+    headers = cookie_header(vu["token"])
+    for product_id in rng.sample(["1", "2", "3", "4", "5", "6", "7", "8"], 2):
+        await rec.call(client, "POST /api/cart/items", "POST", "/api/cart/items",
+                       json={"product_id": product_id, "quantity": rng.randint(1, 3)}, headers=headers)
+    await rec.call(client, "GET /api/cart", "GET", "/api/cart", headers=headers)
+    r = await rec.call(client, "POST /api/cart/checkout", "POST", "/api/cart/checkout", headers=headers)
+    token = r.json()["token"]
+    await rec.call(client, "POST /api/webpay/commit", "POST", "/api/webpay/commit", data={"token_ws": token})
+    await rec.call(client, "GET /api/transactions/{token}", "GET", f"/api/transactions/{token}")
+    await rec.call(client, "DELETE /api/cart", "DELETE", "/api/cart", headers=headers)
+
+
+SCENARIO_FUNCS = {"browse": browse, "login": login, "google": google, "checkout": checkout}
+
+
+async def run_scenario(client, name, users, args):
+    rec = Recorder()
+    func = SCENARIO_FUNCS[name]
+
+    async def virtual_user(vu, deadline, rng, counter):
+        while time.perf_counter() < deadline:
+            await func(client, rec, vu, rng)
+            counter[0] += 1
+
+    # calentamiento (caches, pools, JIT de indices) sin registrar
+    rec.enabled = False
+    await asyncio.gather(*(func(client, rec, users[i], random.Random(i)) for i in range(args.concurrency)))
+    rec.enabled = True
+
+    counter = [0]
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(virtual_user(users[i], deadline, random.Random(args.seed + i), counter)
+                           for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    for label, samples in sorted(rec.samples.items()):
+        routes[label] = {**summarize(samples), "rps": round(len(samples) / elapsed, 1),
+                         "errors": rec.errors.get(label, 0)}
+    return {"elapsed_s": round(elapsed, 3), "iterations": counter[0], "routes": routes}
+
+
+async def prepare_users(db, count):
+    from routes.routes import create_access_token
+    from services.password_hasher import pwd_context
+
+    # un solo hash para todos: el costo de bcrypt se mide en /login, no al preparar
+    hashed = pwd_context.hash(PASSWORD)
+    users = [{"n": i, "email": f"vu{i}@example.com"} for i in range(count)]
+    await db["users"].insert_many([{"email": u["email"], "full_name": f"VU {u['n']}", "google_id": None,
+                                    "hashed_password": hashed} for u in users])
+    for u in users:
+        u["token"] = create_access_token({"sub": u["email"]})
+    return users
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    # antes de importar la app: la config se lee de variables de entorno al importar
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "bench-client")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench-secret")
+    os.environ.setdefault("RECONCILE_ENABLED", "0")
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    db = use_memory_db()
+    import main
+    from bench import standins
+
+    standins.install(webpay=args.webpay_latency / 1000, google=args.google_latency / 1000,
+                     off=args.off_latency / 1000)
+    users = await prepare_users(db, args.concurrency)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": {k: v for k, v in vars(args).items() if k not in ("baseline", "compare", "output")},
+        },
+        "scenarios": {},
+    }
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            for name in args.scenarios:
+                report["scenarios"][name] = await run_scenario(client, name, users, args)
+    return report
+
+
+def compare(baseline, current, threshold, min_ms):
+    """Rutas cuyo p95 subio (o cuyo req/s bajo) mas que `threshold`"""
+    regressions = []
+    for name, scenario in current["scenarios"].items():
+        base_routes = baseline.get("scenarios", {}).get(name, {}).get("routes", {})
+        for label, stats in scenario["routes"].items():
+            base = base_routes.get(label)
+            if not base or not stats.get("count"):
+                continue
+            p95, base_p95 = stats["p95_ms"], base["p95_ms"]
+            if p95 > base_p95 * (1 + threshold) and p95 - base_p95 > min_ms:
+                regressions.append({"scenario": name, "route": label, "metric": "p95_ms",
+                                    "baseline": base_p95, "current": p95})
+            if stats["rps"] < base["rps"] * (1 - threshold):
+                regressions.append({"scenario": name, "route": label, "metric": "rps",
+                                    "baseline": base["rps"], "current": stats["rps"]})
+    return regressions
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS),
+                        help="lista separada por comas: " + ",".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=5, help="segundos por escenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="usuarios virtuales")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--webpay-latency", type=float, default=5, help="ms")
+    parser.add_argument("--google-latency", type=float, default=20, help="ms")
+    parser.add_argument("--off-latency", type=float, default=50, help="ms")
+    parser.add_argument("--bcrypt-rounds", type=int, help="costo de bcrypt (por defecto BCRYPT_ROUNDS)")
+    parser.add_argument("--output", help="guardar el resultado en este archivo")
+    parser.add_argument("--baseline", help="resultado anterior para detectar regresiones")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="solo comparar dos resultados")
+    parser.add_argument("--threshold", type=float, default=0.2, help="empeoramiento tolerado (0.2 = 20%%)")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="diferencia de p95 minima para contar")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    if args.compare:
+        baseline, report = load(args.compare[0]), load(args.compare[1])
+    else:
+        report = asyncio.run(run(args))
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+        print(output)
+        baseline = load(args.baseline) if args.baseline else None
+
+    if baseline is None:
+        return
+    regressions = compare(baseline, report, args.threshold, args.min_ms)
+    for r in regressions:
+        print(f"REGRESION {r['scenario']} {r['route']} {r['metric']}: {r['baseline']} -> {r['current']}",
+              file=sys.stderr)
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from bench.common import summarize, use_memory_db
+
+# Latencia del catalogo durante una rafaga de logins.
+# Compara bcrypt en el event loop ("inline", como antes) contra el pool de
+# password_hasher ("pool").
+#   cd backend && python -m bench.login_flood --logins 200 --concurrency 50
+
+EMAIL = "flood@example.com"
+PASSWORD = "secreto123"
+
+
+async def timed_get(client, path, scheduled, samples):
+    response = await client.get(path)
+    # se mide desde cuando deberia haber salido: incluye el tiempo que el loop estuvo bloqueado
+    samples.append((time.perf_counter() - scheduled) * 1000)
+    assert response.status_code == 200
+
+
+async def sample_catalog(client, stop, samples, interval=0.01):
+    # carga abierta: un request cada `interval`, sin esperar al anterior
+    tasks = []
+    started = time.perf_counter()
+    i = 0
+    while not stop.is_set():
+        scheduled = started + i * interval
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        tasks.append(asyncio.create_task(timed_get(client, "/products/categories", scheduled, samples)))
+        i += 1
+    await asyncio.gather(*tasks)
+
+
+async def login_worker(client, queue, results):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        response = await client.post("/login", data={"username": EMAIL, "password": PASSWORD})
+        results[response.status_code] = results.get(response.status_code, 0) + 1
+
+
+async def run_mode(app, mode, logins, concurrency):
+    from services.password_hasher import password_hasher
+
+    original = password_hasher._run
+    if mode == "inline":
+        async def inline(fn, *args):
+            return fn(*args)
+        password_hasher._run = inline
+
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            idle = []
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(sample_catalog(client, stop, idle))
+            await asyncio.sleep(1)
+            stop.set()
+            await sampler
+
+            queue = asyncio.Queue()
+            for _ in range(logins):
+                queue.put_nowait(None)
+            during, results = [], {}
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(sample_catalog(client, stop, during))
+            started = time.perf_counter()
+            await asyncio.gather(*(login_worker(client, queue, results) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await sampler
+    finally:
+        password_hasher._run = original
+
+    return {
+        "catalog_idle": summarize(idle),
+        "catalog_during_flood": summarize(during),
+        "login_status_codes": results,
+        "logins_per_s": round(logins / elapsed, 1),
+    }
+
+
+async def main_async(args):
+    db = use_memory_db()
+    import main
+    from services.password_hasher import pwd_context
+
+    await db["users"].insert_one({"email": EMAIL, "hashed_password": pwd_context.hash(PASSWORD),
+                                  "full_name": "Bench", "google_id": None})
+    report = {}
+    async with main.app.router.lifespan_context(main.app):
+        for mode in ("inline", "pool"):
+            report[mode] = await run_mode(main.app, mode, args.logins, args.concurrency)
+    print(json.dumps(report, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main_async(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+from bench.common import summarize, use_memory_db
+from bench.standins import WebpayStandIn
+
+# Prueba de concurrencia de create-payment contra un Webpay local:
+# - miles de pagos simultaneos sin llave: ningun buy_order repetido
+# - muchos reintentos simultaneos con la misma Idempotency-Key: una sola
+#   transaccion en Webpay y todos reciben la misma respuesta
+#   cd backend && python -m bench.payment_concurrency --payments 2000 --replays 200
+
+
+async def post_payment(client, amount, key=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    started = time.perf_counter()
+    response = await client.post("/api/create-payment", json={"amount": amount}, headers=headers)
+    return response, (time.perf_counter() - started) * 1000
+
+
+async def main_async(args):
+    db = use_memory_db()
+    import main
+    from services.http_clients import http_clients
+
+    webpay = WebpayStandIn(args.latency)
+    http_clients.set_transport("webpay", httpx.MockTransport(webpay.handler))
+    report = {}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            results = await asyncio.gather(*(post_payment(client, 1000 + i) for i in range(args.payments)))
+            statuses = [r.status_code for r, _ in results]
+            orders = [t["buy_order"] async for t in db["transactions"].find({}, {"buy_order": 1})]
+            report["distinct_payments"] = {
+                "requests": args.payments,
+                "ok": statuses.count(200),
+                "webpay_calls": len(webpay.created),
+                "unique_buy_orders": len(set(orders)),
+                "duplicated_buy_orders": len(orders) - len(set(orders)),
+                "latency": summarize([ms for _, ms in results]),
+            }
+
+            calls_before = len(webpay.created)
+            key = uuid.uuid4().hex
+            results = await asyncio.gather(*(post_payment(client, 5000, key) for _ in range(args.replays)))
+            tokens = {r.json().get("token") for r, _ in results if r.status_code == 200}
+            report["idempotent_replays"] = {
+                "requests": args.replays,
+                "ok": sum(1 for r, _ in results if r.status_code == 200),
+                "replayed": sum(1 for r, _ in results if r.headers.get("idempotent-replayed") == "true"),
+                "webpay_calls": len(webpay.created) - calls_before,
+                "distinct_tokens": len(tokens),
+                "transactions_with_key": await db["transactions"].count_documents({"idempotency_key": key}),
+            }
+    print(json.dumps(report, indent=2))
+
+    ok = (report["distinct_payments"]["duplicated_buy_orders"] == 0
+          and report["idempotent_replays"]["webpay_calls"] == 1
+          and report["idempotent_replays"]["distinct_tokens"] == 1)
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=2000)
+    parser.add_argument("--replays", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005, help="latencia simulada de Webpay (s)")
+    raise SystemExit(asyncio.run(main_async(parser.parse_args(argv))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+
+from bench.common import use_memory_db
+
+# Reconciliacion de pagos pendientes contra un Webpay local:
+# - solo una de varias replicas toma el lease y consulta Webpay
+# - nunca hay mas de --concurrency consultas a la vez ni mas de --rate por segundo
+# - cada transaccion queda con el estado que dice Webpay (o EXPIRED)
+#   cd backend && python -m bench.reconcile_bench --pending 500 --replicas 3
+
+OUTCOMES = ["AUTHORIZED", "FAILED", "INITIALIZED", "unknown", "error"]
+
+
+class WebpayStatusStandIn:
+    """Transbank falso para GET /transactions/{token}: estado fijo por token"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.outcomes = {}
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.call_times = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        self.call_times.append(time.monotonic())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        outcome = self.outcomes.get(request.url.path.rsplit("/", 1)[-1], "unknown")
+        if outcome == "unknown":
+            return httpx.Response(422, json={"error_message": "Invalid token"})
+        if outcome == "error":
+            return httpx.Response(500, json={"error_message": "boom"})
+        return httpx.Response(200, json={"status": outcome, "response_code": 0 if outcome == "AUTHORIZED" else -1})
+
+
+def peak_rate(call_times, window=1.0):
+    """Maximo de llamadas dentro de cualquier ventana de `window` segundos"""
+    peak, start = 0, 0
+    for end, t in enumerate(call_times):
+        while t - call_times[start] > window:
+            start += 1
+        peak = max(peak, end - start + 1)
+    return peak
+
+
+async def main_async(args):
+    db = use_memory_db()
+    from services.http_clients import http_clients
+    from services.reconciliation import EXPIRED_STATUS, PaymentReconciler
+
+    webpay = WebpayStatusStandIn(args.latency)
+    http_clients.set_transport("webpay", httpx.MockTransport(webpay.handler))
+    # sin reintentos, asi cada consulta cuenta una vez
+    http_clients.upstreams["webpay"].retries = 0
+
+    rng = random.Random(7)
+    now = datetime.now()
+    expected = {}
+    docs = []
+    for i in range(args.pending):
+        token = uuid.uuid4().hex
+        outcome = rng.choice(OUTCOMES)
+        webpay.outcomes[token] = outcome
+        created_at = now - timedelta(hours=2 if i % 2 else 0, minutes=30)
+        old = created_at < now - timedelta(hours=1)
+        if outcome in ("AUTHORIZED", "FAILED"):
+            expected[token] = outcome
+        elif outcome in ("INITIALIZED", "unknown") and old:
+            expected[token] = EXPIRED_STATUS
+        else:
+            expected[token] = "pending"
+        docs.append({"token": token, "buy_order": f"ORD{i}", "amount": 1000, "status": "pending",
+                     "created_at": created_at})
+    # uno reciente que todavia no debe tocarse
+    docs.append({"token": "fresh", "buy_order": "ORDFRESH", "amount": 1000, "status": "pending",
+                 "created_at": now})
+    expected["fresh"] = "pending"
+    await db["transactions"].insert_many(docs)
+
+    replicas = [PaymentReconciler(batch_size=args.pending + 1, concurrency=args.concurrency,
+                                  rate=args.rate, expire_after=3600, stale_after=600)
+                for _ in range(args.replicas)]
+
+    async def tick(reconciler):
+        if await reconciler.acquire_lease():
+            return await reconciler.run_once()
+        return None
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(tick(r) for r in replicas))
+    elapsed = time.perf_counter() - started
+
+    actual = {t["token"]: t["status"] async for t in db["transactions"].find({}, {"token": 1, "status": 1})}
+    mismatches = [token for token, status in expected.items() if actual.get(token) != status]
+    leaders = [r for r in results if r is not None]
+    await http_clients.aclose()
+
+    report = {
+        "pending": args.pending,
+        "replicas": args.replicas,
+        "leaders": len(leaders),
+        "pass": leaders[0] if leaders else None,
+        "webpay_calls": webpay.calls,
+        "max_concurrent_calls": webpay.max_in_flight,
+        "peak_calls_per_s": peak_rate(webpay.call_times),
+        "elapsed_s": round(elapsed, 3),
+        "status_mismatches": len(mismatches),
+    }
+    print(json.dumps(report, indent=2))
+
+    ok = (len(leaders) == 1 and not mismatches
+          and webpay.max_in_flight <= args.concurrency
+          and report["peak_calls_per_s"] <= args.rate + 1)
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pending", type=int, default=200)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=100, help="consultas por segundo a Webpay")
+    parser.add_argument("--latency", type=float, default=0.05, help="latencia simulada de Webpay (s)")
+    raise SystemExit(asyncio.run(main_async(parser.parse_args(argv))))
+
+
+if __name__ == "__main__":
+    main()
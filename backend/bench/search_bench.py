@@ -0,0 +1,105 @@
+import argparse
+import itertools
+import json
+import random
+import time
+
+from bench.common import summarize
+from services.search import SearchIndex
+
+# Benchmark del buscador: arma un catalogo sintetico y mide la latencia por consulta.
+#   cd backend && python -m bench.search_bench --products 100000
+
+WORDS = [
+    "hamburguesa", "clásica", "pizza", "margherita", "ensalada", "césar", "pasta", "carbonara",
+    "sushi", "california", "tacos", "pastor", "sopa", "tomate", "tiramisú", "queso", "pollo",
+    "carne", "cerdo", "piña", "cilantro", "albahaca", "crutones", "parmesano", "aguacate",
+    "pepino", "cangrejo", "mascarpone", "café", "cacao", "lechuga", "salsa", "especial",
+    "picante", "vegana", "integral", "artesanal", "familiar", "doble", "crema", "champiñón",
+    "jamón", "aceitunas", "camarón", "salmón", "arroz", "frijoles", "maíz", "limón", "chocolate",
+]
+SYLLABLES = ["ma", "la", "co", "ri", "to", "pe", "sa", "ca", "ne", "bo", "du", "fi", "gra", "tre", "que", "llo"]
+CATEGORIES = ["Hamburguesas", "Pizzas", "Ensaladas", "Pastas", "Sushi", "Tacos", "Sopas", "Postres"]
+
+
+def make_vocabulary(rng, size=5_000):
+    # palabras reales + inventadas con distribucion tipo Zipf (pesos acumulados) como en un catalogo real
+    vocabulary = list(WORDS)
+    while len(vocabulary) < size:
+        vocabulary.append("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    return vocabulary, weights
+
+
+def make_products(n, rng, vocabulary, weights):
+    for i in range(n):
+        yield {
+            "id": str(i),
+            "name": " ".join(rng.choices(vocabulary, cum_weights=weights, k=3)).capitalize(),
+            "description": " ".join(rng.choices(vocabulary, cum_weights=weights, k=12)),
+            "price": rng.randint(3000, 30000),
+            "image_url": "",
+            "category": rng.choice(CATEGORIES),
+        }
+
+
+def make_queries(n, rng, vocabulary, weights):
+    queries = []
+    for _ in range(n):
+        kind = rng.random()
+        word, other = rng.choices(vocabulary, cum_weights=weights, k=2)
+        if kind < 0.4:
+            queries.append(word)  # palabra completa
+        elif kind < 0.8:
+            queries.append(word[:rng.randint(2, 4)])  # type-ahead
+        else:
+            queries.append(f"{other} {word[:3]}")  # dos terminos
+    return queries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    vocabulary, weights = make_vocabulary(rng)
+    index = SearchIndex()
+    started = time.perf_counter()
+    for product in make_products(args.products, rng, vocabulary, weights):
+        index.upsert(product)
+    build_s = time.perf_counter() - started
+
+    # actualizaciones incrementales: cambiar 1% del catalogo
+    updates = [dict(p, name=p["name"] + " oferta") for p in make_products(args.products // 100, rng, vocabulary, weights)]
+    started = time.perf_counter()
+    for product in updates:
+        index.upsert(product)
+    update_ms = (time.perf_counter() - started) * 1000 / max(1, len(updates))
+
+    index.search("warmup")  # calcula la normalizacion despues de las actualizaciones
+    queries = make_queries(args.queries, rng, vocabulary, weights)
+    # primera pasada en frio (incluye ordenar terminos comunes), la segunda ya con esos rankings listos
+    passes = {}
+    for name in ("cold", "warm"):
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, args.limit)
+            latencies.append((time.perf_counter() - started) * 1000)
+        passes[name] = summarize(latencies)
+
+    print(json.dumps({
+        "products": args.products,
+        "queries": args.queries,
+        "build_s": round(build_s, 2),
+        "upsert_ms": round(update_ms, 3),
+        **passes,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
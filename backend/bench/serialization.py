@@ -0,0 +1,101 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from schemas.productos_schemas import Product
+from schemas.schemas import User
+from services import catalog
+from services.compression import COMPRESS_MIN_BYTES, SUPPORTED, compress
+from services.responses import PRODUCT, USER, dumps
+
+# Costo de serializar las respuestas mas usadas, antes (jsonable_encoder +
+# json de la stdlib, o revalidar el modelo) y despues (orjson / TypeAdapter),
+# y bytes en la red sin comprimir, con gzip y con brotli.
+#   cd backend && python -m bench.serialization --products 50 --repeat 2000
+
+
+def sample_products(count):
+    base = catalog.SAMPLE_PRODUCTS
+    return [{**base[i % len(base)], "id": str(i + 1)} for i in range(count)]
+
+
+def sample_transaction():
+    created = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    return {
+        "buy_order": "O01HXY8J6G4M3Q2R", "session_id": "S01HXY8J6G4M3Q2R", "amount": 25500,
+        "status": "AUTHORIZED", "token": "01ab" * 16, "url": "https://webpay3gint.transbank.cl/webpayserver/initTransaction",
+        "created_at": created, "updated_at": created + timedelta(minutes=2), "reservation_id": "RES01HXY8J6G4",
+        "items": [{"product_id": str(i), "quantity": i % 3 + 1} for i in range(1, 6)],
+        "commit_response": {
+            "vci": "TSY", "amount": 25500, "status": "AUTHORIZED", "buy_order": "O01HXY8J6G4M3Q2R",
+            "session_id": "S01HXY8J6G4M3Q2R", "card_detail": {"card_number": "6623"},
+            "accounting_date": "0501", "transaction_date": "2024-05-01T16:32:10.512Z",
+            "authorization_code": "1213", "payment_type_code": "VN", "response_code": 0,
+            "installments_number": 0,
+        },
+    }
+
+
+def before_raw(content):
+    # ruta sin response_model: FastAPI recorre todo con jsonable_encoder y JSONResponse usa json.dumps
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def before_model(adapter):
+    # ruta con response_model: FastAPI valida lo que retorna la ruta y despues serializa
+    return lambda value: adapter.dump_json(adapter.validate_python(value))
+
+
+def timed(func, value, repeat):
+    func(value)  # calentamiento
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = func(value)
+    return (time.perf_counter() - started) / repeat * 1e6, body
+
+
+def wire_sizes(body: bytes) -> dict:
+    sizes = {"identity": len(body)}
+    for encoding in SUPPORTED:
+        # bajo el umbral el middleware no comprime
+        sizes[encoding] = len(compress(body, encoding)) if len(body) >= COMPRESS_MIN_BYTES else len(body)
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=50, help="productos por pagina")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    products = sample_products(args.products)
+    product = Product(**products[0])
+    user = {"id": "665f1c2e8b3e4a0012345678", "email": "vu1@example.com", "full_name": "VU 1", "google_id": None}
+    cases = {
+        "GET /products?sort=-price": (products, before_raw, dumps),
+        "GET /products/search": (products[:20], before_raw, dumps),
+        "GET /products/{barcode}": (product, before_model(PRODUCT), PRODUCT.dump_json),
+        "GET /api/transactions/{token}": (sample_transaction(), before_raw, dumps),
+        "GET /me": (user, before_raw, lambda u: USER.dump_json(User.model_construct(**u))),
+    }
+
+    report = {}
+    for route, (value, before, after) in cases.items():
+        before_us, before_body = timed(before, value, args.repeat)
+        after_us, after_body = timed(after, value, args.repeat)
+        # mismo contenido, solo cambia como se serializa
+        assert json.loads(before_body) == json.loads(after_body), route
+        report[route] = {
+            "encode_us": {"before": round(before_us, 2), "after": round(after_us, 2),
+                          "speedup": round(before_us / after_us, 1)},
+            "bytes": {"before": len(before_body), "after": wire_sizes(after_body)},
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+import uuid
+from typing import Optional
+from urllib.parse import parse_qs
+
+import httpx
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+# Servicios externos falsos para los benchmarks, montados con
+# http_clients.set_transport(nombre, httpx.MockTransport(standin.handler)).
+# Cada uno acepta una latencia simulada en segundos.
+
+
+def _b64_int(value: int) -> str:
+    raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+class WebpayStandIn:
+    """Transbank falso: crear (POST), estado (GET) y commit (PUT) por token"""
+
+    def __init__(self, latency: float = 0.005, fail_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.created = {}
+        self.results = {}
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+        path = request.url.path
+        if request.method == "POST" and path.endswith("/transactions"):
+            body = json.loads(request.content)
+            token = uuid.uuid4().hex
+            self.created[token] = body
+            return httpx.Response(200, json={"token": token, "url": "https://webpay.local/pay"})
+
+        token = path.rsplit("/", 1)[-1]
+        if token not in self.created:
+            return httpx.Response(422, json={"error_message": "Invalid token"})
+        if request.method == "PUT":
+            failed = self.rng.random() < self.fail_rate
+            self.results[token] = "FAILED" if failed else "AUTHORIZED"
+        status = self.results.get(token, "INITIALIZED")
+        return httpx.Response(200, json={
+            "status": status,
+            "amount": self.created[token]["amount"],
+            "buy_order": self.created[token]["buy_order"],
+            "response_code": 0 if status == "AUTHORIZED" else -1,
+        })
+
+
+class GoogleStandIn:
+    """OAuth de Google falso: el code "user-<n>" corresponde al usuario n.
+    Firma id_tokens RS256 con una llave propia y la publica en /oauth2/v3/certs"""
+
+    def __init__(self, latency: float = 0.02, client_id: Optional[str] = None, max_age: int = 3600):
+        self.latency = latency
+        self.client_id = client_id or os.getenv("GOOGLE_CLIENT_ID", "bench-client")
+        self.max_age = max_age
+        self.keys = {}  # kid -> llave privada (todas se publican)
+        self.signing_key = None
+        self.certs_calls = 0
+        self.rotate()
+
+    def rotate(self) -> str:
+        """Llave nueva para firmar (como cuando Google rota las suyas)"""
+        self.kid = uuid.uuid4().hex[:16]
+        private_key = self.keys[self.kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        # cargar el PEM en cada firma es lento: la llave de jose se arma una vez
+        pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                        serialization.NoEncryption())
+        self.signing_key = jwk.construct(pem, "RS256")
+        return self.kid
+
+    def jwks(self) -> dict:
+        keys = []
+        for kid, private_key in self.keys.items():
+            numbers = private_key.public_key().public_numbers()
+            keys.append({"kty": "RSA", "alg": "RS256", "use": "sig", "kid": kid,
+                         "n": _b64_int(numbers.n), "e": _b64_int(numbers.e)})
+        return {"keys": keys}
+
+    def id_token(self, code: str, access_token: str) -> str:
+        now = int(time.time())
+        claims = {"iss": "https://accounts.google.com", "aud": self.client_id, "sub": f"g-{code}",
+                  "email": f"{code}@gmail.test", "email_verified": True, "name": f"Google {code}",
+                  "iat": now, "exp": now + 3600}
+        return jwt.encode(claims, self.signing_key, algorithm="RS256", headers={"kid": self.kid}, access_token=access_token)
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+        if request.url.path == "/token":
+            code = parse_qs(request.content.decode()).get("code", [""])[0]
+            access_token = f"at-{code}"
+            return httpx.Response(200, json={"access_token": access_token, "expires_in": 3599,
+                                             "id_token": self.id_token(code, access_token)})
+        if request.url.path == "/oauth2/v3/certs":
+            self.certs_calls += 1
+            return httpx.Response(200, json=self.jwks(),
+                                  headers={"Cache-Control": f"public, max-age={self.max_age}"})
+        return httpx.Response(404, json={"error": "not_found"})
+
+
+class OpenFoodFactsStandIn:
+    """OpenFoodFacts falso: los codigos que terminan en 0 no existen"""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.calls = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        barcode = request.url.path.rsplit("/", 1)[-1].removesuffix(".json")
+        if barcode.endswith("0"):
+            return httpx.Response(200, json={"status": 0, "status_verbose": "product not found"})
+        return httpx.Response(200, json={"status": 1, "product": {
+            "product_name": f"Producto {barcode}",
+            "generic_name": "Producto de prueba",
+            "categories": "Snacks, Dulces",
+            "image_front_url": f"https://images.local/{barcode}.jpg",
+        }})
+
+
+def install(webpay: float = 0.005, google: float = 0.02, off: float = 0.05, fail_rate: float = 0.0):
+    """Conecta los tres servicios falsos a http_clients; retorna los stand-ins"""
+    from services.http_clients import http_clients
+
+    standins = {
+        "webpay": WebpayStandIn(webpay, fail_rate),
+        "google": GoogleStandIn(google),
+        "off": OpenFoodFactsStandIn(off),
+    }
+    for name, standin in standins.items():
+        http_clients.set_transport(name, httpx.MockTransport(standin.handler))
+    return standins
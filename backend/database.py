@@ -2,11 +2,15 @@ import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from urllib.parse import urlparse
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from services.metrics import mongo_listener
 
 load_dotenv()
 
 MONGODB_URL = os.getenv("DATABASE_URL", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGODB_URL)
+# el listener mide cada comando (coleccion y operacion) para /metrics
+client = AsyncIOMotorClient(MONGODB_URL, event_listeners=[mongo_listener])
 
 # Extraer el nombre de la base de datos desde la URL
 parsed = urlparse(MONGODB_URL)
@@ -20,3 +24,99 @@ db = client[db_name]
 # Helper para obtener la colección de usuarios
 async def get_user_collection():
     return db["users"]
+
+
+# Indices que necesitan las consultas de la app, por coleccion.
+# Se crean al arrancar (create_index es idempotente si ya existen igual).
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "transactions": [
+        # parcial: los documentos sin token aun (pago en creacion, o Webpay respondio
+        # sin token y quedo null) no chocan entre si; sparse si indexaria los null
+        IndexModel([("token", ASCENDING)], unique=True, name="token_unique",
+                   partialFilterExpression={"token": {"$type": "string"}}),
+        IndexModel([("buy_order", ASCENDING)], unique=True, name="buy_order_unique"),
+        IndexModel([("idempotency_key", ASCENDING)], unique=True, sparse=True, name="idempotency_key_unique"),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    ],
+    "inventory_shards": [
+        IndexModel([("product_id", ASCENDING), ("shard", ASCENDING)], name="product_shard"),
+    ],
+    "reservations": [
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+    ],
+    # Mongo borra solo las sesiones vencidas y las revocaciones que ya no afectan a ningun token
+    "sessions": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "revocations": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+}
+
+# Formas de consulta que usa la app: (coleccion, filtro, orden, donde se usa).
+# /diagnostics/indexes revisa con explain cuales no estan cubiertas por un indice.
+QUERY_SHAPES = [
+    ("users", {"email": "x"}, None, "login, register, get_current_user"),
+    ("transactions", {"token": "x"}, None, "commit_payment, get_transaction_status"),
+    ("transactions", {"buy_order": "x"}, None, "create_payment"),
+    ("transactions", {"idempotency_key": "x"}, None, "create_payment (Idempotency-Key)"),
+    ("transactions", {"status": "pending", "created_at": {"$lt": 0}}, [("created_at", ASCENDING)], "payment_reconciler"),
+    ("inventory_shards", {"product_id": "x"}, [("shard", ASCENDING)], "inventory.reserve, inventory.get_stock"),
+    ("reservations", {"status": "held", "expires_at": {"$lt": 0}}, None, "reservation_sweeper"),
+    ("revocations", {"_id": {"$gt": 0}, "expires_at": {"$gt": 0}}, None, "revocations.sync"),
+    ("products", {"category_key": "x"}, [("_id", ASCENDING)], "get_products_by_category"),
+    ("products", {"category_key": "x"}, [("price", ASCENDING), ("_id", ASCENDING)], "get_products_by_category?sort=price"),
+    ("products", {}, [("price", ASCENDING), ("_id", ASCENDING)], "get_products?sort=price"),
+]
+
+# resultado del ultimo ensure_indexes, por nombre de indice
+index_status = {}
+
+
+async def ensure_indexes():
+    """Crea los indices declarados en INDEXES; un indice que falla no impide crear el resto"""
+    for collection, models in INDEXES.items():
+        for model in models:
+            name = model.document["name"]
+            try:
+                await db[collection].create_indexes([model])
+                index_status[f"{collection}.{name}"] = "ok"
+            except PyMongoError as e:
+                # p.ej. datos duplicados antiguos que impiden un indice unico
+                index_status[f"{collection}.{name}"] = f"error: {str(e)}"
+                print(f"Error creando indice {collection}.{name}: {str(e)}")
+    return index_status
+
+
+def _plan_stages(plan):
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        yield from _plan_stages(plan.get(key))
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+async def explain_query_shapes():
+    """Para cada forma de consulta indica si el plan ganador hace COLLSCAN"""
+    report = []
+    for collection, query, sort, used_by in QUERY_SHAPES:
+        find = {"find": collection, "filter": query}
+        if sort:
+            find["sort"] = dict(sort)
+        entry = {"collection": collection, "filter": list(query), "sort": [f for f, _ in sort or []],
+                 "used_by": used_by}
+        try:
+            explain = await db.command({"explain": find, "verbosity": "queryPlanner"})
+            stages = list(_plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {})))
+            entry["stages"] = stages
+            entry["covered"] = "COLLSCAN" not in stages
+        except Exception as e:
+            entry["error"] = str(e)
+        report.append(entry)
+    return report
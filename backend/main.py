@@ -1,21 +1,87 @@
+from contextlib import asynccontextmanager
+import database
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routes import router
 from routes.productos_routes import router_productos
 from routes.webpay_routes import router as webpay_router
+from routes.diagnostics_routes import router_diagnostics, router_metrics
+from routes.analytics_routes import router_analytics
+from routes.cart_routes import router_carts
+from routes.admin_routes import router_admin
+from services import catalog
+from services.catalog_snapshot import catalog_snapshot
+from services.shared_catalog import shared_catalog_reader
+from services.http_clients import http_clients
+from services.password_hasher import password_hasher
+from services.admission import AdmissionMiddleware
+from services.compression import CompressionMiddleware
+from services.metrics import MetricsMiddleware
+from services.profiling import ProfilingMiddleware
+from services.payment_events import payment_events
+from services.reconciliation import payment_reconciler
+from services.inventory import reservation_sweeper
+from services.sessions import revocations
 
-app = FastAPI()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_clients.start()
+    reader = shared_catalog_reader()
+    if reader is not None:
+        # worker de serve.py: el catalogo lo publica el proceso constructor
+        catalog_snapshot.use_shared(reader)
+    try:
+        await database.ensure_indexes()
+        await catalog.ensure_catalog_indexes()
+        await catalog.seed_sample_products()
+        await catalog_snapshot.refresh()
+        await revocations.sync()
+    except Exception as e:
+        # sin Mongo la app igual levanta, las rutas que lo usan responderan error
+        print(f"Error preparando la base de datos: {str(e)}")
+    catalog_snapshot.start()
+    payment_events.start()
+    payment_reconciler.start()
+    reservation_sweeper.start()
+    revocations.start()
+    yield
+    await revocations.stop()
+    await reservation_sweeper.stop()
+    await payment_reconciler.stop()
+    await payment_events.stop()
+    await catalog_snapshot.stop()
+    # cerrar conexiones abiertas hacia afuera
+    await http_clients.aclose()
+    password_hasher.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# limite de concurrencia por clase de ruta (el mas interno: los 503/429 pasan por CORS y /metrics)
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],  # Permitir solo el frontend
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],
 )
+# gzip/brotli segun Accept-Encoding (dentro de las metricas: cuenta en la latencia)
+app.add_middleware(CompressionMiddleware)
+# spans de cada request, requests lentos y X-Profile
+app.add_middleware(ProfilingMiddleware)
+# latencia por ruta para /metrics (el mas externo: incluye CORS)
+app.add_middleware(MetricsMiddleware)
 
 # por ahora ningun prefix 
 app.include_router(router)
 app.include_router(router_productos)
 app.include_router(webpay_router)
+app.include_router(router_diagnostics)
+app.include_router(router_metrics)
+app.include_router(router_analytics)
+app.include_router(router_carts)
+app.include_router(router_admin)
 
@@ -0,0 +1,59 @@
+import json
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+
+from services.profiling import is_admin_token, profiler, slow_requests
+
+# Perfilado y requests lentos. Requiere el header X-Admin-Token = ADMIN_TOKEN
+# (si ADMIN_TOKEN no esta configurado, todo responde 403).
+
+
+async def require_admin(x_admin_token: str = Header(None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Acceso restringido")
+
+
+router_admin = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+MAX_PROFILE_SECONDS = 60
+
+
+def speedscope_response(session) -> Response:
+    return Response(
+        content=json.dumps(session.to_speedscope(profiler.interval)),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{session.id}.speedscope.json"'},
+    )
+
+
+#perfila todo lo que corre en el worker durante `seconds` y devuelve el archivo de speedscope
+@router_admin.post("/profile")
+async def profile_window(seconds: float = Query(5, gt=0, le=MAX_PROFILE_SECONDS)):
+    session = await profiler.profile_window(seconds)
+    return speedscope_response(session)
+
+
+#perfiles guardados (ventanas y requests con X-Profile)
+@router_admin.get("/profiles")
+async def list_profiles():
+    return [s.summary() for s in reversed(profiler.finished.values())]
+
+
+@router_admin.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    session = profiler.finished.get(profile_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return speedscope_response(session)
+
+
+#los requests mas lentos recientes, con el detalle de cada paso
+@router_admin.get("/slow-requests")
+async def get_slow_requests(limit: int = Query(20, ge=1, le=1000)):
+    return {"threshold_ms": slow_requests.threshold_ms, "requests": slow_requests.slowest()[:limit]}
+
+
+@router_admin.delete("/slow-requests")
+async def clear_slow_requests():
+    slow_requests.clear()
+    return {"message": "ok"}
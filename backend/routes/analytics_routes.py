@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from routes.admin_routes import require_admin
+from schemas.analytics_schemas import SalesReport
+from services.profiling import TracedRoute
+from services.sales_rollups import get_sales
+
+# ventas del negocio: solo con X-Admin-Token, igual que /admin
+router_analytics = APIRouter(prefix="/api/analytics", route_class=TracedRoute,
+                             dependencies=[Depends(require_admin)])
+
+# tope de buckets por consulta (~3 meses por hora)
+MAX_BUCKETS = 2500
+GRANULARITY_SECONDS = {"hour": 3600, "day": 86400}
+
+
+def to_local(moment: Optional[datetime]) -> Optional[datetime]:
+    # las transacciones se guardan con datetime.now() (hora local sin zona)
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+#ventas por hora o por dia, leidas solo de los resumenes (sales_hourly / sales_daily)
+@router_analytics.get("/sales", response_model=SalesReport)
+async def get_sales_report(
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    granularity: Literal["hour", "day"] = "day",
+):
+    to = to_local(to) or datetime.now()
+    from_ = to_local(from_) or to - timedelta(days=30)
+    if from_ >= to:
+        raise HTTPException(status_code=400, detail="'from' debe ser anterior a 'to'")
+    if (to - from_).total_seconds() / GRANULARITY_SECONDS[granularity] > MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="Rango demasiado grande para esa granularidad")
+    return await get_sales(from_, to, granularity)
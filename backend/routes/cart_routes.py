@@ -0,0 +1,70 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+
+from routes.routes import get_current_user_from_cookie
+from routes.webpay_routes import start_payment
+from schemas.cart_schemas import Cart, CartItemRequest, CartQuantityRequest, CheckoutResponse
+from services.carts import CartError, cart_store, price_cart
+from services.profiling import TracedRoute
+
+router_carts = APIRouter(prefix="/api/cart", route_class=TracedRoute)
+
+
+#carrito del usuario logeado (cache revalidado contra Mongo)
+@router_carts.get("", response_model=Cart)
+async def get_cart(current_user=Depends(get_current_user_from_cookie)):
+    return await cart_store.get(current_user.email)
+
+
+@router_carts.post("/items", response_model=Cart)
+async def add_cart_item(body: CartItemRequest, current_user=Depends(get_current_user_from_cookie)):
+    try:
+        return await cart_store.add_item(current_user.email, body.product_id, body.quantity)
+    except CartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+#fija la cantidad de una linea (0 la elimina)
+@router_carts.put("/items/{product_id}", response_model=Cart)
+async def set_cart_item(product_id: str, body: CartQuantityRequest,
+                        current_user=Depends(get_current_user_from_cookie)):
+    try:
+        return await cart_store.set_quantity(current_user.email, product_id, body.quantity)
+    except CartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router_carts.delete("/items/{product_id}", response_model=Cart)
+async def remove_cart_item(product_id: str, current_user=Depends(get_current_user_from_cookie)):
+    return await cart_store.remove_item(current_user.email, product_id)
+
+
+@router_carts.delete("", response_model=Cart)
+async def clear_cart(current_user=Depends(get_current_user_from_cookie)):
+    return await cart_store.clear(current_user.email)
+
+
+#precio calculado en el servidor con el catalogo, y de ahi al flujo normal de Webpay
+@router_carts.post("/checkout", response_model=CheckoutResponse)
+async def checkout(response: Response, current_user=Depends(get_current_user_from_cookie),
+                   idempotency_key: Optional[str] = Header(None, max_length=255)):
+    cart = await cart_store.get(current_user.email)
+    if not cart["items"]:
+        raise HTTPException(status_code=400, detail="El carrito está vacío")
+
+    lines, total, missing = await price_cart(cart["items"])
+    if missing:
+        raise HTTPException(status_code=409, detail={"error": "Productos no disponibles", "product_ids": missing})
+    if total <= 0:
+        raise HTTPException(status_code=400, detail="Monto inválido")
+
+    # start_payment reserva el stock de las lineas (409 si algun producto no alcanza)
+    payment_response, replayed = await start_payment(
+        total, idempotency_key=idempotency_key,
+        extra={"user_email": current_user.email, "items": lines},
+        items=cart["items"]
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return CheckoutResponse(**payment_response.model_dump(exclude={"error"}), amount=total, lines=lines)
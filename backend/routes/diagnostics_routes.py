@@ -0,0 +1,67 @@
+from fastapi import APIRouter, Depends, Response
+import database
+from routes.admin_routes import require_admin
+from services.admission import admission
+from services.google_auth import google_keys
+from services.http_clients import http_clients
+from services.metrics import render_metrics
+from services.reconciliation import payment_reconciler
+from services.repositories import repository_stats
+from services.sessions import revocations
+
+# rutas de diagnostico (estado interno del servicio), con X-Admin-Token igual que /admin
+router_diagnostics = APIRouter(prefix="/diagnostics", dependencies=[Depends(require_admin)])
+# /metrics va en la raiz, es donde Prometheus lo busca por defecto
+router_metrics = APIRouter()
+
+
+@router_metrics.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+#reutilizacion de conexiones por servicio externo
+@router_diagnostics.get("/http-clients")
+async def get_http_client_stats():
+    return http_clients.get_stats()
+
+
+#indices creados al arrancar y consultas que no usan indice (COLLSCAN)
+@router_diagnostics.get("/indexes")
+async def get_index_diagnostics():
+    shapes = await database.explain_query_shapes()
+    return {
+        "indexes": database.index_status,
+        "query_shapes": shapes,
+        "uncovered": [s for s in shapes if s.get("covered") is False],
+    }
+
+
+#estado del worker que reconcilia pagos pendientes
+@router_diagnostics.get("/reconciler")
+async def get_reconciler_stats():
+    return payment_reconciler.get_stats()
+
+
+#cache de llaves de Google para verificar id_tokens
+@router_diagnostics.get("/google-keys")
+async def get_google_key_stats():
+    return google_keys.get_stats()
+
+
+#revocaciones de sesiones en memoria de este worker
+@router_diagnostics.get("/revocations")
+async def get_revocation_stats():
+    return revocations.get_stats()
+
+
+#lecturas de users/transactions por metodo: llamadas y bytes traidos de Mongo
+@router_diagnostics.get("/repositories")
+async def get_repository_stats():
+    return repository_stats.get_stats()
+
+
+#limites adaptativos, colas y rechazos del control de admision por clase de ruta
+@router_diagnostics.get("/admission")
+async def get_admission_stats():
+    return admission.get_stats()
@@ -1,109 +1,100 @@
-from fastapi import APIRouter, HTTPException
-from schemas.productos_schemas import Product
-import requests
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from routes.admin_routes import require_admin
+from schemas.productos_schemas import Product, BarcodeLookupRequest, BarcodeLookupResult
+from services import catalog, inventory
+from services.catalog_snapshot import catalog_snapshot, snapshot_response
+from services.off_client import off_client
+from services.off_index import off_index
+from services.profiling import TracedRoute
+from services.responses import PRODUCT, json_response, model_response
+from services.search import search_index
+from typing import Optional
+import asyncio
+import httpx
+import os
 import re
 import random
 
-router_productos = APIRouter()
-
-# Productosde ejemplo para mostrar
-SAMPLE_PRODUCTS = [
-    {
-        "id": "1",
-        "name": "Hamburguesa Clásica",
-        "description": "Hamburguesa con carne de res, lechuga, tomate, queso y salsa especial",
-        "price": 8500,
-        "image_url": "https://images.unsplash.com/photo-1568901346375-23c9450c58e9?w=400&h=400&fit=crop",
-        "category": "Hamburguesas"
-    },
-    {
-        "id": "2",
-        "name": "Pizza Margherita",
-        "description": "Pizza tradicional con salsa de tomate, mozzarella y albahaca fresca",
-        "price": 12000,
-        "image_url": "https://images.unsplash.com/photo-1604382354936-07c5d9983bd3?w=400&h=400&fit=crop",
-        "category": "Pizzas"
-    },
-    {
-        "id": "3",
-        "name": "Ensalada César",
-        "description": "Lechuga romana, crutones, parmesano y aderezo César",
-        "price": 6500,
-        "image_url": "https://images.unsplash.com/photo-1546793665-c74683f339c1?w=400&h=400&fit=crop",
-        "category": "Ensaladas"
-    },
-    {
-        "id": "4",
-        "name": "Pasta Carbonara",
-        "description": "Pasta con salsa cremosa, panceta, huevo y queso parmesano",
-        "price": 9500,
-        "image_url": "https://images.unsplash.com/photo-1621996346565-e3dbc353d2e5?w=400&h=400&fit=crop",
-        "category": "Pastas"
-    },
-    {
-        "id": "5",
-        "name": "Sushi Roll California",
-        "description": "Roll de sushi con aguacate, pepino y cangrejo",
-        "price": 15000,
-        "image_url": "https://images.unsplash.com/photo-1579584425555-c3ce17fd4351?w=400&h=400&fit=crop",
-        "category": "Sushi"
-    },
-    {
-        "id": "6",
-        "name": "Tacos al Pastor",
-        "description": "Tacos con carne de cerdo marinada, piña y cilantro",
-        "price": 7500,
-        "image_url": "https://images.unsplash.com/photo-1565299585323-38d6b0865b47?w=400&h=400&fit=crop",
-        "category": "Tacos"
-    },
-    {
-        "id": "7",
-        "name": "Sopa de Tomate",
-        "description": "Sopa cremosa de tomate con albahaca y crutones",
-        "price": 5500,
-        "image_url": "https://images.unsplash.com/photo-1547592166-23ac45744acd?w=400&h=400&fit=crop",
-        "category": "Sopas"
-    },
-    {
-        "id": "8",
-        "name": "Tiramisú",
-        "description": "Postre italiano con café, mascarpone y cacao",
-        "price": 4500,
-        "image_url": "https://images.unsplash.com/photo-1571877227200-a0d98ea607e9?w=400&h=400&fit=crop",
-        "category": "Postres"
-    }
-]
+router_productos = APIRouter(route_class=TracedRoute)
+
+# limites para la consulta por lote de codigos de barras
+LOOKUP_CONCURRENCY = int(os.getenv("OFF_LOOKUP_CONCURRENCY", "16"))
+LOOKUP_MAX_CONCURRENCY = int(os.getenv("OFF_LOOKUP_MAX_CONCURRENCY", "64"))
+LOOKUP_ITEM_TIMEOUT = float(os.getenv("OFF_LOOKUP_ITEM_TIMEOUT", "8"))
+
+
+async def catalog_page(category, limit, cursor, sort, fields):
+    try:
+        products, next_cursor = await catalog.list_products(category, limit, cursor, sort, fields)
+    except catalog.CatalogQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # el cuerpo sigue siendo una lista; la siguiente pagina va en el header
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return json_response(products, headers=headers)
+
+def is_default_page(limit, cursor, sort, fields):
+    return limit == catalog.DEFAULT_PAGE_SIZE and cursor is None and sort == "id" and fields is None
 
 ## Rutas de productos
-@router_productos.get("/products", response_model=list[Product])
-async def get_products():
-    """lista de productos para mostrar"""
-    return [Product(**product) for product in SAMPLE_PRODUCTS]
+@router_productos.get("/products")
+async def get_products(request: Request,
+                       limit: int = Query(catalog.DEFAULT_PAGE_SIZE, ge=1, le=catalog.MAX_PAGE_SIZE),
+                       cursor: Optional[str] = None,
+                       sort: str = "id",
+                       fields: Optional[str] = None):
+    """lista de productos para mostrar, paginada por cursor (?limit=&cursor=&sort=-price&fields=name,price)"""
+    snapshot = catalog_snapshot.current
+    # la primera pagina sin parametros (la que pide el front) sale del snapshot ya serializado
+    if snapshot is not None and is_default_page(limit, cursor, sort, fields):
+        return snapshot_response(request, snapshot.products_page)
+    return await catalog_page(None, limit, cursor, sort, fields)
 
 #obtiene las categorías disponibles
 @router_productos.get("/products/categories")
-async def get_categories():
-    categories = list(set(product["category"] for product in SAMPLE_PRODUCTS))
+async def get_categories(request: Request):
+    snapshot = catalog_snapshot.current
+    if snapshot is not None:
+        return snapshot_response(request, snapshot.categories)
+    categories = await catalog.list_categories()
     return {"categories": categories}
 
+#busqueda por texto en nombre, descripcion y categoria (sin tildes, por prefijo)
+@router_productos.get("/products/search")
+async def search_products(q: str = Query(..., min_length=1, max_length=100),
+                          limit: int = Query(20, ge=1, le=100)):
+    return json_response(search_index.search(q, limit))
+
 #filtrar productos por categoría
 @router_productos.get("/products/category/{category}")
-async def get_products_by_category(category: str):
-    filtered_products = [p for p in SAMPLE_PRODUCTS if p["category"].lower() == category.lower()]
-    return [Product(**product) for product in filtered_products]
+async def get_products_by_category(category: str, request: Request,
+                                   limit: int = Query(catalog.DEFAULT_PAGE_SIZE, ge=1, le=catalog.MAX_PAGE_SIZE),
+                                   cursor: Optional[str] = None,
+                                   sort: str = "id",
+                                   fields: Optional[str] = None):
+    snapshot = catalog_snapshot.current
+    if snapshot is not None and is_default_page(limit, cursor, sort, fields):
+        encoded = snapshot.category_pages.get(category.lower(), snapshot.empty_page)
+        return snapshot_response(request, encoded)
+    return await catalog_page(category, limit, cursor, sort, fields)
+
+#contadores del cache de codigos de barras (hits, misses, coalesced...), solo administradores
+@router_productos.get("/products/cache/stats", dependencies=[Depends(require_admin)])
+async def get_barcode_cache_stats():
+    return {**off_client.get_stats(), "local_index": off_index.get_stats()}
 
 ## Funciones para consumir API externa y extrar datos de productos
-def get_product_data(barcode):
-    url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json().get("product", None)
-    else:
-        return None
+async def get_product_data(barcode):
+    # primero el indice local (dump de OpenFoodFacts), solo si no esta se consulta la API
+    product_data = off_index.get(barcode)
+    if product_data is not None:
+        return product_data
+    # async + cache compartido, ya no bloquea el event loop
+    return await off_client.get_product(barcode)
 
 #intento de obtener imagen desde API externa
 def get_image_url(product_data, image_name, resolution="400"):
-    if image_name not in product_data["images"]:
+    if image_name not in product_data.get("images", {}):
         return None
 
     base_url = "https://images.openfoodfacts.org/images/products"
@@ -124,28 +115,81 @@ def get_image_url(product_data, image_name, resolution="400"):
     return f"{base_url}/{folder_name}/{filename}"
 
 
-#intento de consumir API externa
-@router_productos.get("/products/{barcode}", response_model=Product)
-async def get_product_by_barcode(barcode: str):
-    product_data = get_product_data(barcode)
-    if not product_data:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
-
-    # Buscar imagen frontal en español, luego en inglés, si no hay, placeholder
+# Buscar imagen frontal en español, luego en inglés, si no hay, placeholder
+def resolve_image_url(product_data):
     image_url = get_image_url(product_data, "front_es", "400")
     if not image_url:
         image_url = get_image_url(product_data, "front_en", "400")
     if not image_url:
         image_url = "https://via.placeholder.com/400x400?text=No+Image"
+    return image_url
 
+#arma el Product a partir de los datos de OpenFoodFacts
+def build_product(barcode, product_data):
     # Generar precio random
     random_price = random.randint(5000, 30000)
 
-    product = Product(
+    return Product(
         id=barcode,
         name=product_data.get("product_name", "Nombre desconocido"),
         description=product_data.get("generic_name", "Sin descripción"),
         price=random_price,
-        image_url=image_url
+        image_url=resolve_image_url(product_data),
+        category=product_data.get("categories", "").split(",")[0].strip() or "Sin categoría"
     )
-    return product
+
+
+#stock disponible (sin contar lo reservado por pagos en curso)
+@router_productos.get("/products/{product_id}/stock")
+async def get_product_stock(product_id: str):
+    stock = await inventory.get_stock(product_id)
+    if stock is None:
+        raise HTTPException(status_code=404, detail="Producto sin control de stock")
+    return {"product_id": product_id, "available": stock["available"]}
+
+
+#intento de consumir API externa
+@router_productos.get("/products/{barcode}", response_model=Product)
+async def get_product_by_barcode(barcode: str):
+    try:
+        product_data = await get_product_data(barcode)
+    except httpx.HTTPError:
+        raise HTTPException(status_code=502, detail="Error consultando OpenFoodFacts")
+    if not product_data:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return model_response(PRODUCT, build_product(barcode, product_data))
+
+
+async def lookup_one(barcode, semaphore, timeout):
+    async with semaphore:
+        try:
+            product_data = await asyncio.wait_for(get_product_data(barcode), timeout)
+        except asyncio.TimeoutError:
+            return BarcodeLookupResult(barcode=barcode, ok=False, error="timeout")
+        except httpx.HTTPError:
+            return BarcodeLookupResult(barcode=barcode, ok=False, error="upstream_error")
+    if not product_data:
+        return BarcodeLookupResult(barcode=barcode, ok=False, error="not_found")
+    return BarcodeLookupResult(barcode=barcode, ok=True, product=build_product(barcode, product_data))
+
+#consulta por lote (pallets), responde NDJSON a medida que va terminando cada codigo
+@router_productos.post("/products/lookup")
+async def lookup_products(body: BarcodeLookupRequest):
+    concurrency = min(body.concurrency or LOOKUP_CONCURRENCY, LOOKUP_MAX_CONCURRENCY)
+    timeout = body.timeout or LOOKUP_ITEM_TIMEOUT
+    semaphore = asyncio.Semaphore(concurrency)
+    # codigos repetidos se resuelven una sola vez
+    barcodes = list(dict.fromkeys(body.barcodes))
+
+    async def stream():
+        tasks = [asyncio.ensure_future(lookup_one(b, semaphore, timeout)) for b in barcodes]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield result.model_dump_json() + "\n"
+        finally:
+            # si el cliente corta la conexion no seguimos consultando
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -8,14 +8,22 @@ from jose import jwt, JWTError
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import Optional
 import os
-from passlib.context import CryptContext
 from bson import ObjectId
-import httpx
+from pymongo.errors import DuplicateKeyError
 from urllib.parse import urlencode
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
+from services.google_auth import GoogleTokenError, verify_id_token
+from services.http_clients import http_clients
+from services.password_hasher import HasherBusy, password_hasher
+from services.profiling import TracedRoute, span
+from services.repositories import UserProfile, users
+from services.responses import USER, model_response
+from services.sessions import (ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, SessionError,
+                               revocations, session_store, utcnow)
+from services.user_cache import user_cache
 
 # Cargar variables de entorno del archivo .env
 load_dotenv()
@@ -24,8 +32,7 @@ load_dotenv()
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "secret")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30  # Token expira en 30 minutos
-REFRESH_TOKEN_EXPIRE_DAYS = 7  # Refresh token dura 7 días
+# la duracion de los tokens se configura en services/sessions.py
 
 # Google OAuth config
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
@@ -33,19 +40,31 @@ GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI")
 
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 async def get_user_collection():
     return database.db["users"]
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+hasher_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Servidor ocupado, intenta nuevamente",
+    headers={"Retry-After": "1"},
+)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# bcrypt corre en el pool de password_hasher, no en el event loop
+async def verify_password_and_update(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except HasherBusy:
+        raise hasher_busy_exception
+
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HasherBusy:
+        raise hasher_busy_exception
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -64,77 +83,76 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire})
+    # "type" evita que un refresh token se use como access token
+    to_encode.update({"exp": expire, "type": "refresh"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), user_collection=Depends(get_user_collection)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = await user_collection.find_one({"email": email})
-    if user is None:
-        raise credentials_exception
-    user["id"] = str(user["_id"])
-    return user
+async def issue_tokens(email: str):
+    """Login nuevo: crea la sesion y retorna (access_token, refresh_token)"""
+    sid, jti, expires_at = await session_store.create(email)
+    access_token = create_access_token({"sub": email, "sid": sid})
+    refresh_token = create_refresh_token({"sub": email, "sid": sid, "jti": jti},
+                                         expires_delta=expires_at - utcnow())
+    return access_token, refresh_token
 
-# Nueva función para extraer el JWT desde la cookie
-async def get_current_user_from_cookie(access_token: str = Cookie(None), user_collection=Depends(get_user_collection)):
+async def resolve_user_from_token(token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    if not access_token:
+    if not token:
         raise credentials_exception
     try:
-        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
+        # decode memoizado y usuario cacheado: /me repetido no vuelve a Mongo
+        with span("jwt_decode"):
+            payload = user_cache.decode_token(token, SECRET_KEY, ALGORITHM)
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or payload.get("type") == "refresh":
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = await user_collection.find_one({"email": email})
+    # logout / robo detectado: revision en memoria, sin ir a Mongo
+    sid = payload.get("sid")
+    if sid is not None and revocations.is_revoked(sid):
+        raise credentials_exception
+    with span("user_lookup"):
+        user = await user_cache.get_user(email)
     if user is None:
         raise credentials_exception
-    user["id"] = str(user["_id"])
     return user
 
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserProfile:
+    return await resolve_user_from_token(token)
+
+# Nueva función para extraer el JWT desde la cookie
+async def get_current_user_from_cookie(access_token: str = Cookie(None)) -> UserProfile:
+    return await resolve_user_from_token(access_token)
+
 
 @router.post("/register", response_model=schemas.User)
 async def register(user: schemas.UserCreate, user_collection=Depends(get_user_collection)):
-    existing = await user_collection.find_one({"email": user.email})
-    if existing:
+    if await users.exists(user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_doc = {
         "email": user.email,
         "hashed_password": hashed_password,
         "full_name": user.full_name,
         "google_id": None
     }
-    result = await user_collection.insert_one(user_doc)
+    try:
+        result = await user_collection.insert_one(user_doc)
+    except DuplicateKeyError:
+        # dos registros simultaneos con el mismo email: el indice unico deja pasar solo uno
+        raise HTTPException(status_code=400, detail="Email already registered")
+    user_cache.invalidate(user.email)
     user_doc["id"] = str(result.inserted_id)
-    return schemas.User(**user_doc)
+    return model_response(USER, schemas.User(**user_doc))
 
-# Reemplazar el endpoint de login para usar cookies HttpOnly
-@router.post("/login")
-async def login(response: Response, form_data: OAuth2PasswordRequestForm = Depends(), user_collection=Depends(get_user_collection)):
-    user = await user_collection.find_one({"email": form_data.username})
-    if not user or not verify_password(form_data.password, user.get("hashed_password", "")):
-        raise HTTPException(status_code=400, detail="Incorrect email or password")
-    access_token = create_access_token({"sub": user["email"]})
-    refresh_token = create_refresh_token({"sub": user["email"]})
-    # Setea el JWT en una cookie HttpOnly
+# Setea los JWT en cookies HttpOnly
+def set_auth_cookies(response: Response, access_token: str, refresh_token: str):
     response.set_cookie(
         key="access_token",
         value=access_token,
@@ -149,6 +167,22 @@ async def login(response: Response, form_data: OAuth2PasswordRequestForm = Depen
         secure=False,  # Cambiar esto a True en producción con HTTPS
         samesite="lax"
     )
+
+# Reemplazar el endpoint de login para usar cookies HttpOnly
+@router.post("/login")
+async def login(response: Response, form_data: OAuth2PasswordRequestForm = Depends(), user_collection=Depends(get_user_collection)):
+    user = await users.find_credentials(form_data.username)
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect email or password")
+    valid, new_hash = await verify_password_and_update(form_data.password, user.hashed_password)
+    if not valid:
+        raise HTTPException(status_code=400, detail="Incorrect email or password")
+    if new_hash:
+        # cambio BCRYPT_ROUNDS: guardar el hash con el costo nuevo
+        await user_collection.update_one({"_id": user.id}, {"$set": {"hashed_password": new_hash}})
+        user_cache.invalidate(user.email)
+    access_token, refresh_token = await issue_tokens(user.email)
+    set_auth_cookies(response, access_token, refresh_token)
     return {"message": "Login exitoso"}
 
 @router.get("/auth/google")
@@ -169,7 +203,7 @@ async def google_auth():
     return {"auth_url": auth_url}
 
 @router.get("/auth/google/callback")
-async def google_callback(code: str, user_collection=Depends(get_user_collection)):
+async def google_callback(code: str):
     # Callback de Google OAuth
     if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
         raise HTTPException(status_code=500, detail="Google OAuth not configured")
@@ -184,69 +218,52 @@ async def google_callback(code: str, user_collection=Depends(get_user_collection
         "redirect_uri": GOOGLE_REDIRECT_URI
     }
     
-    async with httpx.AsyncClient() as client:
-        token_response = await client.post(token_url, data=token_data)
-        token_info = token_response.json()
-        
-        if "error" in token_info:
-            raise HTTPException(status_code=400, detail=f"Token error: {token_info['error']}")
-        
-        access_token = token_info["access_token"]
-        
-        # Obtener información del usuario
-        user_info_url = "https://www.googleapis.com/oauth2/v2/userinfo"
-        headers = {"Authorization": f"Bearer {access_token}"}
-        user_response = await client.get(user_info_url, headers=headers)
-        user_info = user_response.json()
-        
-        # Buscar o crear usuario
-        existing_user = await user_collection.find_one({"email": user_info["email"]})
-        
-        if existing_user:
-            # Usuario existe, actualizar google_id si es necesario
-            if not existing_user.get("google_id"):
-                await user_collection.update_one(
-                    {"email": user_info["email"]},
-                    {"$set": {"google_id": user_info["id"]}}
-                )
-            user_id = str(existing_user["_id"])
-        else:
-            # Crear nuevo usuario
-            new_user = {
-                "email": user_info["email"],
-                "full_name": user_info.get("name", ""),
-                "google_id": user_info["id"],
-                "hashed_password": None  # Usuario de Google no tiene password
-            }
-            result = await user_collection.insert_one(new_user)
-            user_id = str(result.inserted_id)
-        
-        # Crear JWT token
-        jwt_token = create_access_token({"sub": user_info["email"]})
-        refresh_token = create_refresh_token({"sub": user_info["email"]})
-        
-        frontend_url = "http://localhost:3000/auth/callback"
-        
-        user_data = {
-            "id": user_id,
-            "email": user_info["email"],
-            "full_name": user_info.get("name", ""),
-            "google_id": user_info["id"]
-        }
-        params = {
-            "access_token": jwt_token,
-            "refresh_token": refresh_token,
-            "user": urllib.parse.quote(json.dumps(user_data))
-        }
-        redirect_url = f"{frontend_url}?access_token={params['access_token']}&refresh_token={params['refresh_token']}&user={params['user']}"
-        return RedirectResponse(redirect_url)
+    # pool compartido hacia Google (el codigo es de un solo uso, no se reintenta)
+    token_response = await http_clients.request("google", "POST", token_url, data=token_data)
+    token_info = token_response.json()
+    
+    if "error" in token_info:
+        raise HTTPException(status_code=400, detail=f"Token error: {token_info['error']}")
+    
+    # el id_token se verifica localmente con las llaves de Google (sin llamar a /userinfo)
+    try:
+        with span("google_id_token"):
+            claims = await verify_id_token(token_info.get("id_token"), GOOGLE_CLIENT_ID,
+                                           token_info.get("access_token"))
+    except GoogleTokenError as e:
+        raise HTTPException(status_code=400, detail=f"Token error: {str(e)}")
+    email = claims["email"]
+
+    # Buscar o crear usuario en una sola operacion: si existe solo se completa el
+    # google_id que falte, si no existe se crea (sin password)
+    user = await users.upsert_google(email, claims["sub"], claims.get("name", ""))
+    user_cache.invalidate(email)
+    
+    # Crear JWT token
+    jwt_token, refresh_token = await issue_tokens(email)
+    
+    frontend_url = "http://localhost:3000/auth/callback"
+    
+    user_data = {
+        "id": user.id,
+        "email": email,
+        "full_name": user.full_name or "",
+        "google_id": user.google_id
+    }
+    params = {
+        "access_token": jwt_token,
+        "refresh_token": refresh_token,
+        "user": urllib.parse.quote(json.dumps(user_data))
+    }
+    redirect_url = f"{frontend_url}?access_token={params['access_token']}&refresh_token={params['refresh_token']}&user={params['user']}"
+    return RedirectResponse(redirect_url)
 
 
 
 # Endpoint para refrescar el token, hay como dos token, uno de acceso y otro de refresco(este dura mas) y ese se pasa aqui
 # para verificar que el usuario sigue logueado y se le genera un nuevo token de acceso en caso de que se alla salido o acabado
 @router.post("/refresh")
-async def refresh_token_endpoint(body: schemas.RefreshTokenRequest, user_collection=Depends(get_user_collection)):
+async def refresh_token_endpoint(body: schemas.RefreshTokenRequest, response: Response):
     refresh_token = body.refresh_token
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -255,30 +272,51 @@ async def refresh_token_endpoint(body: schemas.RefreshTokenRequest, user_collect
     )
     try:
         payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = await user_collection.find_one({"email": email})
-    if user is None:
+    sid, jti = payload.get("sid"), payload.get("jti")
+    # los refresh tokens sin sesion (anteriores a la rotacion) ya no se aceptan
+    if payload.get("type") != "refresh" or not sid or not jti:
+        raise credentials_exception
+    try:
+        # cada refresh token sirve una sola vez; reusarlo revoca la sesion
+        email, new_jti, expires_at = await session_store.rotate(sid, jti)
+    except SessionError:
+        raise credentials_exception
+    if await user_cache.get_user(email) is None:
         raise credentials_exception
-    access_token = create_access_token({"sub": email})
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = create_access_token({"sub": email, "sid": sid})
+    new_refresh_token = create_refresh_token({"sub": email, "sid": sid, "jti": new_jti},
+                                             expires_delta=expires_at - utcnow())
+    set_auth_cookies(response, access_token, new_refresh_token)
+    return {"access_token": access_token, "refresh_token": new_refresh_token, "token_type": "bearer"}
 
 
 # Modificar el endpoint /me para usar la cookie
 @router.get("/me")
-async def read_users_me(current_user=Depends(get_current_user_from_cookie)):
-    return {
-        "id": current_user["id"],
-        "email": current_user["email"],
-        "full_name": current_user.get("full_name"),
-        "google_id": current_user.get("google_id")
-    }
+async def read_users_me(current_user: UserProfile = Depends(get_current_user_from_cookie)):
+    # el usuario viene de nuestra base: se arma el modelo sin volver a validarlo
+    return model_response(USER, schemas.User.model_construct(
+        id=current_user.id,
+        email=current_user.email,
+        full_name=current_user.full_name,
+        google_id=current_user.google_id
+    ))
 
 @router.post("/logout")
-async def logout(response: Response):
+async def logout(response: Response, access_token: str = Cookie(None), refresh_token: str = Cookie(None)):
+    # se cierra la sesion en el servidor: el refresh token y los access tokens emitidos dejan de servir
+    for token in (refresh_token, access_token):
+        if not token:
+            continue
+        try:
+            # un access token vencido igual identifica la sesion a cerrar
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+        except JWTError:
+            continue
+        if payload.get("sid"):
+            await session_store.revoke(payload["sid"], "logout")
+            break
     response.delete_cookie(key="access_token")
     response.delete_cookie(key="refresh_token")
     return {"message": "Sesión cerrada"}
@@ -1,40 +1,46 @@
 import os
 import json
+import asyncio
 import hmac
 import hashlib
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import APIRouter, HTTPException, Request, Response
-from pydantic import BaseModel
-import httpx
-from database import db
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pymongo.errors import DuplicateKeyError
+import database
+from schemas.webpay_schemas import PaymentRequest, PaymentResponse
+from services import inventory
+from services.carts import cart_store
+from services.http_clients import http_clients
+from services.order_ids import new_buy_order, new_session_id
+from services.profiling import TracedRoute
+from services.repositories import transactions
+from services.responses import PAYMENT_RESPONSE, json_response, model_response
+from services.payment_events import STATUS_PROJECTION, is_final, payment_events, status_payload
+from services.sales_rollups import record_sale
+from services.webpay import WEBPAY_CONFIG, webpay_headers
 from dotenv import load_dotenv
 
 # Cargar variables de entorno del archivo .env
 load_dotenv()
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
-# Configuración de WebPay
-WEBPAY_CONFIG = {
-    "commerce_code": os.getenv("WEBPAY_COMMERCE_CODE", "597055555532"),
-    "api_key": os.getenv("WEBPAY_API_KEY", "579B532A7440BB0C9079DED94D31EA1615BACEB56610332264630D42D0A36B1C"),
-    "base_url": "https://webpay3gint.transbank.cl" if os.getenv("WEBPAY_ENVIRONMENT") != "LIVE" else "https://webpay3g.transbank.cl"
-}
+# SSE: cada cuanto se manda un comentario para mantener viva la conexion, y cuanto dura como maximo
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_SECONDS = 600
 
+# cuanto espera un request repetido (misma Idempotency-Key) a que termine el original
+IDEMPOTENCY_WAIT_ATTEMPTS = 50
+IDEMPOTENCY_WAIT_INTERVAL = 0.1
+# un registro "creating" mas viejo que esto es de un intento que murio (caida del proceso):
+# la misma Idempotency-Key puede tomarlo y reintentar
+IDEMPOTENCY_CREATING_TIMEOUT = float(os.getenv("IDEMPOTENCY_CREATING_TIMEOUT", "60"))
+# reintentos de insert tras liberar la llave; mas alla algo anda mal y se responde 409
+IDEMPOTENCY_INSERT_ATTEMPTS = 3
 
-## modelos que debo mover luego a la carpeta
-class PaymentRequest(BaseModel):
-    amount: int
-    buy_order: Optional[str] = None
-    session_id: Optional[str] = None
-
-class PaymentResponse(BaseModel):
-    success: bool
-    payment_url: Optional[str] = None
-    token: Optional[str] = None
-    error: Optional[str] = None
 
 def create_hmac_signature(message: str, secret_key: str) -> str:
     """Crear firma HMAC para WebPay"""
@@ -46,71 +52,171 @@ def create_hmac_signature(message: str, secret_key: str) -> str:
     return base64.b64encode(signature).decode('utf-8')
 
 
+async def wait_for_idempotent_payment(idempotency_key: str, amount: int) -> Optional[PaymentResponse]:
+    """Otro request con la misma Idempotency-Key ya reclamo el pago: devolver su respuesta"""
+    for _ in range(IDEMPOTENCY_WAIT_ATTEMPTS):
+        existing = await transactions.find_idempotent(idempotency_key)
+        if existing is None:
+            # el otro intento fallo y libero la llave
+            return None
+        if existing.amount != amount:
+            raise HTTPException(status_code=422, detail="Idempotency-Key ya usada con otro monto")
+        if existing.payment_response:
+            return PaymentResponse(**existing.payment_response)
+        if existing.status == "creating" and existing.created_at is not None \
+                and existing.created_at < datetime.now() - timedelta(seconds=IDEMPOTENCY_CREATING_TIMEOUT):
+            # el intento original quedo a medias: se borra (si nadie lo hizo antes) y se reintenta
+            await database.db["transactions"].delete_one(
+                {"_id": existing.id, "status": "creating", "created_at": existing.created_at})
+            return None
+        await asyncio.sleep(IDEMPOTENCY_WAIT_INTERVAL)
+    raise HTTPException(status_code=409, detail="Pago en proceso, reintenta en unos segundos",
+                        headers={"Retry-After": "1"})
+
+
+async def is_idempotent_conflict(error: DuplicateKeyError, buy_order: str,
+                                 idempotency_key: Optional[str]) -> bool:
+    """True si el choque es con un pago de la misma Idempotency-Key (hay que esperarlo o repetirlo)"""
+    if not idempotency_key:
+        return False
+    key_pattern = (error.details or {}).get("keyPattern", {})
+    if "idempotency_key" in key_pattern:
+        return True
+    if "buy_order" in key_pattern:
+        # reintento que repite buy_order y llave: Mongo puede reportar cualquiera de los dos indices
+        existing = await database.db["transactions"].find_one({"buy_order": buy_order}, {"idempotency_key": 1})
+        return existing is not None and existing.get("idempotency_key") == idempotency_key
+    return False
+
+
+async def start_payment(amount: int, buy_order: Optional[str] = None, session_id: Optional[str] = None,
+                        idempotency_key: Optional[str] = None, extra: Optional[dict] = None,
+                        items: Optional[list] = None):
+    """Crea la transaccion en Webpay y la registra; retorna (PaymentResponse, repetida).
+
+    Si vienen `items` ([{product_id, quantity}]) se reserva su stock mientras dura el pago.
+    """
+    # Generar datos de la transacción (ids unicos sin ir a la BD)
+    buy_order = buy_order or new_buy_order()
+    session_id = session_id or new_session_id()
+
+    # El stock se reserva antes que nada: si esta agotado se responde sin tocar transactions
+    reservation_id = None
+    if items:
+        try:
+            reservation_id = await inventory.reserve(items, buy_order=buy_order)
+        except inventory.OutOfStock as e:
+            raise HTTPException(status_code=409, detail={"error": str(e), "product_id": e.product_id})
+
+    async def release_stock():
+        if reservation_id:
+            await inventory.release(reservation_id, reason="payment not created")
+
+    # Se registra antes de llamar a Webpay: los indices unicos de buy_order e
+    # idempotency_key impiden crear dos veces la misma transaccion
+    transaction_record = {
+        "buy_order": buy_order,
+        "session_id": session_id,
+        "amount": amount,
+        "status": "creating",
+        "created_at": datetime.now(),
+        **(extra or {})
+    }
+    if idempotency_key:
+        transaction_record["idempotency_key"] = idempotency_key
+    if reservation_id:
+        transaction_record["reservation_id"] = reservation_id
+    try:
+        for _ in range(IDEMPOTENCY_INSERT_ATTEMPTS):
+            try:
+                result = await database.db["transactions"].insert_one(transaction_record)
+                break
+            except DuplicateKeyError as e:
+                # solo la Idempotency-Key se espera; buy_order (u otro indice) ajeno es un conflicto
+                if not await is_idempotent_conflict(e, buy_order, idempotency_key):
+                    raise HTTPException(status_code=409, detail="buy_order duplicado")
+                replay = await wait_for_idempotent_payment(idempotency_key, amount)
+                if replay is not None:
+                    # el pago original ya tiene su propia reserva
+                    await release_stock()
+                    return replay, True
+                transaction_record.pop("_id", None)
+        else:
+            raise HTTPException(status_code=409, detail="Pago en proceso, reintenta en unos segundos",
+                                headers={"Retry-After": "1"})
+    except BaseException:
+        await release_stock()
+        raise
+
+    async def abort():
+        # liberar buy_order / Idempotency-Key (y el stock) para que el cliente pueda reintentar
+        await database.db["transactions"].delete_one({"_id": result.inserted_id})
+        await release_stock()
+
+    # URL de retorno (debe ser una ruta de tu frontend siosi)
+    return_url = f"{os.getenv('FRONTEND_URL', 'http://localhost:3000')}/payment-result"
+
+    # Datos de la transacción
+    transaction_data = {
+        "buy_order": buy_order,
+        "session_id": session_id,
+        "amount": amount,
+        "return_url": return_url
+    }
+
+    # URL de la API de WebPay
+    url = f"{WEBPAY_CONFIG['base_url']}/rswebpaytransaction/api/webpay/v1.2/transactions"
+
+    try:
+        # Realizar petición a WebPay (pool compartido, sin reintentos: crear no es idempotente)
+        response = await http_clients.request("webpay", "POST", url, json=transaction_data, headers=webpay_headers())
+    except BaseException:
+        await abort()
+        raise
+
+    if response.status_code != 200:
+        await abort()
+        error_data = response.json() if response.content else {"error": "Unknown error"}
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Error en WebPay: {error_data}"
+        )
+
+    response_data = response.json()
+    payment_response = PaymentResponse(
+        success=True,
+        payment_url=response_data.get("url"),
+        token=response_data.get("token")
+    )
+    # Guardar información de la transacción en la base de datos
+    await database.db["transactions"].update_one(
+        {"_id": result.inserted_id},
+        {"$set": {
+            "token": response_data.get("token"),
+            "status": "pending",
+            "webpay_response": response_data,
+            "payment_response": payment_response.model_dump()
+        }}
+    )
+    return payment_response, False
+
+
 # inicia el proceso de pago
 @router.post("/api/create-payment", response_model=PaymentResponse)
-async def create_payment(request: PaymentRequest):
+async def create_payment(request: PaymentRequest,
+                         idempotency_key: Optional[str] = Header(None, max_length=255)):
 
     try:
         # Validación básica
         if not request.amount or request.amount <= 0:
             raise HTTPException(status_code=400, detail="Monto inválido")
 
-        # Generar datos de la transacción
-        buy_order = request.buy_order or f"ORDER{int(datetime.now().timestamp())}"
-        session_id = request.session_id or f"SESS{int(datetime.now().timestamp())}"
-        
-        # URL de retorno (debe ser una ruta de tu frontend siosi)
-        return_url = f"{os.getenv('FRONTEND_URL', 'http://localhost:3000')}/payment-result"
-
-        # Datos de la transacción
-        transaction_data = {
-            "buy_order": buy_order,
-            "session_id": session_id,
-            "amount": request.amount,
-            "return_url": return_url
-        }
-
-        # URL de la API de WebPay
-        url = f"{WEBPAY_CONFIG['base_url']}/rswebpaytransaction/api/webpay/v1.2/transactions"
-        
-        # Headers requeridos
-        headers = {
-            "Tbk-Api-Key-Id": WEBPAY_CONFIG["commerce_code"],
-            "Tbk-Api-Key-Secret": WEBPAY_CONFIG["api_key"],
-            "Content-Type": "application/json"
-        }
-
-        # Realizar petición a WebPay
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=transaction_data, headers=headers)
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                
-                # Guardar información de la transacción en la base de datos
-                transaction_record = {
-                    "buy_order": buy_order,
-                    "session_id": session_id,
-                    "amount": request.amount,
-                    "token": response_data.get("token"),
-                    "status": "pending",
-                    "created_at": datetime.now(),
-                    "webpay_response": response_data
-                }
-                
-                await db["transactions"].insert_one(transaction_record)
-                
-                return PaymentResponse(
-                    success=True,
-                    payment_url=response_data.get("url"),
-                    token=response_data.get("token")
-                )
-            else:
-                error_data = response.json() if response.content else {"error": "Unknown error"}
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Error en WebPay: {error_data}"
-                )
+        payment_response, replayed = await start_payment(
+            request.amount, request.buy_order, request.session_id, idempotency_key
+        )
+        # misma Idempotency-Key: se devuelve la respuesta original sin llamar a Webpay
+        headers = {"Idempotent-Replayed": "true"} if replayed else None
+        return model_response(PAYMENT_RESPONSE, payment_response, headers=headers)
 
     except HTTPException:
         raise
@@ -137,67 +243,66 @@ async def commit_payment(request: Request):
         # URL para consultar el estado de la transacción
         url = f"{WEBPAY_CONFIG['base_url']}/rswebpaytransaction/api/webpay/v1.2/transactions/{token_ws}"
         
-        headers = {
-            "Tbk-Api-Key-Id": WEBPAY_CONFIG["commerce_code"],
-            "Tbk-Api-Key-Secret": WEBPAY_CONFIG["api_key"],
-            "Content-Type": "application/json"
-        }
-
-        # Consultar estado de la transacción
-        async with httpx.AsyncClient() as client:
-            response = await client.put(url, headers=headers)
+        # Confirmar la transacción (pool compartido; sin reintentos automáticos, el commit no es idempotente)
+        response = await http_clients.request("webpay", "PUT", url, headers=webpay_headers())
+        
+        if response.status_code == 200:
+            transaction_data = response.json()
             
-            if response.status_code == 200:
-                transaction_data = response.json()
-                
-                # Actualizar transacción en la base de datos
-                await db["transactions"].update_one(
-                    {"token": token_ws},
-                    {
-                        "$set": {
-                            "status": transaction_data.get("status"),
-                            "response_code": transaction_data.get("response_code"),
-                            "response_description": transaction_data.get("response_description"),
-                            "updated_at": datetime.now(),
-                            "commit_response": transaction_data
-                        }
-                    }
+            # Actualizar transacción en la base de datos
+            update = {
+                "status": transaction_data.get("status"),
+                "response_code": transaction_data.get("response_code"),
+                "response_description": transaction_data.get("response_description"),
+                "updated_at": datetime.now()
+            }
+            previous = await transactions.record_commit(
+                token_ws, update, transaction_data, projection={**STATUS_PROJECTION, "reservation_id": 1, "user_email": 1, "created_at": 1}
+            )
+            current = {**(previous or {"token": token_ws}), **update}
+            # avisar al navegador que esta escuchando /events
+            payment_events.publish(token_ws, status_payload(current))
+            # sumar a los resumenes de ventas solo la primera vez que queda en estado final
+            if previous is not None and not is_final(previous):
+                await record_sale(current)
+                # AUTHORIZED confirma el stock reservado, cualquier otro estado final lo devuelve
+                await inventory.settle(current)
+                await cart_store.clear_paid(current)
+            
+            # Redirigir según el resultado
+            if transaction_data.get("status") == "AUTHORIZED":
+                return Response(
+                    content=f"""
+                    <html>
+                    <head><title>Pago Exitoso</title></head>
+                    <body>
+                    <script>
+                        window.location.href = '{os.getenv("FRONTEND_URL", "http://localhost:3000")}/payment-result?status=success&token={token_ws}';
+                    </script>
+                    </body>
+                    </html>
+                    """,
+                    media_type="text/html"
                 )
-                
-                # Redirigir según el resultado
-                if transaction_data.get("status") == "AUTHORIZED":
-                    return Response(
-                        content=f"""
-                        <html>
-                        <head><title>Pago Exitoso</title></head>
-                        <body>
-                        <script>
-                            window.location.href = '{os.getenv("FRONTEND_URL", "http://localhost:3000")}/payment-result?status=success&token={token_ws}';
-                        </script>
-                        </body>
-                        </html>
-                        """,
-                        media_type="text/html"
-                    )
-                else:
-                    return Response(
-                        content=f"""
-                        <html>
-                        <head><title>Pago Fallido</title></head>
-                        <body>
-                        <script>
-                            window.location.href = '{os.getenv("FRONTEND_URL", "http://localhost:3000")}/payment-result?status=failure&token={token_ws}';
-                        </script>
-                        </body>
-                        </html>
-                        """,
-                        media_type="text/html"
-                    )
             else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Error al consultar estado de la transacción"
+                return Response(
+                    content=f"""
+                    <html>
+                    <head><title>Pago Fallido</title></head>
+                    <body>
+                    <script>
+                        window.location.href = '{os.getenv("FRONTEND_URL", "http://localhost:3000")}/payment-result?status=failure&token={token_ws}';
+                    </script>
+                    </body>
+                    </html>
+                    """,
+                    media_type="text/html"
                 )
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail="Error al consultar estado de la transacción"
+            )
 
     except HTTPException:
         raise
@@ -212,13 +317,11 @@ async def commit_payment(request: Request):
 @router.get("/api/transactions/{token}")
 async def get_transaction_status(token: str):
     try:
-        transaction = await db["transactions"].find_one({"token": token})
+        # solo el estado: sin _id, datos del comprador ni las respuestas completas de Webpay
+        transaction = await transactions.find_status(token)
         if not transaction:
             raise HTTPException(status_code=404, detail="Transacción no encontrada")
-        
-        # Remover campos sensibles
-        transaction.pop("_id", None)
-        return transaction
+        return json_response(transaction.as_dict())
         
     except HTTPException:
         raise
@@ -227,4 +330,47 @@ async def get_transaction_status(token: str):
         raise HTTPException(
             status_code=500,
             detail="Error interno del servidor"
-        )
\ No newline at end of file
+        )
+
+
+def sse_event(payload: dict) -> str:
+    return f"event: status\ndata: {json.dumps(payload)}\n\n"
+
+#estado del pago por Server-Sent Events: avisa apenas commit_payment actualiza la transaccion
+@router.get("/api/transactions/{token}/events")
+async def transaction_events(token: str, request: Request):
+    # suscribirse antes de leer el estado actual, asi no se pierde un cambio entre medio
+    queue = payment_events.subscribe(token)
+    try:
+        current = await transactions.find_status(token)
+    except BaseException:
+        payment_events.unsubscribe(token, queue)
+        raise
+    if not current:
+        payment_events.unsubscribe(token, queue)
+        raise HTTPException(status_code=404, detail="Transacción no encontrada")
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SSE_MAX_SECONDS
+        try:
+            payload = status_payload(current.as_dict())
+            last_status = payload["status"]
+            yield sse_event(payload)
+            while not is_final(payload) and loop.time() < deadline:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                # el mismo cambio puede llegar por publish directo y por change stream
+                if payload["status"] != last_status:
+                    last_status = payload["status"]
+                    yield sse_event(payload)
+        finally:
+            payment_events.unsubscribe(token, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,2 +1,4 @@
 from .productos_schemas import *
-from .schemas import *
\ No newline at end of file
+from .schemas import *
+from .analytics_schemas import *
+from .cart_schemas import *
\ No newline at end of file
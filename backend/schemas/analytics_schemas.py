@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+class SalesTotals(BaseModel):
+    count: int = 0
+    authorized_count: int = 0
+    authorized_amount: int = 0
+    rejected_count: int = 0
+    rejections: dict[str, int] = {}  # response_code -> cantidad
+    statuses: dict[str, int] = {}
+
+class SalesBucket(SalesTotals):
+    start: datetime
+
+class SalesReport(BaseModel):
+    granularity: Literal["hour", "day"]
+    from_: datetime = Field(..., alias="from")
+    to: datetime
+    buckets: list[SalesBucket]
+    totals: SalesTotals
@@ -0,0 +1,33 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+class CartItem(BaseModel):
+    product_id: str
+    quantity: int
+
+class Cart(BaseModel):
+    items: list[CartItem] = []
+    updated_at: Optional[datetime] = None
+
+class CartItemRequest(BaseModel):
+    product_id: str = Field(..., min_length=1, max_length=64)
+    quantity: int = Field(1, ge=1, le=99)
+
+class CartQuantityRequest(BaseModel):
+    quantity: int = Field(..., ge=0, le=99)
+
+class CheckoutLine(BaseModel):
+    product_id: str
+    name: Optional[str] = None
+    quantity: int
+    unit_price: float
+    subtotal: float
+
+class CheckoutResponse(BaseModel):
+    success: bool
+    payment_url: Optional[str] = None
+    token: Optional[str] = None
+    amount: int
+    lines: list[CheckoutLine]
@@ -1,5 +1,6 @@
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Optional
 
 class Product(BaseModel):
     id: str
@@ -7,4 +8,15 @@ class Product(BaseModel):
     description: str
     price: float
     image_url: str
-    category: str
\ No newline at end of file
+    category: str
+
+class BarcodeLookupRequest(BaseModel):
+    barcodes: list[str] = Field(..., min_length=1, max_length=1000)
+    concurrency: Optional[int] = Field(None, ge=1)
+    timeout: Optional[float] = Field(None, gt=0)
+
+class BarcodeLookupResult(BaseModel):
+    barcode: str
+    ok: bool
+    product: Optional[Product] = None
+    error: Optional[str] = None
@@ -0,0 +1,14 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+class PaymentRequest(BaseModel):
+    amount: int
+    buy_order: Optional[str] = None
+    session_id: Optional[str] = None
+
+class PaymentResponse(BaseModel):
+    success: bool
+    payment_url: Optional[str] = None
+    token: Optional[str] = None
+    error: Optional[str] = None
@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import uuid
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Arranque de produccion: N workers de uvicorn + un proceso constructor que
+# publica el snapshot del catalogo en memoria compartida. Los workers lo
+# mapean (services/shared_catalog.py) y cambian de version sin reiniciarse.
+#   cd backend && python serve.py --workers 4
+# En desarrollo sigue siendo: uvicorn main:app --reload
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+CATALOG_PUBLISH_INTERVAL = float(os.getenv("CATALOG_SNAPSHOT_CHECK_INTERVAL", "10"))
+
+
+def run_builder(name: str, interval: float, stop) -> None:
+    # Ctrl+C llega a todo el grupo de procesos: el que coordina el cierre es el padre
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from services.shared_catalog import SharedCatalogPublisher, run_publisher
+
+    publisher = SharedCatalogPublisher(name)
+    try:
+        asyncio.run(run_publisher(publisher, interval, stop))
+    finally:
+        publisher.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    # los workers heredan el nombre por la variable de entorno
+    name = f"catalog-{uuid.uuid4().hex[:8]}"
+    os.environ["CATALOG_SHM_NAME"] = name
+
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    builder = ctx.Process(target=run_builder, args=(name, CATALOG_PUBLISH_INTERVAL, stop), name="catalog-builder")
+    builder.start()
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers,
+                    proxy_headers=True, forwarded_allow_ips="*")
+    finally:
+        stop.set()
+        builder.join(timeout=10)
+        if builder.is_alive():
+            builder.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import deque
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from services.metrics import (admission_in_flight, admission_limit, admission_queue_depth,
+                              admission_queue_wait, admission_rejected)
+from services.profiling import record_span
+from services.responses import json_response
+
+load_dotenv()
+
+# Control de admision por clase de ruta.
+#
+# Cada clase (pagos, auth, servicios externos, el resto) tiene su propio
+# limite de requests en curso y una cola acotada; quien espera mas de
+# queue_timeout sale con 503 y Retry-After en vez de seguir acumulandose.
+# El limite es adaptativo (AIMD): si la latencia observada pasa la objetivo
+# de la clase se multiplica por ADMISSION_BACKOFF (como mucho una vez por
+# ventana), y si no, mientras la clase este usando su cupo, sube de a 1/limite.
+#
+# Prioridad: mientras una clase de mayor prioridad este congestionada, las de
+# prioridad menor (numero mas alto) no pasan de su limite minimo ni hacen
+# cola (429 inmediato), y cada vez que la de mayor prioridad ve latencia sobre
+# su objetivo las de menor prioridad tambien reducen su limite. Asi una rafaga
+# de /login (bcrypt) o de /products/{barcode} (OpenFoodFacts) no empuja el
+# checkout mas alla del timeout de Webpay.
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.8"))
+ADMISSION_RETRY_AFTER_MAX = int(os.getenv("ADMISSION_RETRY_AFTER_MAX", "30"))
+# una clase de mayor prioridad cuenta como congestionada hasta este tiempo despues de su ultimo request lento
+ADMISSION_CONGESTION_WINDOW = float(os.getenv("ADMISSION_CONGESTION_WINDOW", "1.0"))
+
+
+def _setting(route_class: str, key: str, default: float) -> float:
+    # ADMISSION_AUTH_LIMIT, ADMISSION_PAYMENTS_TARGET, ...
+    return float(os.getenv(f"ADMISSION_{route_class.upper()}_{key}", str(default)))
+
+
+def class_settings(route_class: str, priority: int, limit: int, min_limit: int, max_limit: int,
+                   target: float, queue_size: int, queue_timeout: float) -> dict:
+    return {
+        "priority": priority,
+        "limit": _setting(route_class, "LIMIT", limit),
+        "min_limit": _setting(route_class, "MIN_LIMIT", min_limit),
+        "max_limit": _setting(route_class, "MAX_LIMIT", max_limit),
+        "target": _setting(route_class, "TARGET", target),  # segundos
+        "queue_size": int(_setting(route_class, "QUEUE", queue_size)),
+        "queue_timeout": _setting(route_class, "QUEUE_TIMEOUT", queue_timeout),
+    }
+
+
+ROUTE_CLASSES = {
+    # incluye la llamada a Webpay: objetivo holgado y cola larga, nunca cede cupo a otra clase
+    "payments": class_settings("payments", 0, limit=32, min_limit=8, max_limit=128,
+                               target=1.5, queue_size=128, queue_timeout=5.0),
+    "default": class_settings("default", 1, limit=64, min_limit=8, max_limit=256,
+                              target=0.25, queue_size=128, queue_timeout=1.0),
+    # bcrypt: mas alla de los threads de password_hasher solo se agrega espera
+    "auth": class_settings("auth", 2, limit=8, min_limit=1, max_limit=32,
+                           target=1.0, queue_size=32, queue_timeout=2.0),
+    "external": class_settings("external", 2, limit=16, min_limit=2, max_limit=64,
+                               target=1.0, queue_size=32, queue_timeout=1.0),
+}
+
+# (patron del path, clase); el primero que calza gana, None = sin control de admision.
+# Se clasifica antes del routing, por eso son patrones y no las plantillas de las rutas.
+ROUTE_RULES = (
+    # diagnostico y administracion tienen que responder justamente cuando todo esta saturado
+    (re.compile(r"^/(metrics|diagnostics|admin|docs|redoc|openapi\.json)(/|$)"), None),
+    # streams largos (SSE, NDJSON): ocuparian un cupo todo lo que dura la conexion
+    (re.compile(r"^/api/transactions/[^/]+/events$"), None),
+    (re.compile(r"^/products/lookup$"), None),
+    (re.compile(r"^/api/(create-payment|webpay/commit|cart/checkout|transactions/[^/]+)$"), "payments"),
+    (re.compile(r"^/(login|register|refresh|auth/google)(/|$)"), "auth"),
+    (re.compile(r"^/products/(?!search$|categories$|category/|cache/)[^/]+$"), "external"),
+)
+DEFAULT_CLASS = "default"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, priority: int, limit: float, min_limit: float, max_limit: float,
+                 target: float, queue_size: int, queue_timeout: float, backoff: float = ADMISSION_BACKOFF):
+        self.name = name
+        self.priority = priority
+        self.limit = float(limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.target = target
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.in_flight = 0
+        self.latency = target / 2  # promedio movil (EWMA) en segundos, para estimar Retry-After
+        self._waiters: deque = deque()
+        self._last_decrease = 0.0
+        self._last_slow = float("-inf")
+        self._labels = (name,)
+        self.stats = {"admitted": 0, "queued": 0, "increases": 0, "decreases": 0}
+        self.rejected = {"queue_full": 0, "timeout": 0, "priority": 0}
+        self._publish()
+
+    @property
+    def capacity(self) -> int:
+        return max(1, int(self.limit))
+
+    def congested(self, now: float) -> bool:
+        return bool(self._waiters) or now - self._last_slow < ADMISSION_CONGESTION_WINDOW
+
+    def retry_after(self) -> int:
+        # lo que tardaria en vaciarse la cola actual con el limite actual
+        seconds = (len(self._waiters) + 1) * self.latency / self.capacity
+        return min(ADMISSION_RETRY_AFTER_MAX, max(1, math.ceil(seconds)))
+
+    def reject(self, status_code: int, reason: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        admission_rejected.inc((self.name, reason))
+        return AdmissionRejected(status_code, reason, self.retry_after())
+
+    def try_acquire(self) -> bool:
+        # sin saltarse a los que ya estan esperando
+        if self._waiters or self.in_flight >= self.capacity:
+            return False
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        self._publish()
+        return True
+
+    async def wait(self) -> None:
+        if len(self._waiters) >= self.queue_size:
+            raise self.reject(503, "queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        self._publish()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            raise self.reject(503, "timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # ya tenia cupo asignado pero el cliente se fue: se devuelve
+                self.release(None)
+            else:
+                self._discard(waiter)
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            admission_queue_wait.get(self.name).observe(waited)
+            record_span(f"admission wait {self.name}", waited)
+        self.stats["admitted"] += 1
+
+    def _discard(self, waiter) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._publish()
+
+    def release(self, latency: Optional[float]) -> bool:
+        """Libera el cupo; retorna True si el request fue lento (sobre la latencia objetivo)"""
+        busy = self.in_flight >= self.capacity or bool(self._waiters)
+        self.in_flight -= 1
+        slow = False
+        if latency is not None:
+            self.latency += 0.2 * (latency - self.latency)
+            now = time.monotonic()
+            if latency > self.target:
+                slow = True
+                self._last_slow = now
+                self.decrease(now)
+            elif busy and self.limit < self.max_limit:
+                # solo crece si el limite actual realmente se estaba usando
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.stats["increases"] += 1
+        self._wake()
+        return slow
+
+    def decrease(self, now: float) -> None:
+        # una vez por ventana: muchos requests lentos de la misma rafaga no derrumban el limite
+        if now - self._last_decrease < self.target or self.limit <= self.min_limit:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.stats["decreases"] += 1
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < self.capacity:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            # el cupo pasa directo al que esperaba
+            self.in_flight += 1
+            waiter.set_result(None)
+        self._publish()
+
+    def _publish(self) -> None:
+        admission_limit.set(self._labels, round(self.limit, 2))
+        admission_in_flight.set(self._labels, self.in_flight)
+        admission_queue_depth.set(self._labels, len(self._waiters))
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "rejected": dict(self.rejected),
+            "priority": self.priority,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "queue_size": self.queue_size,
+            "target_ms": round(self.target * 1000, 1),
+            "latency_ms": round(self.latency * 1000, 1),
+            "congested": self.congested(time.monotonic()),
+        }
+
+
+class AdmissionController:
+    def __init__(self, classes: dict = ROUTE_CLASSES, rules: tuple = ROUTE_RULES,
+                 enabled: bool = ADMISSION_ENABLED):
+        self.limiters = {name: AdaptiveLimiter(name, **settings) for name, settings in classes.items()}
+        self.rules = rules
+        self.enabled = enabled
+
+    def classify(self, path: str) -> Optional[AdaptiveLimiter]:
+        for pattern, route_class in self.rules:
+            if pattern.match(path):
+                return self.limiters[route_class] if route_class is not None else None
+        return self.limiters[DEFAULT_CLASS]
+
+    def _higher_priority_congested(self, limiter: AdaptiveLimiter) -> bool:
+        now = time.monotonic()
+        return any(other.priority < limiter.priority and other.congested(now)
+                   for other in self.limiters.values())
+
+    async def admit(self, limiter: AdaptiveLimiter) -> None:
+        if self._higher_priority_congested(limiter):
+            # los pagos (u otra clase mas importante) estan lentos o esperando: esta clase
+            # baja de inmediato a su minimo y no hace cola
+            if limiter.in_flight >= limiter.min_limit or not limiter.try_acquire():
+                raise limiter.reject(429, "priority")
+            return
+        if not limiter.try_acquire():
+            await limiter.wait()
+
+    def done(self, limiter: AdaptiveLimiter, latency: float) -> None:
+        if limiter.release(latency):
+            now = time.monotonic()
+            for other in self.limiters.values():
+                if other.priority > limiter.priority:
+                    other.decrease(now)
+
+    def get_stats(self) -> dict:
+        return {"enabled": self.enabled,
+                "classes": {name: limiter.get_stats() for name, limiter in self.limiters.items()}}
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI: limite de concurrencia adaptativo y cola acotada por clase de ruta"""
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        # OPTIONS: los preflight de CORS no llegan a las rutas
+        if scope["type"] != "http" or not self.controller.enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        limiter = self.controller.classify(scope["path"])
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.admit(limiter)
+        except AdmissionRejected as e:
+            response = json_response(
+                {"detail": "Servidor ocupado, intenta nuevamente", "route_class": limiter.name, "reason": e.reason},
+                status_code=e.status_code, headers={"Retry-After": str(e.retry_after)})
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.done(limiter, time.perf_counter() - started)
@@ -0,0 +1,176 @@
+import os
+from datetime import datetime
+from typing import Optional
+
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import database
+from services.cache import TTLCache
+
+load_dotenv()
+
+# Carrito en el servidor, un documento por usuario:
+#   {_id: email, items: [{product_id, quantity}], updated_at, version}
+# Cada cambio es una sola operacion atomica ($inc / $set / $push / $pull)
+# con find_one_and_update, que devuelve el carrito ya actualizado y sube
+# `version`. El cache es por proceso (serve.py corre varios workers), asi que
+# cada lectura lo revalida: find_one filtrando por version distinta solo trae
+# el documento si otro proceso lo cambio.
+
+CART_CACHE_TTL = float(os.getenv("CART_CACHE_TTL", "30"))
+CART_CACHE_SIZE = int(os.getenv("CART_CACHE_SIZE", "10000"))
+MAX_CART_LINES = int(os.getenv("MAX_CART_LINES", "100"))
+
+
+class CartError(Exception):
+    pass
+
+
+def carts_collection():
+    return database.db["carts"]
+
+
+def empty_cart() -> dict:
+    return {"items": [], "updated_at": None, "version": None}
+
+
+def _public(doc: Optional[dict]) -> dict:
+    if not doc:
+        return empty_cart()
+    return {"items": doc.get("items", []), "updated_at": doc.get("updated_at"), "version": doc.get("version")}
+
+
+class CartStore:
+    def __init__(self, ttl: float = CART_CACHE_TTL, maxsize: int = CART_CACHE_SIZE):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "writes": 0}
+
+    def _remember(self, user_id: str, doc: Optional[dict]) -> dict:
+        cart = _public(doc)
+        self._cache.set(user_id, cart)
+        return cart
+
+    async def get(self, user_id: str) -> dict:
+        found, cart = self._cache.get(user_id)
+        if not found:
+            self.stats["misses"] += 1
+            doc = await carts_collection().find_one({"_id": user_id})
+            return self._remember(user_id, doc)
+        # sin documento de vuelta = nadie lo cambio desde que se guardo en cache
+        # ($ne null tampoco calza con un carrito que no existe o sin version)
+        doc = await carts_collection().find_one({"_id": user_id, "version": {"$ne": cart["version"]}})
+        if doc is None:
+            self.stats["hits"] += 1
+            return cart
+        self.stats["stale"] += 1
+        return self._remember(user_id, doc)
+
+    async def _update(self, query: dict, update: dict, upsert: bool = False) -> Optional[dict]:
+        self.stats["writes"] += 1
+        update.setdefault("$set", {})["updated_at"] = datetime.now()
+        update.setdefault("$inc", {})["version"] = 1
+        return await carts_collection().find_one_and_update(
+            query, update, upsert=upsert, return_document=ReturnDocument.AFTER
+        )
+
+    async def _increment(self, user_id: str, product_id: str, quantity: int) -> Optional[dict]:
+        return await self._update(
+            {"_id": user_id, "items.product_id": product_id},
+            {"$inc": {"items.$.quantity": quantity}}
+        )
+
+    async def _push(self, user_id: str, product_id: str, quantity: int) -> Optional[dict]:
+        # solo si la linea no existe y queda espacio; si el filtro no calza con
+        # un carrito existente, el upsert choca con su _id
+        try:
+            return await self._update(
+                {"_id": user_id, "items.product_id": {"$ne": product_id},
+                 f"items.{MAX_CART_LINES - 1}": {"$exists": False}},
+                {"$push": {"items": {"product_id": product_id, "quantity": quantity}}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return None
+
+    async def add_item(self, user_id: str, product_id: str, quantity: int = 1) -> dict:
+        """Suma `quantity` unidades; crea la linea (y el carrito) si no existen"""
+        found, cart = self._cache.get(user_id)
+        in_cart = found and any(i["product_id"] == product_id for i in cart["items"])
+        # se intenta primero la operacion que probablemente calce, asi casi siempre es un solo write
+        attempts = (self._increment, self._push) if in_cart else (self._push, self._increment)
+        for attempt in attempts:
+            doc = await attempt(user_id, product_id, quantity)
+            if doc is not None:
+                return self._remember(user_id, doc)
+        self._cache.pop(user_id)
+        raise CartError(f"El carrito admite hasta {MAX_CART_LINES} productos distintos")
+
+    async def set_quantity(self, user_id: str, product_id: str, quantity: int) -> dict:
+        if quantity <= 0:
+            return await self.remove_item(user_id, product_id)
+        doc = await self._update(
+            {"_id": user_id, "items.product_id": product_id},
+            {"$set": {"items.$.quantity": quantity}}
+        )
+        if doc is None:
+            doc = await self._push(user_id, product_id, quantity)
+            if doc is None:
+                self._cache.pop(user_id)
+                raise CartError(f"El carrito admite hasta {MAX_CART_LINES} productos distintos")
+        return self._remember(user_id, doc)
+
+    async def remove_item(self, user_id: str, product_id: str) -> dict:
+        doc = await self._update({"_id": user_id}, {"$pull": {"items": {"product_id": product_id}}})
+        return self._remember(user_id, doc)
+
+    async def clear(self, user_id: str) -> dict:
+        doc = await self._update({"_id": user_id}, {"$set": {"items": []}})
+        return self._remember(user_id, doc)
+
+    async def clear_paid(self, transaction: dict) -> None:
+        """Vacia el carrito cuando su pago queda AUTHORIZED.
+
+        Solo si no cambio despues del checkout: lo que el usuario agrego mientras
+        pagaba no se pierde.
+        """
+        user_id = transaction.get("user_email")
+        if transaction.get("status") != "AUTHORIZED" or not user_id:
+            return
+        created_at = transaction.get("created_at")
+        query = {"_id": user_id}
+        if created_at is not None:
+            query["updated_at"] = {"$lte": created_at}
+        await self._update(query, {"$set": {"items": []}})
+        # el cache de este proceso puede tener el carrito ya pagado
+        self._cache.pop(user_id)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "cached": len(self._cache)}
+
+
+async def price_cart(items: list) -> tuple:
+    """Precios del catalogo para todas las lineas en una sola consulta.
+
+    Retorna (lineas con precio, total, ids que ya no estan en el catalogo).
+    """
+    ids = [item["product_id"] for item in items]
+    cursor = database.db["products"].find({"_id": {"$in": ids}}, {"name": 1, "price": 1})
+    prices = {doc["_id"]: doc async for doc in cursor}
+
+    lines, missing, total = [], [], 0
+    for item in items:
+        product = prices.get(item["product_id"])
+        if product is None:
+            missing.append(item["product_id"])
+            continue
+        subtotal = product["price"] * item["quantity"]
+        total += subtotal
+        lines.append({"product_id": item["product_id"], "name": product.get("name"),
+                      "quantity": item["quantity"], "unit_price": product["price"], "subtotal": subtotal})
+    # Webpay recibe montos enteros (pesos)
+    return lines, int(round(total)), missing
+
+
+cart_store = CartStore()
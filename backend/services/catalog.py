@@ -0,0 +1,253 @@
+import base64
+import json
+from typing import Optional
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+import database
+
+# Catalogo de productos guardado en MongoDB (coleccion "products").
+# El listado se pagina por cursor (keyset): el cursor guarda el ultimo valor
+# del campo de orden y el ultimo _id, asi cada pagina es una busqueda por
+# indice y no un skip que crece con el catalogo.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+PRODUCT_FIELDS = ("id", "name", "description", "price", "image_url", "category")
+# campo publico -> campo en mongo
+SORT_FIELDS = {"id": "_id", "price": "price", "name": "name"}
+
+
+class CatalogQueryError(ValueError):
+    pass
+
+
+# Productos de ejemplo, se usan para sembrar la coleccion
+SAMPLE_PRODUCTS = [
+    {
+        "id": "1",
+        "name": "Hamburguesa Clásica",
+        "description": "Hamburguesa con carne de res, lechuga, tomate, queso y salsa especial",
+        "price": 8500,
+        "image_url": "https://images.unsplash.com/photo-1568901346375-23c9450c58e9?w=400&h=400&fit=crop",
+        "category": "Hamburguesas"
+    },
+    {
+        "id": "2",
+        "name": "Pizza Margherita",
+        "description": "Pizza tradicional con salsa de tomate, mozzarella y albahaca fresca",
+        "price": 12000,
+        "image_url": "https://images.unsplash.com/photo-1604382354936-07c5d9983bd3?w=400&h=400&fit=crop",
+        "category": "Pizzas"
+    },
+    {
+        "id": "3",
+        "name": "Ensalada César",
+        "description": "Lechuga romana, crutones, parmesano y aderezo César",
+        "price": 6500,
+        "image_url": "https://images.unsplash.com/photo-1546793665-c74683f339c1?w=400&h=400&fit=crop",
+        "category": "Ensaladas"
+    },
+    {
+        "id": "4",
+        "name": "Pasta Carbonara",
+        "description": "Pasta con salsa cremosa, panceta, huevo y queso parmesano",
+        "price": 9500,
+        "image_url": "https://images.unsplash.com/photo-1621996346565-e3dbc353d2e5?w=400&h=400&fit=crop",
+        "category": "Pastas"
+    },
+    {
+        "id": "5",
+        "name": "Sushi Roll California",
+        "description": "Roll de sushi con aguacate, pepino y cangrejo",
+        "price": 15000,
+        "image_url": "https://images.unsplash.com/photo-1579584425555-c3ce17fd4351?w=400&h=400&fit=crop",
+        "category": "Sushi"
+    },
+    {
+        "id": "6",
+        "name": "Tacos al Pastor",
+        "description": "Tacos con carne de cerdo marinada, piña y cilantro",
+        "price": 7500,
+        "image_url": "https://images.unsplash.com/photo-1565299585323-38d6b0865b47?w=400&h=400&fit=crop",
+        "category": "Tacos"
+    },
+    {
+        "id": "7",
+        "name": "Sopa de Tomate",
+        "description": "Sopa cremosa de tomate con albahaca y crutones",
+        "price": 5500,
+        "image_url": "https://images.unsplash.com/photo-1547592166-23ac45744acd?w=400&h=400&fit=crop",
+        "category": "Sopas"
+    },
+    {
+        "id": "8",
+        "name": "Tiramisú",
+        "description": "Postre italiano con café, mascarpone y cacao",
+        "price": 4500,
+        "image_url": "https://images.unsplash.com/photo-1571877227200-a0d98ea607e9?w=400&h=400&fit=crop",
+        "category": "Postres"
+    }
+]
+
+def products_collection():
+    return database.db["products"]
+
+
+async def ensure_catalog_indexes():
+    col = products_collection()
+    # category_key es la categoria en minusculas (el filtro no distingue mayusculas)
+    # (category_key, _id): orden por defecto de get_products_by_category, sin sort en memoria
+    await col.create_index([("category_key", ASCENDING), ("_id", ASCENDING)])
+    await col.create_index([("category_key", ASCENDING), ("price", ASCENDING), ("_id", ASCENDING)])
+    await col.create_index([("category_key", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)])
+    await col.create_index([("price", ASCENDING), ("_id", ASCENDING)])
+    await col.create_index([("name", ASCENDING), ("_id", ASCENDING)])
+
+
+def product_to_document(product: dict) -> dict:
+    doc = {k: v for k, v in product.items() if k != "id"}
+    doc["_id"] = product["id"]
+    doc["category_key"] = product["category"].lower()
+    return doc
+
+
+def document_to_product(doc: dict) -> dict:
+    product = {"id": doc["_id"]}
+    product.update((k, v) for k, v in doc.items() if k not in ("_id", "category_key"))
+    return product
+
+
+async def upsert_products(products) -> int:
+    requests = [
+        UpdateOne({"_id": p["id"]}, {"$set": product_to_document(p)}, upsert=True)
+        for p in products
+    ]
+    if not requests:
+        return 0
+    result = await products_collection().bulk_write(requests, ordered=False)
+    changed = result.upserted_count + result.modified_count
+    if changed:
+        await bump_catalog_version()
+    return changed
+
+
+# version del catalogo: cambia con cada escritura, la usa el snapshot para saber cuando reconstruirse
+async def bump_catalog_version():
+    await database.db["catalog_meta"].update_one({"_id": "catalog"}, {"$inc": {"version": 1}}, upsert=True)
+
+
+async def get_catalog_version() -> int:
+    meta = await database.db["catalog_meta"].find_one({"_id": "catalog"})
+    return meta["version"] if meta else 0
+
+
+async def iter_all_products():
+    """Recorre todo el catalogo ordenado por id"""
+    async for doc in products_collection().find({}).sort("_id", ASCENDING):
+        yield document_to_product(doc)
+
+
+async def seed_sample_products(only_if_empty: bool = True) -> int:
+    """Carga SAMPLE_PRODUCTS en la coleccion (por defecto solo si esta vacia)"""
+    if only_if_empty and await products_collection().estimated_document_count() > 0:
+        return 0
+    return await upsert_products(SAMPLE_PRODUCTS)
+
+
+def encode_cursor(value, last_id) -> str:
+    raw = json.dumps([value, last_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, last_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise CatalogQueryError("Cursor inválido")
+    # los valores van directo al filtro: un dict o lista armado a mano seria un operador de Mongo
+    if not isinstance(value, (str, int, float, type(None))) or not isinstance(last_id, str):
+        raise CatalogQueryError("Cursor inválido")
+    return value, last_id
+
+
+def parse_sort(sort: str):
+    descending = sort.startswith("-")
+    name = sort.lstrip("-")
+    if name not in SORT_FIELDS:
+        raise CatalogQueryError(f"No se puede ordenar por '{name}'")
+    return name, SORT_FIELDS[name], DESCENDING if descending else ASCENDING
+
+
+def parse_fields(fields: Optional[str]):
+    if not fields:
+        return None
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in PRODUCT_FIELDS]
+    if unknown:
+        raise CatalogQueryError(f"Campos desconocidos: {', '.join(unknown)}")
+    return selected
+
+
+async def list_products(category: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                        cursor: Optional[str] = None, sort: str = "id",
+                        fields: Optional[str] = None):
+    """Retorna (productos, siguiente_cursor); siguiente_cursor es None en la ultima pagina"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    sort_name, sort_field, direction = parse_sort(sort)
+    selected = parse_fields(fields)
+
+    query = {}
+    if category is not None:
+        query["category_key"] = category.lower()
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        op = "$gt" if direction == ASCENDING else "$lt"
+        if sort_field == "_id":
+            query["_id"] = {op: last_id}
+        else:
+            query["$or"] = [{sort_field: {op: value}}, {sort_field: value, "_id": {op: last_id}}]
+
+    projection = None
+    if selected is not None:
+        projection = {SORT_FIELDS.get(f, f): 1 for f in selected}
+        # el campo de orden siempre se lee porque va en el cursor
+        projection[sort_field] = 1
+
+    sort_spec = [(sort_field, direction)]
+    if sort_field != "_id":
+        sort_spec.append(("_id", direction))
+
+    docs = await products_collection().find(query, projection).sort(sort_spec).limit(limit + 1).to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last["_id"])
+
+    products = [document_to_product(d) for d in docs]
+    if selected is not None:
+        products = [{k: p[k] for k in selected if k in p} for p in products]
+    return products, next_cursor
+
+
+async def list_categories():
+    return await products_collection().distinct("category")
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+
+    # python -m services.catalog seed  -> recarga los productos de ejemplo
+    if sys.argv[1:] == ["seed"]:
+        async def _seed():
+            await ensure_catalog_indexes()
+            count = await seed_sample_products(only_if_empty=False)
+            print(f"{count} productos sembrados")
+        asyncio.run(_seed())
+    else:
+        print("uso: python -m services.catalog seed")
@@ -0,0 +1,200 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Request, Response
+from dotenv import load_dotenv
+
+from services import catalog
+from services.compression import accepts_encoding
+from services.search import PackedSearchIndex, SearchIndex, search_index
+
+load_dotenv()
+
+# Snapshot inmutable del catalogo. Se reconstruye solo cuando cambia la
+# version del catalogo; mientras tanto las rutas sirven directamente los
+# bytes ya serializados (y ya comprimidos) con un ETag fuerte.
+
+CATALOG_SNAPSHOT_CHECK_INTERVAL = float(os.getenv("CATALOG_SNAPSHOT_CHECK_INTERVAL", "10"))
+# con serve.py el snapshot viene de memoria compartida y revisarlo es casi gratis
+CATALOG_SHM_POLL_INTERVAL = float(os.getenv("CATALOG_SHM_POLL_INTERVAL", "1"))
+
+
+@dataclass(frozen=True)
+class EncodedBody:
+    body: bytes  # o memoryview sobre la memoria compartida (serve.py)
+    gzip_body: bytes
+    etag: str
+    next_cursor: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    products: tuple  # vacio si viene de la memoria compartida (los tiene `search`)
+    products_page: EncodedBody
+    categories: EncodedBody
+    category_pages: dict  # categoria en minusculas -> EncodedBody
+    empty_page: EncodedBody
+    search: Optional[PackedSearchIndex] = None  # buscador en la memoria compartida (serve.py)
+
+
+def encode_body(data, next_cursor: Optional[str] = None) -> EncodedBody:
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return EncodedBody(body, gzip.compress(body, compresslevel=9, mtime=0), etag, next_cursor)
+
+
+def encode_first_page(products: tuple) -> EncodedBody:
+    # misma forma que la primera pagina de catalog.list_products (orden por id)
+    page = list(products[:catalog.DEFAULT_PAGE_SIZE])
+    next_cursor = None
+    if len(products) > catalog.DEFAULT_PAGE_SIZE:
+        next_cursor = catalog.encode_cursor(page[-1]["id"], page[-1]["id"])
+    return encode_body(page, next_cursor)
+
+
+def group_by_category(products: tuple) -> dict:
+    by_category = {}
+    for product in products:
+        by_category.setdefault(product["category"].lower(), []).append(product)
+    return {key: tuple(items) for key, items in by_category.items()}
+
+
+def build_snapshot(products, version: int) -> CatalogSnapshot:
+    products = tuple(products)
+    by_category = group_by_category(products)
+
+    categories = sorted({p["category"] for p in products})
+
+    return CatalogSnapshot(
+        version=version,
+        products=products,
+        products_page=encode_first_page(products),
+        categories=encode_body({"categories": categories}),
+        category_pages={key: encode_first_page(items) for key, items in by_category.items()},
+        empty_page=encode_body([]),
+    )
+
+
+def gzip_etag(etag: str) -> str:
+    # cada representacion lleva su propio ETag: un cache no debe entregar
+    # el cuerpo gzip a quien lo valido sin Accept-Encoding (ni al reves)
+    return etag[:-1] + '-gz"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match compara en forma debil (un proxy puede agregar W/)
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def snapshot_response(request: Request, encoded: EncodedBody) -> Response:
+    """Sirve un cuerpo precalculado, con 304 si el cliente ya lo tiene"""
+    gzipped = accepts_encoding(request.headers.get("accept-encoding", ""), "gzip")
+    etag = gzip_etag(encoded.etag) if gzipped else encoded.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if encoded.next_cursor:
+        headers["X-Next-Cursor"] = encoded.next_cursor
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=encoded.gzip_body, media_type="application/json", headers=headers)
+    return Response(content=encoded.body, media_type="application/json", headers=headers)
+
+
+def build_search_index(products) -> SearchIndex:
+    index = SearchIndex(search_index.k1, search_index.b)
+    index.sync(products)
+    index.warm()
+    return index
+
+
+async def sync_search_index(products) -> None:
+    if not len(search_index):
+        # primera carga (todo el catalogo): se arma en otro hilo y se cambia de una vez,
+        # las busquedas mientras tanto ven el indice vacio en vez de bloquear el loop
+        search_index.replace(await asyncio.to_thread(build_search_index, products))
+    else:
+        # despues solo se reindexan los productos que cambiaron
+        search_index.sync(products)
+
+
+class CatalogSnapshotManager:
+    def __init__(self, check_interval: float = CATALOG_SNAPSHOT_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.current: Optional[CatalogSnapshot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.rebuilds = 0
+        # SharedCatalogReader cuando corre como worker de serve.py
+        self.shared = None
+
+    def use_shared(self, reader) -> None:
+        """Toma el snapshot que publica el constructor en vez de armarlo desde Mongo"""
+        self.shared = reader
+        self.check_interval = CATALOG_SHM_POLL_INTERVAL
+
+    async def refresh(self, force: bool = False) -> Optional[CatalogSnapshot]:
+        """Reconstruye el snapshot si la version del catalogo cambio"""
+        async with self._lock:
+            if self.shared is not None:
+                return await self._refresh_shared()
+            version = await catalog.get_catalog_version()
+            if not force and self.current is not None and self.current.version == version:
+                return self.current
+            products = [p async for p in catalog.iter_all_products()]
+            # construir fuera del event loop, con catalogos grandes el gzip tarda
+            self.current = await asyncio.to_thread(build_snapshot, products, version)
+            await sync_search_index(self.current.products)
+            self.rebuilds += 1
+            return self.current
+
+    async def _refresh_shared(self) -> Optional[CatalogSnapshot]:
+        if not self.shared.changed():
+            return self.current
+        snapshot = await asyncio.to_thread(self.shared.load)
+        if snapshot is not None:
+            self.current = snapshot
+            search_index.use_packed(snapshot.search)
+            # el snapshot y el buscador anteriores ya no se usan: su segmento se puede cerrar
+            self.shared.close_retired()
+            self.rebuilds += 1
+        return self.current
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error actualizando snapshot del catalogo: {str(e)}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.shared is not None:
+            # soltar las vistas sobre el segmento antes de cerrarlo
+            self.current = None
+            search_index.replace(SearchIndex(search_index.k1, search_index.b))
+            self.shared.close()
+
+
+catalog_snapshot = CatalogSnapshotManager()
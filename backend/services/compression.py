@@ -0,0 +1,116 @@
+import gzip
+import os
+from typing import Optional
+
+from starlette.datastructures import MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # sin brotli se negocia solo gzip
+    brotli = None
+
+# Compresion de respuestas segun Accept-Encoding (br > gzip).
+# Solo respuestas completas (un unico mensaje de cuerpo) de tipos de texto y
+# sobre COMPRESS_MIN_BYTES: los streams (SSE, NDJSON) pasan tal cual para no
+# retrasar eventos, y lo que ya trae Content-Encoding (snapshot del catalogo
+# precomprimido) no se toca.
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+SUPPORTED = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def parse_accept_encoding(accept_encoding: str) -> dict:
+    """Accept-Encoding -> {codificacion: q}"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """True si el cliente acepta `encoding` (gzip;q=0 es un rechazo explicito)"""
+    accepted = parse_accept_encoding(accept_encoding)
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """La mejor codificacion aceptada por el cliente, None si ninguna"""
+    accepted = parse_accept_encoding(accept_encoding)
+    for encoding in SUPPORTED:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """Middleware ASGI: gzip/brotli negociado para respuestas medianas y grandes"""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = None
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                encoding = choose_encoding(value.decode("latin-1"))
+                break
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # se retiene hasta ver el cuerpo: ahi se sabe si conviene comprimir
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start.setdefault("headers", []))
+            if (message.get("more_body", False) or "content-encoding" in headers
+                    or len(body) < self.minimum_size or not is_compressible(headers.get("content-type", ""))):
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
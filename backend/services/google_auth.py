@@ -0,0 +1,107 @@
+import asyncio
+import os
+import re
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+from jose import jwt, JWTError
+
+from services.http_clients import http_clients
+
+load_dotenv()
+
+# Verificacion local del id_token que devuelve Google al canjear el code.
+# Las llaves publicas de Google (JWKS) se guardan por "kid" hasta lo que diga
+# su Cache-Control; si llega un kid desconocido (Google rota llaves) se vuelve
+# a pedir el JWKS, como mucho una vez cada GOOGLE_JWKS_MIN_REFRESH segundos.
+# Asi el login ya no necesita la llamada a /userinfo.
+
+GOOGLE_CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+GOOGLE_JWKS_DEFAULT_TTL = float(os.getenv("GOOGLE_JWKS_DEFAULT_TTL", "3600"))
+GOOGLE_JWKS_MIN_REFRESH = float(os.getenv("GOOGLE_JWKS_MIN_REFRESH", "60"))
+
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class GoogleTokenError(Exception):
+    pass
+
+
+def cache_ttl(cache_control: Optional[str], default: float) -> float:
+    match = MAX_AGE.search(cache_control or "")
+    return float(match.group(1)) if match else default
+
+
+class GoogleKeyCache:
+    def __init__(self, url: str = GOOGLE_CERTS_URL, default_ttl: float = GOOGLE_JWKS_DEFAULT_TTL,
+                 min_refresh: float = GOOGLE_JWKS_MIN_REFRESH):
+        self.url = url
+        self.default_ttl = default_ttl
+        self.min_refresh = min_refresh
+        self._keys: dict = {}  # kid -> jwk
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self.stats = {"hits": 0, "refreshes": 0, "unknown_kid": 0}
+
+    async def _refresh(self) -> None:
+        response = await http_clients.request("google", "GET", self.url)
+        if response.status_code != 200:
+            raise GoogleTokenError(f"JWKS de Google respondio {response.status_code}")
+        keys = {key["kid"]: key for key in response.json().get("keys", []) if "kid" in key}
+        now = time.monotonic()
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + cache_ttl(response.headers.get("cache-control"), self.default_ttl)
+        self.stats["refreshes"] += 1
+
+    async def get(self, kid: str) -> dict:
+        now = time.monotonic()
+        key = self._keys.get(kid)
+        if key is not None and now < self._expires_at:
+            self.stats["hits"] += 1
+            return key
+        # un solo refresco aunque lleguen muchos logins juntos
+        async with self._lock:
+            now = time.monotonic()
+            expired = now >= self._expires_at
+            unknown = kid not in self._keys
+            if expired or (unknown and now - self._fetched_at >= self.min_refresh):
+                await self._refresh()
+            elif unknown:
+                self.stats["unknown_kid"] += 1
+        key = self._keys.get(kid)
+        if key is None:
+            raise GoogleTokenError("id_token firmado con una llave desconocida")
+        return key
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "keys": len(self._keys),
+                "expires_in": round(max(0.0, self._expires_at - time.monotonic()), 1)}
+
+
+google_keys = GoogleKeyCache()
+
+
+async def verify_id_token(id_token: str, audience: str, access_token: Optional[str] = None) -> dict:
+    """Claims del id_token si la firma, aud, iss, exp (y at_hash) son validos"""
+    if not id_token:
+        raise GoogleTokenError("Google no entrego id_token")
+    try:
+        header = jwt.get_unverified_header(id_token)
+    except JWTError:
+        raise GoogleTokenError("id_token mal formado")
+    key = await google_keys.get(header.get("kid", ""))
+    try:
+        claims = jwt.decode(id_token, key, algorithms=["RS256"], audience=audience,
+                            access_token=access_token)
+    except JWTError as e:
+        raise GoogleTokenError(f"id_token invalido: {str(e)}")
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise GoogleTokenError("id_token con emisor desconocido")
+    if not claims.get("email") or not claims.get("email_verified"):
+        # se vincula por email con cuentas existentes: tiene que estar verificado
+        raise GoogleTokenError("id_token sin email verificado")
+    return claims
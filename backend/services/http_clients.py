@@ -0,0 +1,181 @@
+import asyncio
+import importlib.util
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from services.metrics import observe_upstream
+from services.profiling import span
+
+load_dotenv()
+
+# Un pool de conexiones keep-alive por servicio externo (Webpay, Google,
+# OpenFoodFacts). Se crean en el lifespan de la app y se cierran al apagar,
+# asi cada pago/login reutiliza la conexion TLS en vez de abrir una nueva.
+#
+# Configurable por variables de entorno, por ejemplo:
+#   HTTP_WEBPAY_CONNECT_TIMEOUT, HTTP_WEBPAY_READ_TIMEOUT, HTTP_WEBPAY_RETRIES,
+#   HTTP_WEBPAY_MAX_CONNECTIONS
+
+# HTTP/2 solo si esta instalado el paquete h2 (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+@dataclass
+class UpstreamConfig:
+    connect_timeout: float = 5.0
+    read_timeout: float = 15.0
+    max_connections: int = 50
+    max_keepalive: int = 20
+    keepalive_expiry: float = 60.0
+    retries: int = 2
+    backoff: float = 0.2
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "UpstreamConfig":
+        config = cls(**defaults)
+        prefix = f"HTTP_{name.upper()}_"
+        for field, cast in (("connect_timeout", float), ("read_timeout", float),
+                            ("max_connections", int), ("max_keepalive", int),
+                            ("keepalive_expiry", float), ("retries", int), ("backoff", float)):
+            value = os.getenv(prefix + field.upper())
+            if value is not None:
+                setattr(config, field, cast(value))
+        return config
+
+
+UPSTREAMS = {
+    "webpay": UpstreamConfig.from_env("webpay", read_timeout=30.0),
+    "google": UpstreamConfig.from_env("google", read_timeout=10.0),
+    "off": UpstreamConfig.from_env("off", read_timeout=10.0, max_connections=100, max_keepalive=50),
+}
+
+
+class UpstreamStats:
+    __slots__ = ("requests", "new_connections", "retries", "errors", "http_versions")
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.retries = 0
+        self.errors = 0
+        self.http_versions = {}
+
+    def as_dict(self) -> dict:
+        reused = max(0, self.requests - self.new_connections)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+            "retries": self.retries,
+            "errors": self.errors,
+            "http_versions": dict(self.http_versions),
+        }
+
+
+class HttpClientRegistry:
+    def __init__(self, upstreams: dict = UPSTREAMS):
+        self.upstreams = upstreams
+        self._clients: dict = {}
+        self._transports: dict = {}
+        self.stats = {name: UpstreamStats() for name in upstreams}
+
+    def _build(self, name: str) -> httpx.AsyncClient:
+        config = self.upstreams[name]
+        stats = self.stats[name]
+
+        async def trace(event, info):
+            # httpcore avisa cuando abre una conexion TCP nueva; el resto se reutilizo
+            if event == "connection.connect_tcp.complete":
+                stats.new_connections += 1
+
+        async def on_request(request):
+            stats.requests += 1
+            request.extensions["trace"] = trace
+
+        async def on_response(response):
+            version = response.http_version
+            stats.http_versions[version] = stats.http_versions.get(version, 0) + 1
+
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout),
+            limits=httpx.Limits(max_connections=config.max_connections,
+                                max_keepalive_connections=config.max_keepalive,
+                                keepalive_expiry=config.keepalive_expiry),
+            http2=config.http2 and HTTP2_AVAILABLE,
+            transport=self._transports.get(name),
+            event_hooks={"request": [on_request], "response": [on_response]},
+        )
+
+    async def start(self) -> None:
+        for name in self.upstreams:
+            self.get(name)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None:
+            client = self._clients[name] = self._build(name)
+        return client
+
+    def set_transport(self, name: str, transport: Optional[httpx.AsyncBaseTransport]) -> None:
+        """Reemplaza el transporte de un upstream (mocks locales en benchmarks).
+
+        Solo antes de crear el cliente: descartar uno abierto dejaria su pool y
+        sus sockets sin cerrar, hay que llamar aclose() primero.
+        """
+        if name in self._clients:
+            raise RuntimeError(f"El cliente '{name}' ya esta abierto: llamar aclose() antes de cambiar el transporte")
+        self._transports[name] = transport
+
+    async def request(self, name: str, method: str, url: str, retry: Optional[bool] = None,
+                      **kwargs) -> httpx.Response:
+        """Request con reintentos y backoff; por defecto solo se reintentan metodos idempotentes"""
+        config = self.upstreams[name]
+        stats = self.stats[name]
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS
+        attempts = 1 + (config.retries if retry else 0)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            started = time.perf_counter()
+            try:
+                with span(f"{name} {method}"):
+                    response = await self.get(name).request(method, url, **kwargs)
+            except httpx.TransportError:
+                observe_upstream(name, url, None, time.perf_counter() - started)
+                stats.errors += 1
+                if last_attempt:
+                    raise
+            else:
+                observe_upstream(name, url, response.status_code, time.perf_counter() - started)
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                await response.aclose()
+            stats.retries += 1
+            # backoff exponencial con jitter
+            await asyncio.sleep(config.backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    def get_stats(self) -> dict:
+        return {
+            name: {**self.stats[name].as_dict(), "http2_enabled": self.upstreams[name].http2 and HTTP2_AVAILABLE}
+            for name in self.upstreams
+        }
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+http_clients = HttpClientRegistry()
@@ -0,0 +1,287 @@
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+import database
+from services.order_ids import order_ids
+
+load_dotenv()
+
+# Stock por producto con reservas que vencen.
+#
+# El stock de un producto se reparte en N contadores ("shards") en
+# inventory_shards: {_id: "<producto>:<n>", product_id, available}. Reservar
+# es un $inc negativo condicionado a available >= cantidad sobre un shard
+# elegido al azar, asi los compradores simultaneos de un mismo producto no
+# pelean por el mismo documento y nunca se vende mas de lo que hay.
+#
+# Cada reserva queda en reservations con los shards de donde salio:
+#   held -> confirmed (pago AUTHORIZED) | released (pago fallido o vencida)
+# Al liberar se devuelve lo tomado a esos mismos shards.
+#
+# Los productos sin shards no llevan control de stock.
+
+INVENTORY_DEFAULT_SHARDS = int(os.getenv("INVENTORY_DEFAULT_SHARDS", "1"))
+INVENTORY_RESERVATION_TTL = float(os.getenv("INVENTORY_RESERVATION_TTL", "1200"))  # 20 min
+INVENTORY_SWEEP_INTERVAL = float(os.getenv("INVENTORY_SWEEP_INTERVAL", "30"))
+INVENTORY_SWEEP_BATCH = int(os.getenv("INVENTORY_SWEEP_BATCH", "500"))
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id: str):
+        super().__init__(f"Sin stock suficiente para {product_id}")
+        self.product_id = product_id
+
+
+def shards_collection():
+    return database.db["inventory_shards"]
+
+
+def reservations_collection():
+    return database.db["reservations"]
+
+
+async def set_stock(product_id: str, quantity: int, shards: int = INVENTORY_DEFAULT_SHARDS) -> None:
+    """Fija el stock disponible de un producto repartido en `shards` contadores.
+
+    Pensado para cargas de stock fuera de la venta: las reservas vigentes no
+    se tocan, lo que devuelvan al liberarse se suma encima.
+    """
+    shards = max(1, shards)
+    base, extra = divmod(quantity, shards)
+    operations = [
+        UpdateOne({"_id": f"{product_id}:{n}"},
+                  {"$set": {"product_id": product_id, "shard": n, "available": base + (1 if n < extra else 0)}},
+                  upsert=True)
+        for n in range(shards)
+    ]
+    await shards_collection().bulk_write(operations, ordered=False)
+    await shards_collection().delete_many({"product_id": product_id, "shard": {"$gte": shards}})
+
+
+async def get_stock(product_id: str) -> Optional[dict]:
+    """Disponible total y por shard; None si el producto no lleva stock"""
+    shards = await shards_collection().find({"product_id": product_id}).sort("shard", 1).to_list(None)
+    if not shards:
+        return None
+    return {"product_id": product_id, "available": sum(s["available"] for s in shards),
+            "shards": [s["available"] for s in shards]}
+
+
+async def _take(shard_id: str, quantity: int) -> bool:
+    doc = await shards_collection().find_one_and_update(
+        {"_id": shard_id, "available": {"$gte": quantity}},
+        {"$inc": {"available": -quantity}},
+        projection={"_id": 1}
+    )
+    return doc is not None
+
+
+async def _give_back(allocations: list) -> None:
+    operations = [UpdateOne({"_id": a["shard"]}, {"$inc": {"available": a["quantity"]}}) for a in allocations]
+    if operations:
+        await shards_collection().bulk_write(operations, ordered=False)
+
+
+async def _shard_levels(product_ids: list) -> dict:
+    """Una sola lectura: producto -> {shard: disponible} (solo productos con stock)"""
+    levels = {}
+    async for doc in shards_collection().find({"product_id": {"$in": product_ids}},
+                                              {"product_id": 1, "available": 1}):
+        levels.setdefault(doc["product_id"], {})[doc["_id"]] = doc["available"]
+    return levels
+
+
+async def _allocate(product_id: str, levels: dict, quantity: int) -> list:
+    """Toma `quantity` unidades de los shards; lanza OutOfStock (sin tomar nada) si no alcanza.
+
+    `levels` es lo que habia en cada shard al leerlos: solo sirve para elegir
+    donde intentar, el $inc condicionado es el que garantiza no pasarse.
+    """
+    if sum(levels.values()) < quantity:
+        # agotado: se responde sin escribir nada
+        raise OutOfStock(product_id)
+    # orden al azar: reparte la contencion entre todos los shards
+    shard_ids = [s for s, available in levels.items() if available > 0]
+    random.shuffle(shard_ids)
+    allocations, need = [], quantity
+
+    # primero se intenta sacar todo de un solo shard
+    for shard_id in shard_ids:
+        if levels[shard_id] >= need and await _take(shard_id, need):
+            return [{"shard": shard_id, "quantity": need}]
+
+    # si ninguno tiene todo, juntar de a pedazos lo que cada uno tenia
+    for shard_id in (shard_ids if quantity > 1 else ()):
+        piece = min(need, levels[shard_id])
+        if await _take(shard_id, piece):
+            allocations.append({"shard": shard_id, "quantity": piece})
+            need -= piece
+            if need == 0:
+                return allocations
+
+    await _give_back(allocations)
+    raise OutOfStock(product_id)
+
+
+async def reserve(items: list, buy_order: Optional[str] = None,
+                  ttl: float = INVENTORY_RESERVATION_TTL) -> Optional[str]:
+    """Reserva las lineas [{product_id, quantity}]; retorna el id de la reserva.
+
+    None si ningun producto lleva stock. Si alguno no alcanza se devuelve lo
+    ya tomado y se lanza OutOfStock.
+    """
+    levels = await _shard_levels([item["product_id"] for item in items])
+
+    lines = []
+    try:
+        for item in items:
+            if item["product_id"] not in levels:
+                continue
+            allocations = await _allocate(item["product_id"], levels[item["product_id"]], item["quantity"])
+            lines.append({"product_id": item["product_id"], "quantity": item["quantity"],
+                          "allocations": allocations})
+    except BaseException:
+        await _give_back([a for line in lines for a in line["allocations"]])
+        raise
+    if not lines:
+        return None
+
+    now = datetime.now()
+    reservation_id = "RES" + order_ids.next_id()
+    try:
+        await reservations_collection().insert_one({
+            "_id": reservation_id,
+            "buy_order": buy_order,
+            "lines": lines,
+            "status": "held",
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=ttl),
+        })
+    except BaseException:
+        await _give_back([a for line in lines for a in line["allocations"]])
+        raise
+    return reservation_id
+
+
+async def release(reservation_id: str, reason: str = "released") -> bool:
+    """Devuelve el stock de una reserva vigente; False si ya estaba cerrada"""
+    # el cambio de estado va primero: solo quien lo logra devuelve el stock
+    doc = await reservations_collection().find_one_and_update(
+        {"_id": reservation_id, "status": "held"},
+        {"$set": {"status": "released", "reason": reason, "closed_at": datetime.now()}},
+        projection={"lines": 1}
+    )
+    if doc is None:
+        return False
+    await _give_back([a for line in doc["lines"] for a in line["allocations"]])
+    return True
+
+
+async def confirm(reservation_id: str) -> bool:
+    """Marca la reserva como vendida.
+
+    Si vencio antes de que llegara el pago (ya se devolvio el stock), se
+    intenta tomar el stock de nuevo; False si ya no queda (sobreventa que
+    hay que resolver a mano).
+    """
+    doc = await reservations_collection().find_one_and_update(
+        {"_id": reservation_id, "status": {"$in": ["held", "released"]}},
+        {"$set": {"status": "confirmed", "closed_at": datetime.now()}},
+        projection={"lines": 1, "status": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if doc is None or doc["status"] == "held":
+        return doc is not None
+
+    retaken = []
+    levels = await _shard_levels([line["product_id"] for line in doc["lines"]])
+    try:
+        for line in doc["lines"]:
+            allocations = await _allocate(line["product_id"], levels.get(line["product_id"], {}), line["quantity"])
+            retaken.append({**line, "allocations": allocations})
+    except OutOfStock as e:
+        await _give_back([a for line in retaken for a in line["allocations"]])
+        await reservations_collection().update_one({"_id": reservation_id}, {"$set": {"oversold": True}})
+        print(f"Pago autorizado sin stock para la reserva {reservation_id}: {str(e)}")
+        return False
+    await reservations_collection().update_one({"_id": reservation_id}, {"$set": {"lines": retaken}})
+    return True
+
+
+async def settle(transaction: dict) -> None:
+    """Confirma o libera la reserva de una transaccion que llego a estado final"""
+    reservation_id = transaction.get("reservation_id")
+    if not reservation_id:
+        return
+    if transaction.get("status") == "AUTHORIZED":
+        await confirm(reservation_id)
+    else:
+        await release(reservation_id, reason=f"payment {transaction.get('status')}")
+
+
+async def release_expired(limit: int = INVENTORY_SWEEP_BATCH) -> int:
+    expired = await reservations_collection().find(
+        {"status": "held", "expires_at": {"$lt": datetime.now()}}, {"_id": 1}
+    ).limit(limit).to_list(limit)
+    released = 0
+    for doc in expired:
+        if await release(doc["_id"], reason="expired"):
+            released += 1
+    return released
+
+
+class ReservationSweeper:
+    """Libera las reservas vencidas cada INVENTORY_SWEEP_INTERVAL segundos.
+
+    Puede correr en todas las replicas: release() solo devuelve el stock una vez.
+    """
+
+    def __init__(self, interval: float = INVENTORY_SWEEP_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.released = 0
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.released += await release_expired()
+            except PyMongoError as e:
+                print(f"Error liberando reservas vencidas: {str(e)}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+reservation_sweeper = ReservationSweeper()
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m services.inventory set-stock <producto> <cantidad> [shards]
+    if len(sys.argv) in (4, 5) and sys.argv[1] == "set-stock":
+        async def _set_stock():
+            shards = int(sys.argv[4]) if len(sys.argv) == 5 else INVENTORY_DEFAULT_SHARDS
+            await set_stock(sys.argv[2], int(sys.argv[3]), shards)
+            print(await get_stock(sys.argv[2]))
+        asyncio.run(_set_stock())
+    else:
+        print("uso: python -m services.inventory set-stock <producto> <cantidad> [shards]")
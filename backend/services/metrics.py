@@ -0,0 +1,209 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Optional
+
+from pymongo import monitoring
+
+from services.profiling import record_span
+
+# Metricas en formato de texto de Prometheus (GET /metrics).
+#
+#   http_request_duration_seconds{method,route,status}   histograma por ruta
+#   http_requests_in_flight{method}                       requests en curso
+#   mongo_command_duration_seconds{collection,command,outcome}  cada comando de Motor/pymongo
+#   upstream_request_duration_seconds{upstream,host,status}  cada llamada httpx hacia afuera
+#   password_hash_duration_seconds{op,outcome}            bcrypt (espera en el pool + calculo)
+#   admission_limit{route_class} / admission_in_flight / admission_queue_depth   control de admision
+#   admission_rejected_total{route_class,reason}          requests rechazados (503/429)
+#   admission_queue_wait_seconds{route_class}             espera en la cola de admision
+#
+# Cada combinacion de labels tiene su histograma con los buckets ya creados;
+# observar un valor es un bisect y dos sumas, sin crear objetos nuevos.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # el ultimo es +Inf
+        self.sum = 0.0
+        self.count = 0
+        # los comandos de Mongo se observan desde los threads de Motor
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class HistogramFamily:
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.bucket_bounds = buckets
+        self.children: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, *values) -> Histogram:
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(values, Histogram(self.bucket_bounds))
+        return child
+
+    def render(self, lines: list) -> None:
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for values, child in list(self.children.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, n in zip(self.bucket_bounds, child.counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {child.count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {child.sum}")
+            lines.append(f"{self.name}_count{{{labels}}} {child.count}")
+
+
+class GaugeFamily:
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: dict = {}
+
+    def inc(self, values: tuple, amount: int = 1) -> None:
+        self.values[values] = self.values.get(values, 0) + amount
+
+    def set(self, values: tuple, value) -> None:
+        self.values[values] = value
+
+    def render(self, lines: list) -> None:
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for values, value in list(self.values.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+
+
+class CounterFamily(GaugeFamily):
+    kind = "counter"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+http_request_duration = HistogramFamily(
+    "http_request_duration_seconds", "Latencia de los requests HTTP por ruta", ("method", "route", "status"))
+http_requests_in_flight = GaugeFamily(
+    "http_requests_in_flight", "Requests HTTP en curso", ("method",))
+mongo_command_duration = HistogramFamily(
+    "mongo_command_duration_seconds", "Duracion de los comandos de MongoDB", ("collection", "command", "outcome"))
+upstream_request_duration = HistogramFamily(
+    "upstream_request_duration_seconds", "Duracion de las llamadas a servicios externos", ("upstream", "host", "status"))
+password_hash_duration = HistogramFamily(
+    "password_hash_duration_seconds", "Duracion de bcrypt incluyendo la espera en el pool", ("op", "outcome"),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+admission_limit = GaugeFamily(
+    "admission_limit", "Concurrencia permitida (adaptativa) por clase de ruta", ("route_class",))
+admission_in_flight = GaugeFamily(
+    "admission_in_flight", "Requests admitidos en curso por clase de ruta", ("route_class",))
+admission_queue_depth = GaugeFamily(
+    "admission_queue_depth", "Requests esperando admision por clase de ruta", ("route_class",))
+admission_rejected = CounterFamily(
+    "admission_rejected_total", "Requests rechazados por el control de admision", ("route_class", "reason"))
+admission_queue_wait = HistogramFamily(
+    "admission_queue_wait_seconds", "Espera en la cola de admision", ("route_class",))
+
+FAMILIES = (http_request_duration, http_requests_in_flight, mongo_command_duration,
+            upstream_request_duration, password_hash_duration, admission_limit, admission_in_flight,
+            admission_queue_depth, admission_rejected, admission_queue_wait)
+
+
+def render_metrics() -> str:
+    lines = []
+    for family in FAMILIES:
+        family.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+def route_label(scope: dict) -> str:
+    # la plantilla de la ruta (/products/{barcode}), no la URL: asi no explotan los labels
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia por ruta y requests en curso"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        # la ruta se conoce recien despues del routing: en curso se cuenta por metodo
+        in_flight_key = (method,)
+        http_requests_in_flight.inc(in_flight_key)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.inc(in_flight_key, -1)
+            http_request_duration.get(method, route_label(scope), status_holder[0]).observe(
+                time.perf_counter() - started)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Tiempo de cada comando de Mongo por coleccion y operacion"""
+
+    def __init__(self):
+        self._collections: dict = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        collection = event.command.get(event.command_name)
+        self._collections[event.request_id] = collection if isinstance(collection, str) else "-"
+
+    def _finish(self, event, outcome: str) -> None:
+        collection = self._collections.pop(event.request_id, "-")
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.get(collection, event.command_name, outcome).observe(seconds)
+        # Motor copia el contexto al thread: el comando queda en los spans del request
+        record_span(f"mongo {event.command_name} {collection}", seconds)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, "error")
+
+
+mongo_listener = MongoCommandListener()
+
+
+def observe_upstream(upstream: str, url: str, status: Optional[int], seconds: float) -> None:
+    # host sin parsear toda la URL: "https://host/..." -> "host"
+    host = url.split("/", 3)[2] if "://" in url else "-"
+    upstream_request_duration.get(upstream, host, status if status is not None else "error").observe(seconds)
@@ -0,0 +1,107 @@
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from services.cache import TTLCache
+from services.http_clients import http_clients
+
+load_dotenv()
+
+# Cliente async para OpenFoodFacts con cache TTL+LRU por codigo de barras
+# y coalescing: si llegan muchas consultas del mismo codigo a la vez solo se
+# hace una peticion hacia afuera y el resto espera ese mismo resultado
+
+OFF_PRODUCT_URL = "https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
+OFF_CACHE_TTL = float(os.getenv("OFF_CACHE_TTL", "3600"))  # 1 hora
+OFF_NEGATIVE_CACHE_TTL = float(os.getenv("OFF_NEGATIVE_CACHE_TTL", "300"))  # 404 se recuerdan 5 min
+OFF_CACHE_SIZE = int(os.getenv("OFF_CACHE_SIZE", "10000"))
+
+
+class OpenFoodFactsClient:
+    def __init__(self, client: Optional[httpx.AsyncClient] = None,
+                 ttl: float = OFF_CACHE_TTL,
+                 negative_ttl: float = OFF_NEGATIVE_CACHE_TTL,
+                 maxsize: int = OFF_CACHE_SIZE):
+        self._client = client
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._negative_ttl = negative_ttl
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.stats = {
+            "hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "upstream_requests": 0,
+            "upstream_errors": 0,
+        }
+
+    async def _get(self, url: str) -> httpx.Response:
+        if self._client is not None:
+            return await self._client.get(url)
+        # pool compartido "off" (keep-alive, timeouts y reintentos configurables)
+        return await http_clients.request("off", "GET", url)
+
+    async def get_product(self, barcode: str) -> Optional[dict]:
+        """Datos crudos del producto o None si OpenFoodFacts no lo conoce"""
+        found, product = self._cache.get(barcode)
+        if found:
+            if product is None:
+                self.stats["negative_hits"] += 1
+            else:
+                self.stats["hits"] += 1
+            return product
+
+        task = self._inflight.get(barcode)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            # la consulta corre en su propia task: si el request que la inicio
+            # se cancela, los demas que esperan no se quedan colgados
+            task = asyncio.ensure_future(self._fetch_and_store(barcode))
+            self._inflight[barcode] = task
+            task.add_done_callback(lambda t: self._on_done(barcode, t))
+        return await asyncio.shield(task)
+
+    def _on_done(self, barcode: str, task: asyncio.Task) -> None:
+        self._inflight.pop(barcode, None)
+        # marcar la excepcion como leida aunque nadie haya quedado esperando
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch_and_store(self, barcode: str) -> Optional[dict]:
+        self.stats["upstream_requests"] += 1
+        try:
+            response = await self._get(OFF_PRODUCT_URL.format(barcode=barcode))
+            if response.status_code == 404:
+                product = None
+            else:
+                response.raise_for_status()
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = None
+                if not isinstance(body, dict):
+                    # cuerpo que no es un objeto JSON: mismo camino que un error HTTP (502 / upstream_error)
+                    raise httpx.DecodingError("Respuesta invalida de OpenFoodFacts", request=response.request)
+                # la API v0 responde 200 con status 0 cuando no existe el producto
+                product = body.get("product") if body.get("status", 1) else None
+        except httpx.HTTPError:
+            # errores de red o 5xx no se cachean, el siguiente intento vuelve a consultar
+            self.stats["upstream_errors"] += 1
+            raise
+
+        if product is None:
+            self._cache.set(barcode, None, ttl=self._negative_ttl)
+        else:
+            self._cache.set(barcode, product)
+        return product
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "cached": len(self._cache), "inflight": len(self._inflight)}
+
+
+off_client = OpenFoodFactsClient()
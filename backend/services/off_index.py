@@ -0,0 +1,272 @@
+import argparse
+import csv
+import gzip
+import heapq
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from typing import Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Indice local de productos de OpenFoodFacts.
+#
+# Se construye desde un dump (JSONL o CSV, opcionalmente .gz) sin cargarlo en
+# memoria: se ordena por trozos a disco y luego se mezclan (external sort).
+# El archivo resultante tiene el formato:
+#
+#   cabecera  <8s Q Q Q>  magic, cantidad, ancho de clave, offset de registros
+#   claves    cantidad * <ancho s, Q offset, I largo>   ordenadas por codigo
+#   registros JSON compacto de cada producto
+#
+# La API lo abre con mmap y hace busqueda binaria sobre las claves.
+
+MAGIC = b"OFFIDX01"
+HEADER = struct.Struct("<8sQQQ")
+KEY_WIDTH = 16
+ENTRY_TAIL = struct.Struct("<QI")
+CHUNK_SIZE = 200_000  # registros por trozo ordenado en memoria
+
+OFF_INDEX_PATH = os.getenv("OFF_INDEX_PATH", "data/off_index.bin")
+OFF_INDEX_CHECK_INTERVAL = float(os.getenv("OFF_INDEX_CHECK_INTERVAL", "5"))
+
+# solo lo que usan Product y get_image_url
+IMAGE_KEYS = ("front_es", "front_en")
+
+
+def _encode_key(barcode: str) -> Optional[bytes]:
+    key = barcode.strip().encode("ascii", "ignore")
+    if not key or len(key) > KEY_WIDTH:
+        return None
+    return key.ljust(KEY_WIDTH, b"\0")
+
+
+def _compact_record(code, product_name=None, generic_name=None, categories=None, images=None) -> dict:
+    record = {"code": code, "images": {}}
+    if product_name:
+        record["product_name"] = product_name
+    if generic_name:
+        record["generic_name"] = generic_name
+    if categories:
+        record["categories"] = categories
+    for name in IMAGE_KEYS:
+        info = (images or {}).get(name)
+        if isinstance(info, dict) and "rev" in info:
+            record["images"][name] = {"rev": info["rev"]}
+    return record
+
+
+def _open_dump(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def iter_dump(path: str, fmt: Optional[str] = None) -> Iterator[dict]:
+    """Recorre el dump registro a registro, en memoria constante"""
+    if fmt is None:
+        name = path[:-3] if path.endswith(".gz") else path
+        fmt = "csv" if name.endswith((".csv", ".tsv")) else "jsonl"
+
+    with _open_dump(path) as f:
+        if fmt == "csv":
+            # el CSV de OpenFoodFacts viene separado por tabs y tiene campos enormes
+            csv.field_size_limit(sys.maxsize)
+            for row in csv.DictReader(f, delimiter="\t"):
+                code = row.get("code")
+                if code:
+                    yield _compact_record(code, row.get("product_name"), row.get("generic_name"),
+                                          row.get("categories"))
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+                code = data.get("code") or data.get("_id")
+                if code:
+                    yield _compact_record(str(code), data.get("product_name"), data.get("generic_name"),
+                                          data.get("categories"), data.get("images"))
+
+
+def _write_run(entries: list, tmp_dir: str) -> str:
+    entries.sort(key=lambda e: e[0])
+    fd, run_path = tempfile.mkstemp(dir=tmp_dir, suffix=".run")
+    with os.fdopen(fd, "wb") as out:
+        for key, payload in entries:
+            out.write(key.hex().encode("ascii") + b"\t" + payload + b"\n")
+    return run_path
+
+
+def _read_run(run_path: str) -> Iterator[Tuple[bytes, bytes]]:
+    with open(run_path, "rb") as f:
+        for line in f:
+            key_hex, payload = line.rstrip(b"\n").split(b"\t", 1)
+            yield bytes.fromhex(key_hex.decode("ascii")), payload
+
+
+def build_index(dump_path: str, output_path: str, fmt: Optional[str] = None,
+                chunk_size: int = CHUNK_SIZE) -> int:
+    """Construye el indice y lo deja en output_path con un rename atomico"""
+    out_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(out_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+        # 1) trozos ordenados a disco
+        runs, entries = [], []
+        for record in iter_dump(dump_path, fmt):
+            key = _encode_key(record["code"])
+            if key is None:
+                continue
+            entries.append((key, json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8")))
+            if len(entries) >= chunk_size:
+                runs.append(_write_run(entries, tmp_dir))
+                entries = []
+        if entries:
+            runs.append(_write_run(entries, tmp_dir))
+        entries = []
+
+        # 2) mezcla de los trozos; si un codigo se repite gana el ultimo del dump
+        keys_path = os.path.join(tmp_dir, "keys")
+        data_path = os.path.join(tmp_dir, "data")
+        count = 0
+        with open(keys_path, "wb") as keys_out, open(data_path, "wb") as data_out:
+            offset = 0
+            pending = None
+
+            def emit(key, payload):
+                nonlocal offset, count
+                keys_out.write(key + ENTRY_TAIL.pack(offset, len(payload)))
+                data_out.write(payload)
+                offset += len(payload)
+                count += 1
+
+            merged = heapq.merge(*(_read_run(r) for r in runs), key=lambda e: e[0])
+            for key, payload in merged:
+                if pending is not None and pending[0] != key:
+                    emit(*pending)
+                pending = (key, payload)
+            if pending is not None:
+                emit(*pending)
+
+        # 3) armar el archivo final y reemplazar el anterior de forma atomica
+        records_offset = HEADER.size + count * (KEY_WIDTH + ENTRY_TAIL.size)
+        tmp_output = os.path.join(tmp_dir, "index")
+        with open(tmp_output, "wb") as out:
+            out.write(HEADER.pack(MAGIC, count, KEY_WIDTH, records_offset))
+            for part in (keys_path, data_path):
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, out, 1024 * 1024)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_output, output_path)
+    return count
+
+
+class OffIndexFile:
+    """Un indice abierto con mmap (solo lectura)"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.key_width, self.records_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} no es un indice de OpenFoodFacts")
+        self._entry_size = self.key_width + ENTRY_TAIL.size
+
+    def get(self, barcode: str) -> Optional[dict]:
+        key = _encode_key(barcode)
+        if key is None:
+            return None
+        mm, width, entry_size = self._mm, self.key_width, self._entry_size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = HEADER.size + mid * entry_size
+            current = mm[start:start + width]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                offset, length = ENTRY_TAIL.unpack_from(mm, start + width)
+                start = self.records_offset + offset
+                return json.loads(mm[start:start + length])
+        return None
+
+
+class LocalProductIndex:
+    """Indice local con recarga en caliente cuando el archivo se reemplaza"""
+
+    def __init__(self, path: str = OFF_INDEX_PATH, check_interval: float = OFF_INDEX_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._index: Optional[OffIndexFile] = None
+        self._identity = None
+        self._next_check = 0.0
+        self.stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self._index, self._identity = None, None
+            return
+        identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if identity != self._identity:
+            try:
+                self._index = OffIndexFile(self.path)
+            except (OSError, ValueError) as e:
+                print(f"Error abriendo indice local de productos: {str(e)}")
+                return
+            self._identity = identity
+            self.stats["reloads"] += 1
+
+    def get(self, barcode: str) -> Optional[dict]:
+        self._maybe_reload()
+        if self._index is None:
+            return None
+        product = self._index.get(barcode)
+        if product is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+        return product
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "loaded": self._index is not None,
+                "products": self._index.count if self._index else 0}
+
+
+off_index = LocalProductIndex()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Construye el indice local de OpenFoodFacts")
+    parser.add_argument("dump", help="dump JSONL o CSV de OpenFoodFacts (puede ser .gz)")
+    parser.add_argument("output", nargs="?", default=OFF_INDEX_PATH)
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    count = build_index(args.dump, args.output, args.format, args.chunk_size)
+    print(f"{count} productos indexados en {args.output} ({time.monotonic() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import secrets
+import threading
+import time
+
+# Identificadores de orden ordenables por tiempo y unicos sin ir a la BD.
+#
+#   48 bits  milisegundos desde epoch
+#   26 bits  nodo: aleatorio por proceso (se regenera despues de un fork)
+#   16 bits  contador dentro del mismo milisegundo
+#
+# 90 bits en base32 Crockford = 18 caracteres, asi "ORD" + id cabe en los
+# 26 caracteres que acepta Webpay para buy_order.
+
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+NODE_BITS = 26
+COUNTER_BITS = 16
+ID_LENGTH = 18
+
+
+def _encode(value: int, length: int = ID_LENGTH) -> str:
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+class OrderIdGenerator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._node = 0
+        self._last_ms = 0
+        self._counter = 0
+
+    def next_id(self) -> str:
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                # proceso nuevo (o fork): otro nodo para no repetir ids con el padre
+                self._pid = pid
+                self._node = secrets.randbits(NODE_BITS)
+                self._last_ms, self._counter = 0, 0
+
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                self._last_ms, self._counter = now_ms, 0
+            else:
+                # mismo ms (o el reloj retrocedio): seguir contando sobre el ultimo ms usado
+                self._counter += 1
+                if self._counter >> COUNTER_BITS:
+                    self._last_ms, self._counter = self._last_ms + 1, 0
+            value = (self._last_ms << (NODE_BITS + COUNTER_BITS)) | (self._node << COUNTER_BITS) | self._counter
+        return _encode(value)
+
+
+order_ids = OrderIdGenerator()
+
+
+def new_buy_order() -> str:
+    return "ORD" + order_ids.next_id()
+
+
+def new_session_id() -> str:
+    return "SES" + order_ids.next_id()
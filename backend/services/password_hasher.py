@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+from services.metrics import password_hash_duration
+from services.profiling import span
+
+load_dotenv()
+
+# bcrypt fuera del event loop. El hash tarda decenas de ms de CPU y mientras
+# corre en el loop todo el worker queda congelado (catalogo, pagos...).
+# Se usa un pool de threads porque bcrypt suelta el GIL mientras calcula,
+# asi varios hashes corren en paralelo sin el costo de procesos aparte.
+# La cola es acotada: si se llena, se rechaza de inmediato (503) en vez de
+# acumular logins esperando.
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "32"))
+
+# si cambia BCRYPT_ROUNDS, los hashes con otro costo quedan "deprecated"
+# y se vuelven a generar en el siguiente login exitoso
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, context: CryptContext = pwd_context, workers: int = PASSWORD_HASH_WORKERS,
+                 queue_size: int = PASSWORD_HASH_QUEUE_SIZE):
+        self.context = context
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self.stats = {"completed": 0, "failed": 0, "rejected": 0, "rehashed": 0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        # en ejecucion + esperando; el limite es la cantidad de workers mas la cola
+        if self._pending >= self.workers + self.queue_size:
+            self.stats["rejected"] += 1
+            raise HasherBusy()
+        self._pending += 1
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span(f"bcrypt {fn.__name__}"):
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+            outcome = "ok"
+            return result
+        finally:
+            # un hash invalido, el pool cerrado o un request cancelado no cuentan como completados
+            self._pending -= 1
+            self.stats["completed" if outcome == "ok" else "failed"] += 1
+            password_hash_duration.get(fn.__name__, outcome).observe(time.perf_counter() - started)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: Optional[str]) -> bool:
+        valid, _ = await self.verify_and_update(password, hashed_password)
+        return valid
+
+    async def verify_and_update(self, password: str, hashed_password: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """(valida, hash_nuevo); hash_nuevo no es None si hay que guardar un hash con el costo actual"""
+        if not hashed_password:
+            # usuarios de Google no tienen password
+            return False, None
+        valid, new_hash = await self._run(self.context.verify_and_update, password, hashed_password)
+        if new_hash is not None:
+            self.stats["rehashed"] += 1
+        return valid, new_hash
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": self._pending, "workers": self.workers, "queue_size": self.queue_size}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
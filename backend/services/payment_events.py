@@ -0,0 +1,174 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Optional
+
+from dotenv import load_dotenv
+from pymongo.errors import OperationFailure
+
+import database
+
+load_dotenv()
+
+# Hub en memoria para avisar cambios de estado de un pago a quien este
+# escuchando por SSE (/api/transactions/{token}/events).
+# commit_payment publica directo aqui; si Mongo soporta change streams
+# (replica set) tambien se escuchan, asi se enteran los demas procesos.
+# Sin change streams (Mongo standalone, o mientras se reconecta el stream)
+# se consulta cada PAYMENT_EVENTS_POLL_INTERVAL segundos el estado de los
+# pagos que tienen alguien escuchando.
+
+PAYMENT_EVENTS_POLL_INTERVAL = float(os.getenv("PAYMENT_EVENTS_POLL_INTERVAL", "1"))
+PAYMENT_EVENTS_RETRY_MIN = float(os.getenv("PAYMENT_EVENTS_RETRY_MIN", "1"))
+PAYMENT_EVENTS_RETRY_MAX = float(os.getenv("PAYMENT_EVENTS_RETRY_MAX", "60"))
+
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+# estados de Webpay que ya no cambian
+# (EXPIRED lo pone la reconciliacion cuando el pago nunca se completo)
+FINAL_STATUSES = {"AUTHORIZED", "FAILED", "REVERSED", "NULLIFIED", "PARTIALLY_NULLIFIED", "CAPTURED", "EXPIRED"}
+
+# lo unico que se manda al navegador (nada de webpay_response/commit_response)
+STATUS_PROJECTION = {"_id": 0, "token": 1, "buy_order": 1, "amount": 1, "status": 1,
+                     "response_code": 1, "updated_at": 1}
+
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+def status_payload(doc: dict) -> dict:
+    payload = {k: doc.get(k) for k in STATUS_PROJECTION if k != "_id"}
+    if isinstance(payload.get("updated_at"), datetime):
+        payload["updated_at"] = payload["updated_at"].isoformat()
+    return payload
+
+
+def is_final(payload: dict) -> bool:
+    return payload.get("status") in FINAL_STATUSES
+
+
+class PaymentEventHub:
+    def __init__(self, poll_interval: float = PAYMENT_EVENTS_POLL_INTERVAL,
+                 retry_min: float = PAYMENT_EVENTS_RETRY_MIN, retry_max: float = PAYMENT_EVENTS_RETRY_MAX):
+        self.poll_interval = poll_interval
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self._subscribers: dict = {}  # token -> set de colas
+        self._polled: dict = {}  # token -> ultimo status visto por polling
+        self._watch_task: Optional[asyncio.Task] = None
+        self.change_stream_active = False
+        self.polling = False
+        self.stats = {"published": 0, "delivered": 0, "dropped": 0, "streams_opened": 0, "watch_errors": 0, "polls": 0}
+
+    def subscribe(self, token: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(token, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, token: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(token)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[token]
+
+    def publish(self, token: str, payload: dict) -> None:
+        self.stats["published"] += 1
+        for queue in self._subscribers.get(token, ()):
+            if queue.full():
+                # cliente lento: se descarta el aviso mas viejo, lo que importa es el ultimo estado
+                queue.get_nowait()
+                self.stats["dropped"] += 1
+            queue.put_nowait(payload)
+            self.stats["delivered"] += 1
+
+    async def _follow_change_stream(self) -> None:
+        pipeline = [{"$match": {"operationType": "update",
+                                "updateDescription.updatedFields.status": {"$exists": True}}}]
+        try:
+            async with database.db["transactions"].watch(pipeline, full_document="updateLookup") as stream:
+                self.change_stream_active = True
+                self.stats["streams_opened"] += 1
+                async for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc and doc.get("token") in self._subscribers:
+                        self.publish(doc["token"], status_payload(doc))
+        finally:
+            self.change_stream_active = False
+
+    async def poll_once(self) -> int:
+        """Publica los cambios de status de los pagos con suscriptores; retorna cuantos"""
+        self.stats["polls"] += 1
+        # olvidar los tokens que ya nadie escucha
+        for token in self._polled.keys() - self._subscribers.keys():
+            del self._polled[token]
+        tokens = list(self._subscribers)
+        if not tokens:
+            return 0
+        changed = 0
+        async for doc in database.db["transactions"].find({"token": {"$in": tokens}}, STATUS_PROJECTION):
+            # el SSE descarta repetidos, pero asi no se llenan las colas cada intervalo
+            if self._polled.get(doc["token"]) != doc.get("status"):
+                self._polled[doc["token"]] = doc.get("status")
+                self.publish(doc["token"], status_payload(doc))
+                changed += 1
+        return changed
+
+    async def _poll_for(self, seconds: float) -> None:
+        self.polling = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        try:
+            while loop.time() < deadline:
+                try:
+                    await self.poll_once()
+                except Exception as e:
+                    print(f"Error consultando estados de pago: {type(e).__name__}: {str(e)}")
+                await asyncio.sleep(max(0.0, min(self.poll_interval, deadline - loop.time())))
+        finally:
+            self.polling = False
+
+    async def _watch(self) -> None:
+        delay = self.retry_min
+        last_error = None
+        while True:
+            opened = self.stats["streams_opened"]
+            try:
+                await self._follow_change_stream()
+                # el stream se cerro sin error (invalidate): se vuelve a abrir
+                delay = self.retry_min
+            except Exception as e:
+                self.stats["watch_errors"] += 1
+                if self.stats["streams_opened"] > opened:
+                    # alcanzo a funcionar: el backoff parte de nuevo
+                    delay = self.retry_min
+                if isinstance(e, OperationFailure) and e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    # Mongo standalone: polling y de vez en cuando se vuelve a probar
+                    delay = self.retry_max
+                error = f"{type(e).__name__}: {str(e)}"
+                if error != last_error:
+                    print(f"Change streams no disponibles para transactions ({error}), se usa polling")
+                    last_error = error
+            # mientras se reintenta el stream, los suscriptores se enteran por polling
+            await self._poll_for(delay)
+            delay = min(delay * 2, self.retry_max)
+
+    def start(self) -> None:
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "subscribers": sum(len(q) for q in self._subscribers.values()),
+                "change_stream_active": self.change_stream_active, "polling": self.polling}
+
+
+payment_events = PaymentEventHub()
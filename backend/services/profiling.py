@@ -0,0 +1,330 @@
+import asyncio
+import heapq
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi.routing import APIRoute
+
+from services.order_ids import order_ids
+
+load_dotenv()
+
+# Diagnostico de requests lentos, solo para administradores (ADMIN_TOKEN).
+#
+# - Spans: cada request lleva en un ContextVar la lista de pasos medidos
+#   (decode del JWT, comandos de Mongo, llamadas a Webpay/Google/OFF, bcrypt,
+#   endpoint y serializacion de la respuesta).
+# - Requests lentos: los que pasan SLOW_REQUEST_THRESHOLD_MS quedan con sus
+#   spans; se guardan los SLOW_REQUEST_KEEP mas lentos (un heap por duracion).
+#   En las respuestas en stream (SSE, NDJSON) la conexion dura lo que dure el
+#   cliente, asi que se mide hasta el primer trozo del cuerpo (TTFB).
+# - Profiler por muestreo: un thread mira la pila del event loop cada
+#   PROFILE_INTERVAL_MS, solo mientras haya algo que perfilar. Se activa por
+#   una ventana de tiempo (POST /admin/profile) o para un request puntual con
+#   el header "X-Profile: <ADMIN_TOKEN>". El resultado es un archivo de
+#   speedscope (https://www.speedscope.app).
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "500"))
+SLOW_REQUEST_KEEP = int(os.getenv("SLOW_REQUEST_KEEP", "50"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "10"))
+MAX_SPANS_PER_REQUEST = 200
+PROFILE_HEADER = b"x-profile"
+
+# tarea que esta corriendo en cada loop (lo que usa asyncio.current_task por dentro)
+_current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+
+
+def is_admin_token(value: Optional[str]) -> bool:
+    # sin ADMIN_TOKEN configurado no hay acceso de administrador
+    return bool(ADMIN_TOKEN) and value is not None and hmac.compare_digest(value, ADMIN_TOKEN)
+
+
+# ---- spans por request ----
+
+class RequestTrace:
+    __slots__ = ("started", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        # se llama tambien desde los threads de Motor: list.append es atomico
+        if len(self.spans) < MAX_SPANS_PER_REQUEST:
+            self.spans.append((name, start - self.started, duration))
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Mide un paso del request en curso (no hace nada fuera de un request)"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter() - started)
+
+
+def record_span(name: str, duration: float) -> None:
+    """Agrega un paso que ya termino (p.ej. un comando de Mongo medido por pymongo)"""
+    trace = current_trace.get()
+    if trace is not None:
+        now = time.perf_counter()
+        trace.add(name, now - duration, duration)
+
+
+class TracedRoute(APIRoute):
+    """Ruta que separa el tiempo del endpoint del de serializar la respuesta"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            async def timed_endpoint(**values):
+                trace = current_trace.get()
+                if trace is None:
+                    return await call(**values)
+                started = time.perf_counter()
+                try:
+                    return await call(**values)
+                finally:
+                    ended = time.perf_counter()
+                    trace.add("endpoint", started, ended - started)
+                    _endpoint_ended.set(ended)
+            self.dependant.call = timed_endpoint
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            _endpoint_ended.set(None)
+            response = await handler(request)
+            trace, ended = current_trace.get(), _endpoint_ended.get()
+            if trace is not None and ended is not None:
+                # despues del endpoint: validar y serializar la respuesta con pydantic
+                trace.add("serialize", ended, time.perf_counter() - ended)
+            return response
+        return traced_handler
+
+
+_endpoint_ended: ContextVar[Optional[float]] = ContextVar("endpoint_ended", default=None)
+
+
+# ---- requests lentos ----
+
+class SlowRequestRecorder:
+    """Los `keep` requests mas lentos vistos (no los ultimos)"""
+
+    def __init__(self, threshold_ms: float = SLOW_REQUEST_THRESHOLD_MS, keep: int = SLOW_REQUEST_KEEP):
+        self.threshold_ms = threshold_ms
+        self.keep = keep
+        self._heap = []  # min-heap (duracion, orden, entrada): la raiz es la que sale primero
+        self._count = 0
+
+    def record(self, entry: dict) -> None:
+        self._count += 1
+        item = (entry["duration_ms"], self._count, entry)
+        if len(self._heap) < self.keep:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def slowest(self) -> list:
+        return [entry for _, _, entry in sorted(self._heap, reverse=True)]
+
+    def clear(self) -> None:
+        self._heap.clear()
+
+
+slow_requests = SlowRequestRecorder()
+
+
+# ---- profiler por muestreo ----
+
+class ProfileSession:
+    def __init__(self, name: str, task: Optional[asyncio.Task] = None):
+        self.id = "PRF" + order_ids.next_id()
+        self.name = name
+        self.task = task  # None: todo lo que corra en el loop
+        self.samples = []
+        self.started = time.perf_counter()
+        self.ended: Optional[float] = None
+        self.created_at = datetime.now()
+
+    def to_speedscope(self, interval: float) -> dict:
+        frames, index = [], {}
+        samples = []
+        for stack in self.samples:
+            ids = []
+            for code in stack:
+                i = index.get(code)
+                if i is None:
+                    i = index[code] = len(frames)
+                    frames.append({"name": getattr(code, "co_qualname", code.co_name),
+                                   "file": code.co_filename, "line": code.co_firstlineno})
+                ids.append(i)
+            samples.append(ids)
+        duration = (self.ended or time.perf_counter()) - self.started
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "prototipo_tienda",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(duration, 6),
+                "samples": samples,
+                "weights": [interval] * len(samples),
+            }],
+        }
+
+    def summary(self) -> dict:
+        return {"id": self.id, "name": self.name, "samples": len(self.samples),
+                "created_at": self.created_at.isoformat(),
+                "duration_ms": round(((self.ended or time.perf_counter()) - self.started) * 1000, 3)}
+
+
+class SamplingProfiler:
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, keep: int = PROFILE_KEEP):
+        self.interval = interval_ms / 1000
+        self._sessions: list = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop = None
+        self._loop_thread_id = None
+        self.finished = OrderedDict()  # id -> sesion, las ultimas `keep`
+        self.keep = keep
+
+    def start_session(self, name: str, task: Optional[asyncio.Task] = None) -> ProfileSession:
+        session = ProfileSession(name, task)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread_id = threading.get_ident()
+            self._sessions.append(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._thread.start()
+        return session
+
+    def stop_session(self, session: ProfileSession) -> ProfileSession:
+        session.ended = time.perf_counter()
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+        self.finished[session.id] = session
+        while len(self.finished) > self.keep:
+            self.finished.popitem(last=False)
+        return session
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self._lock:
+                if not self._sessions:
+                    # nada que perfilar: el thread termina y no cuesta nada
+                    self._thread = None
+                    return
+                sessions = list(self._sessions)
+                loop, thread_id = self._loop, self._loop_thread_id
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                running = _current_tasks.get(loop) if _current_tasks is not None else None
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()  # speedscope quiere la raiz primero
+                stack = tuple(stack)
+                for session in sessions:
+                    if session.task is None or running is None or session.task is running:
+                        session.samples.append(stack)
+            time.sleep(self.interval)
+
+    async def profile_window(self, seconds: float) -> ProfileSession:
+        session = self.start_session(f"ventana de {seconds}s")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.stop_session(session)
+        return session
+
+
+profiler = SamplingProfiler()
+
+
+# ---- middleware ----
+
+class ProfilingMiddleware:
+    """Mide los spans de cada request, guarda los lentos y perfila los pedidos con X-Profile"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        status_holder = [500]
+        first_body = [None, False]  # momento del primer trozo del cuerpo, si es un stream
+        session = None
+        if ADMIN_TOKEN:
+            for key, value in scope["headers"]:
+                if key == PROFILE_HEADER and is_admin_token(value.decode("latin-1")):
+                    session = profiler.start_session(f"{scope['method']} {scope['path']}", asyncio.current_task())
+                    break
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+                if session is not None:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", session.id.encode())]
+            elif message["type"] == "http.response.body" and first_body[0] is None:
+                first_body[:] = [time.perf_counter(), message.get("more_body", False)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            first_body_at, streaming = first_body
+            # un stream se mide hasta su primer trozo: el resto es el cliente escuchando
+            ended = first_body_at if streaming else time.perf_counter()
+            duration_ms = (ended - trace.started) * 1000
+            current_trace.reset(token)
+            if session is not None:
+                profiler.stop_session(session)
+            if duration_ms >= slow_requests.threshold_ms:
+                route = scope.get("route")
+                slow_requests.record({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": getattr(route, "path", None),
+                    "status": status_holder[0],
+                    "duration_ms": round(duration_ms, 3),
+                    "streaming": streaming,
+                    "started_at": (datetime.now() - timedelta(milliseconds=duration_ms)).isoformat(),
+                    "profile_id": session.id if session is not None else None,
+                    "spans": [{"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(d * 1000, 3)}
+                              for name, start, d in trace.spans],
+                })
@@ -0,0 +1,240 @@
+import asyncio
+import os
+import secrets
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import database
+from services import inventory
+from services.carts import cart_store
+from services.http_clients import http_clients
+from services.payment_events import FINAL_STATUSES, payment_events, status_payload
+from services.sales_rollups import record_sale
+from services.webpay import WEBPAY_CONFIG, webpay_headers
+
+load_dotenv()
+
+# Reconciliacion de pagos que quedaron "pending" (el usuario pago y cerro el
+# navegador antes de volver a commit_payment). Cada RECONCILE_INTERVAL se
+# buscan las transacciones pendientes mas viejas que RECONCILE_STALE_AFTER,
+# se consulta su estado en Webpay (concurrencia y tasa acotadas). Las que
+# llegaron a un estado final se actualizan una a una (solo si siguen
+# "pending"); las que siguen igual se marcan revisadas con un bulk_write.
+#
+# Solo una replica lo ejecuta: la que tiene el lease en la coleccion "locks".
+
+RECONCILE_ENABLED = os.getenv("RECONCILE_ENABLED", "1") == "1"
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "60"))
+RECONCILE_STALE_AFTER = float(os.getenv("RECONCILE_STALE_AFTER", "600"))  # 10 min sin commit
+RECONCILE_EXPIRE_AFTER = float(os.getenv("RECONCILE_EXPIRE_AFTER", "3600"))  # INITIALIZED por 1 hora = abandonado
+RECONCILE_RECHECK_AFTER = float(os.getenv("RECONCILE_RECHECK_AFTER", "300"))
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "200"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "8"))
+RECONCILE_RATE = float(os.getenv("RECONCILE_RATE", "10"))  # consultas por segundo a Webpay
+RECONCILE_LEASE_TTL = float(os.getenv("RECONCILE_LEASE_TTL", "180"))
+
+LEASE_ID = "payment_reconciler"
+
+# estado propio (no de Webpay) para los pagos que nunca se completaron
+EXPIRED_STATUS = "EXPIRED"
+
+
+class RateLimiter:
+    """Reparte las llamadas para no pasar de `rate` por segundo"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class PaymentReconciler:
+    def __init__(self, interval: float = RECONCILE_INTERVAL, stale_after: float = RECONCILE_STALE_AFTER,
+                 expire_after: float = RECONCILE_EXPIRE_AFTER, recheck_after: float = RECONCILE_RECHECK_AFTER,
+                 batch_size: int = RECONCILE_BATCH_SIZE, concurrency: int = RECONCILE_CONCURRENCY,
+                 rate: float = RECONCILE_RATE, lease_ttl: float = RECONCILE_LEASE_TTL):
+        self.interval = interval
+        self.stale_after = stale_after
+        self.expire_after = expire_after
+        self.recheck_after = recheck_after
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate = rate
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"passes": 0, "checked": 0, "updated": 0, "expired": 0, "errors": 0,
+                      "last_pass_at": None, "last_pass_seconds": None}
+
+    async def acquire_lease(self) -> bool:
+        """Toma (o renueva) el lease; False si otra replica lo tiene vigente"""
+        now = datetime.now()
+        try:
+            await database.db["locks"].find_one_and_update(
+                {"_id": LEASE_ID, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.lease_ttl)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self.is_leader = True
+        except DuplicateKeyError:
+            # el documento existe y es de otro: el upsert choca con su _id
+            self.is_leader = False
+        return self.is_leader
+
+    async def release_lease(self) -> None:
+        if self.is_leader:
+            await database.db["locks"].delete_one({"_id": LEASE_ID, "owner": self.owner})
+            self.is_leader = False
+
+    async def _fetch_status(self, token: str, limiter: RateLimiter, semaphore: asyncio.Semaphore):
+        url = f"{WEBPAY_CONFIG['base_url']}/rswebpaytransaction/api/webpay/v1.2/transactions/{token}"
+        async with semaphore:
+            await limiter.wait()
+            try:
+                # GET es idempotente: http_clients reintenta errores de red y 5xx
+                response = await http_clients.request("webpay", "GET", url, headers=webpay_headers())
+            except httpx.HTTPError as e:
+                print(f"Error consultando estado de {token} en WebPay: {str(e)}")
+                return None
+        if response.status_code >= 500:
+            return None
+        return response
+
+    def _plan_update(self, transaction: dict, response: Optional[httpx.Response], now: datetime):
+        """Que cambiar en la transaccion segun la respuesta de Webpay (None = solo marcar revisada)"""
+        if response is not None and response.status_code == 200:
+            data = response.json()
+            if not isinstance(data, dict):
+                raise ValueError(f"se esperaba un objeto JSON, llego {type(data).__name__}")
+            if data.get("status") in FINAL_STATUSES:
+                return {
+                    "status": data.get("status"),
+                    "response_code": data.get("response_code"),
+                    "response_description": data.get("response_description"),
+                    "updated_at": now,
+                    "status_response": data,
+                }
+        # INITIALIZED o token que Webpay ya no reconoce (4xx): si paso mucho tiempo se da por abandonado
+        too_old = transaction["created_at"] < now - timedelta(seconds=self.expire_after)
+        if response is not None and response.status_code < 500 and too_old:
+            return {"status": EXPIRED_STATUS, "updated_at": now}
+        return None
+
+    async def run_once(self) -> dict:
+        """Una pasada sobre las transacciones pendientes viejas"""
+        started = time.perf_counter()
+        now = datetime.now()
+        query = {
+            "status": "pending",
+            "created_at": {"$lt": now - timedelta(seconds=self.stale_after)},
+            "$or": [{"reconciled_at": {"$exists": False}},
+                    {"reconciled_at": {"$lt": now - timedelta(seconds=self.recheck_after)}}],
+        }
+        transactions = await database.db["transactions"].find(
+            query, {"token": 1, "created_at": 1, "amount": 1, "reservation_id": 1, "user_email": 1}
+        ).sort("created_at", 1).limit(self.batch_size).to_list(self.batch_size)
+
+        limiter = RateLimiter(self.rate)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        responses = await asyncio.gather(
+            *(self._fetch_status(t["token"], limiter, semaphore) for t in transactions)
+        )
+
+        unchanged = []
+        result = {"checked": len(transactions), "updated": 0, "expired": 0, "errors": 0}
+        for transaction, response in zip(transactions, responses):
+            if response is None:
+                result["errors"] += 1
+                continue
+            try:
+                update = self._plan_update(transaction, response, now)
+            except (ValueError, KeyError, TypeError) as e:
+                # cuerpo inesperado de Webpay: se salta esta transaccion, no la pasada completa
+                print(f"Respuesta inesperada de WebPay para {transaction['token']}: {str(e)}")
+                result["errors"] += 1
+                # marcada como revisada: se reintenta tras recheck_after, no en cada pasada
+                unchanged.append(UpdateOne({"_id": transaction["_id"], "status": "pending"},
+                                           {"$set": {"reconciled_at": now}}))
+                continue
+            if update is None:
+                unchanged.append(UpdateOne({"_id": transaction["_id"], "status": "pending"},
+                                           {"$set": {"reconciled_at": now}}))
+                continue
+            # el filtro por status evita pisar un commit_payment que llego mientras tanto;
+            # si no calzo, el commit ya registro la venta y liquido el stock
+            previous = await database.db["transactions"].find_one_and_update(
+                {"_id": transaction["_id"], "status": "pending"},
+                {"$set": {"reconciled_at": now, **update}},
+                projection={"_id": 1},
+            )
+            if previous is None:
+                continue
+            doc = {**transaction, **update}
+            result["expired" if update["status"] == EXPIRED_STATUS else "updated"] += 1
+            payment_events.publish(doc["token"], status_payload(doc))
+            await record_sale(doc)
+            await inventory.settle(doc)
+            await cart_store.clear_paid(doc)
+
+        if unchanged:
+            await database.db["transactions"].bulk_write(unchanged, ordered=False)
+
+        self.stats["passes"] += 1
+        for key in ("checked", "updated", "expired", "errors"):
+            self.stats[key] += result[key]
+        self.stats["last_pass_at"] = now.isoformat()
+        self.stats["last_pass_seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                if await self.acquire_lease():
+                    await self.run_once()
+            except Exception as e:
+                # cualquier error (Mongo, Webpay, un bug) se registra y el worker sigue vivo;
+                # CancelledError no hereda de Exception y detiene el loop en stop()
+                self.stats["errors"] += 1
+                print(f"Error reconciliando pagos pendientes: {type(e).__name__}: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if RECONCILE_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            try:
+                # soltar el lease para que otra replica no espere a que expire
+                await self.release_lease()
+            except PyMongoError:
+                pass
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "enabled": RECONCILE_ENABLED, "is_leader": self.is_leader, "owner": self.owner}
+
+
+payment_reconciler = PaymentReconciler()
@@ -0,0 +1,189 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import database
+
+# Acceso a users y transactions con proyecciones: cada metodo declara los
+# campos que necesita y retorna un registro liviano (dataclass con slots) en
+# vez del documento completo. Los documentos llegan como RawBSONDocument, asi
+# los bytes leidos salen del BSON sin volver a codificar, y se cuentan por
+# metodo (/diagnostics/repositories).
+
+RAW_CODEC = CodecOptions(document_class=RawBSONDocument)
+
+
+class RepositoryStats:
+    def __init__(self):
+        self.methods: dict = {}
+
+    def record(self, method: str, doc) -> None:
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = {"calls": 0, "documents": 0, "bytes": 0}
+        stats["calls"] += 1
+        if doc is not None:
+            stats["documents"] += 1
+            stats["bytes"] += document_size(doc)
+
+    def get_stats(self) -> dict:
+        return {method: {**stats, "bytes_per_call": round(stats["bytes"] / stats["calls"], 1)}
+                for method, stats in self.methods.items()}
+
+
+repository_stats = RepositoryStats()
+
+
+def document_size(doc) -> int:
+    raw = getattr(doc, "raw", None)
+    # sin RawBSONDocument (p.ej. mongomock) el tamaño se calcula re-codificando
+    return len(raw) if raw is not None else len(bson.encode(doc))
+
+
+def raw_collection(name: str):
+    collection = database.db[name]
+    try:
+        return collection.with_options(codec_options=RAW_CODEC)
+    except NotImplementedError:
+        return collection
+
+
+# ---- usuarios ----
+
+@dataclass(frozen=True, slots=True)
+class UserProfile:
+    """Lo que ven las rutas del usuario autenticado (nunca el hash)"""
+    id: str
+    email: str
+    full_name: Optional[str]
+    google_id: Optional[str]
+
+
+@dataclass(frozen=True, slots=True)
+class UserCredentials:
+    id: bson.ObjectId
+    email: str
+    hashed_password: Optional[str]
+
+
+class UserRepository:
+    PROFILE = {"email": 1, "full_name": 1, "google_id": 1}
+    CREDENTIALS = {"email": 1, "hashed_password": 1}
+
+    def collection(self):
+        return raw_collection("users")
+
+    @staticmethod
+    def _profile(doc) -> UserProfile:
+        return UserProfile(str(doc["_id"]), doc["email"], doc.get("full_name"), doc.get("google_id"))
+
+    async def find_profile(self, email: str) -> Optional[UserProfile]:
+        doc = await self.collection().find_one({"email": email}, self.PROFILE)
+        repository_stats.record("users.find_profile", doc)
+        return self._profile(doc) if doc is not None else None
+
+    async def find_credentials(self, email: str) -> Optional[UserCredentials]:
+        doc = await self.collection().find_one({"email": email}, self.CREDENTIALS)
+        repository_stats.record("users.find_credentials", doc)
+        if doc is None:
+            return None
+        return UserCredentials(doc["_id"], doc["email"], doc.get("hashed_password"))
+
+    async def exists(self, email: str) -> bool:
+        doc = await self.collection().find_one({"email": email}, {"_id": 1})
+        repository_stats.record("users.exists", doc)
+        return doc is not None
+
+    async def upsert_google(self, email: str, google_id: str, name: str) -> UserProfile:
+        """Crea el usuario de Google o completa el google_id que le falte, en una sola operacion"""
+        update = [{"$set": {
+            # $ifNull: lo que ya tenga el usuario se respeta
+            "google_id": {"$ifNull": ["$google_id", google_id]},
+            "full_name": {"$ifNull": ["$full_name", name]},
+            "hashed_password": {"$ifNull": ["$hashed_password", None]},
+        }}]
+        try:
+            doc = await self.collection().find_one_and_update(
+                {"email": email}, update, projection=self.PROFILE, upsert=True,
+                return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # dos callbacks simultaneos de un usuario nuevo: el otro lo creo, ahora existe
+            doc = await self.collection().find_one_and_update(
+                {"email": email}, update, projection=self.PROFILE, return_document=ReturnDocument.AFTER)
+        repository_stats.record("users.upsert_google", doc)
+        return self._profile(doc)
+
+
+users = UserRepository()
+
+
+# ---- transacciones ----
+
+@dataclass(frozen=True, slots=True)
+class TransactionStatus:
+    """Estado publico de un pago (sin las respuestas completas de Webpay)"""
+    token: Optional[str]
+    buy_order: Optional[str]
+    amount: Optional[int]
+    status: Optional[str]
+    response_code: Optional[int]
+    response_description: Optional[str]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+@dataclass(frozen=True, slots=True)
+class IdempotentPayment:
+    id: bson.ObjectId
+    amount: Optional[int]
+    status: Optional[str]
+    created_at: Optional[datetime]
+    payment_response: Optional[dict]
+
+
+class TransactionRepository:
+    STATUS = {"_id": 0, **{field: 1 for field in TransactionStatus.__slots__}}
+    IDEMPOTENT = {"amount": 1, "status": 1, "created_at": 1, "payment_response": 1}
+
+    def collection(self):
+        return raw_collection("transactions")
+
+    async def find_status(self, token: str) -> Optional[TransactionStatus]:
+        doc = await self.collection().find_one({"token": token}, self.STATUS)
+        repository_stats.record("transactions.find_status", doc)
+        if doc is None:
+            return None
+        return TransactionStatus(*(doc.get(field) for field in TransactionStatus.__slots__))
+
+    async def find_idempotent(self, idempotency_key: str) -> Optional[IdempotentPayment]:
+        doc = await self.collection().find_one({"idempotency_key": idempotency_key}, self.IDEMPOTENT)
+        repository_stats.record("transactions.find_idempotent", doc)
+        if doc is None:
+            return None
+        payment_response = doc.get("payment_response")
+        return IdempotentPayment(doc["_id"], doc.get("amount"), doc.get("status"), doc.get("created_at"),
+                                 dict(payment_response) if payment_response else None)
+
+    async def record_commit(self, token: str, update: dict, commit_response: dict,
+                            projection: dict) -> Optional[dict]:
+        """Guarda el resultado del commit; retorna los campos pedidos como estaban antes"""
+        doc = await self.collection().find_one_and_update(
+            {"token": token},
+            {"$set": {**update, "commit_response": commit_response}},
+            projection=projection,
+            return_document=ReturnDocument.BEFORE,
+        )
+        repository_stats.record("transactions.record_commit", doc)
+        return dict(doc) if doc is not None else None
+
+
+transactions = TransactionRepository()
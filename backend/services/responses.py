@@ -0,0 +1,52 @@
+from decimal import Decimal
+from typing import Optional
+
+import orjson
+from bson import ObjectId
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+from schemas.productos_schemas import Product
+from schemas.schemas import User
+from schemas.webpay_schemas import PaymentResponse
+
+# Respuestas JSON sin pasar por jsonable_encoder.
+#
+# - json_response: datos internos de confianza (documentos de Mongo, dicts que
+#   ya armamos nosotros) directo a bytes con orjson. datetime sale en ISO igual
+#   que antes; ObjectId como string.
+# - model_response: modelos de pydantic con un TypeAdapter ya compilado, sin
+#   volver a validar lo que la ruta acaba de construir.
+# Las rutas que devuelven un Response se saltan la validacion y serializacion
+# de FastAPI; el response_model se deja igual para la documentacion.
+
+PRODUCT = TypeAdapter(Product)
+USER = TypeAdapter(User)
+PAYMENT_RESPONSE = TypeAdapter(PaymentResponse)
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"{type(value).__name__} no es serializable a JSON")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def json_response(content, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    return Response(content=dumps(content), status_code=status_code, headers=headers,
+                    media_type="application/json")
+
+
+def model_response(adapter: TypeAdapter, value, status_code: int = 200,
+                   headers: Optional[dict] = None) -> Response:
+    return Response(content=adapter.dump_json(value), status_code=status_code, headers=headers,
+                    media_type="application/json")
@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from pymongo import UpdateOne
+
+import database
+from services.payment_events import FINAL_STATUSES
+
+# Resumenes de ventas por hora y por dia. Se actualizan con $inc cada vez
+# que una transaccion pasa a un estado final, asi los reportes leen unas
+# pocas filas en vez de agregar sobre transactions (que trae las respuestas
+# completas de Webpay).
+#
+# Documento por bucket: _id = inicio del bucket, count, authorized_count,
+# authorized_amount, rejected_count, rejections {response_code: n},
+# statuses {status: n}
+
+GRANULARITIES = {"hour": "sales_hourly", "day": "sales_daily"}
+BACKFILL_BATCH_SIZE = 1000
+
+# lo unico que se lee de transactions para armar los resumenes
+ROLLUP_PROJECTION = {"_id": 0, "status": 1, "amount": 1, "response_code": 1, "updated_at": 1, "created_at": 1}
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def sale_increments(transaction: dict) -> Optional[dict]:
+    """Campos a sumar en el bucket por una transaccion final (None si no es final)"""
+    status = transaction.get("status")
+    if status not in FINAL_STATUSES:
+        return None
+    inc = {"count": 1, f"statuses.{status}": 1}
+    if status == "AUTHORIZED":
+        inc["authorized_count"] = 1
+        inc["authorized_amount"] = transaction.get("amount") or 0
+    else:
+        inc["rejected_count"] = 1
+        if transaction.get("response_code") is not None:
+            inc[f"rejections.{transaction['response_code']}"] = 1
+    return inc
+
+
+def sale_moment(transaction: dict) -> datetime:
+    return transaction.get("updated_at") or transaction.get("created_at") or datetime.now()
+
+
+async def record_sale(transaction: dict) -> None:
+    """Suma una transaccion que acaba de pasar a estado final a los buckets de hora y dia"""
+    inc = sale_increments(transaction)
+    if inc is None:
+        return
+    moment = sale_moment(transaction)
+    await asyncio.gather(*(
+        database.db[collection].update_one({"_id": bucket_start(moment, granularity)}, {"$inc": inc}, upsert=True)
+        for granularity, collection in GRANULARITIES.items()
+    ))
+
+
+def _empty_bucket() -> dict:
+    return {"count": 0, "authorized_count": 0, "authorized_amount": 0, "rejected_count": 0,
+            "rejections": {}, "statuses": {}}
+
+
+def _add(total: dict, bucket: dict) -> None:
+    for key in ("count", "authorized_count", "authorized_amount", "rejected_count"):
+        total[key] += bucket.get(key, 0)
+    for key in ("rejections", "statuses"):
+        for code, n in bucket.get(key, {}).items():
+            total[key][code] = total[key].get(code, 0) + n
+
+
+async def get_sales(start: datetime, end: datetime, granularity: str) -> dict:
+    """Buckets en [start, end) leidos solo de los resumenes"""
+    collection = database.db[GRANULARITIES[granularity]]
+    cursor = collection.find({"_id": {"$gte": bucket_start(start, granularity), "$lt": end}}).sort("_id", 1)
+    buckets, totals = [], _empty_bucket()
+    async for doc in cursor:
+        bucket = {**_empty_bucket(), **doc}
+        bucket["start"] = bucket.pop("_id")
+        buckets.append(bucket)
+        _add(totals, bucket)
+    return {"granularity": granularity, "from": start, "to": end, "buckets": buckets, "totals": totals}
+
+
+async def backfill(batch_size: int = BACKFILL_BATCH_SIZE) -> dict:
+    """Reconstruye los resumenes desde transactions, leyendo por lotes.
+
+    Se arman en colecciones temporales y se reemplazan al final con rename,
+    asi los reportes nunca ven resumenes a medio construir. Los pagos que
+    se cierren mientras corre pueden quedar fuera: correrlo con poco trafico.
+    """
+    buckets = {granularity: {} for granularity in GRANULARITIES}
+    scanned = 0
+    cursor = database.db["transactions"].find(
+        {"status": {"$in": sorted(FINAL_STATUSES)}}, ROLLUP_PROJECTION
+    ).batch_size(batch_size)
+    async for transaction in cursor:
+        scanned += 1
+        inc = sale_increments(transaction)
+        moment = sale_moment(transaction)
+        for granularity, acc in buckets.items():
+            start = bucket_start(moment, granularity)
+            current = acc.setdefault(start, {})
+            for key, n in inc.items():
+                current[key] = current.get(key, 0) + n
+        if scanned % batch_size == 0:
+            print(f"{scanned} transacciones procesadas")
+
+    for granularity, collection in GRANULARITIES.items():
+        staging = database.db[f"{collection}_rebuild"]
+        await staging.drop()
+        operations = [UpdateOne({"_id": start}, {"$inc": inc}, upsert=True)
+                      for start, inc in buckets[granularity].items()]
+        for i in range(0, len(operations), batch_size):
+            await staging.bulk_write(operations[i:i + batch_size], ordered=False)
+        if operations:
+            await staging.rename(collection, dropTarget=True)
+        else:
+            await database.db[collection].drop()
+    return {"transactions": scanned, **{g: len(b) for g, b in buckets.items()}}
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m services.sales_rollups backfill [batch_size]
+    if sys.argv[1:2] == ["backfill"]:
+        size = int(sys.argv[2]) if len(sys.argv) > 2 else BACKFILL_BATCH_SIZE
+        print(asyncio.run(backfill(size)))
+    else:
+        print("uso: python -m services.sales_rollups backfill [batch_size]")
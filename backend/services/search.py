@@ -0,0 +1,461 @@
+import bisect
+import heapq
+import json
+import math
+import re
+import struct
+import unicodedata
+from array import array
+from typing import Iterable, Optional
+
+# Busqueda de productos con indice invertido en memoria.
+# - los textos se pasan a minusculas y sin tildes ("Clásica" -> "clasica")
+# - el ultimo termino de la consulta se busca por prefijo (type-ahead)
+# - ranking BM25, con mas peso para el nombre que para la descripcion
+# - se actualiza por producto (upsert/remove), no se reconstruye entero
+# - con serve.py el constructor lo empaqueta (pack) en la memoria compartida y
+#   los workers buscan directo sobre esos bytes (PackedSearchIndex)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+MAX_PREFIX_EXPANSIONS = 50
+PREFIX_PENALTY = 0.8  # un match por prefijo vale un poco menos que uno exacto
+RANKED_MIN_POSTINGS = 1000  # terminos muy comunes guardan sus documentos ya ordenados por puntaje
+MAX_CANDIDATES = 2000  # con varios tokens muy comunes se puntuan solo los mejores candidatos del primero
+# las normas usan un largo promedio de referencia: un upsert solo calcula la norma
+# de su documento, y todas se recalculan cuando el promedio real se aleja mas que esto
+NORM_REBUILD_DRIFT = 0.05
+
+# indice empaquetado: MAGIC | docs, terminos, postings | secciones alineadas a 8 bytes
+PACK_HEADER = struct.Struct("<8sIII")
+PACK_MAGIC = b"SRCHIDX1"
+
+
+def fold(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(fold(text))
+
+
+class SearchIndex:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: dict = {}  # termino -> {id: tf ponderado}
+        self._doc_terms: dict = {}  # id -> {termino: tf ponderado}
+        self._doc_len: dict = {}
+        self._total_len = 0.0
+        self._terms: list = []  # terminos ordenados, para buscar por prefijo
+        self._docs: dict = {}
+        self._avg_len: Optional[float] = None  # largo promedio con el que se calcularon las normas
+        self._norms: dict = {}  # normalizacion por largo
+        # termino -> [(-tf saturado, id)] de mayor a menor puntaje; el idf es el mismo
+        # para todo el termino, asi que no cambia el orden y se multiplica al buscar
+        self._ranked: dict = {}
+        self._packed: Optional["PackedSearchIndex"] = None  # worker de serve.py
+
+    def __len__(self):
+        if self._packed is not None:
+            return len(self._packed)
+        return len(self._docs)
+
+    def _analyze(self, product: dict) -> dict:
+        terms = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(str(product.get(field) or "")):
+                terms[token] = terms.get(token, 0.0) + weight
+        return terms
+
+    def _norm(self, length: float) -> float:
+        return self.k1 * (1 - self.b + self.b * length / self._avg_len)
+
+    def _saturated(self, tf: float, norm: float) -> float:
+        return tf * (self.k1 + 1) / (tf + norm)
+
+    def upsert(self, product: dict) -> None:
+        doc_id = product["id"]
+        if doc_id in self._docs:
+            self.remove(doc_id)
+        terms = self._analyze(product)
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[doc_id] = tf
+        self._doc_terms[doc_id] = terms
+        length = sum(terms.values())
+        self._doc_len[doc_id] = length
+        self._total_len += length
+        self._docs[doc_id] = product
+        if self._avg_len is not None:
+            # solo la norma de este documento y su lugar en las listas ya ordenadas
+            norm = self._norms[doc_id] = self._norm(length)
+            for term, tf in terms.items():
+                ranked = self._ranked.get(term)
+                if ranked is not None:
+                    bisect.insort(ranked, (-self._saturated(tf, norm), doc_id))
+
+    def remove(self, doc_id) -> None:
+        if doc_id not in self._docs:
+            return
+        norm = self._norms.pop(doc_id, None)
+        for term, tf in self._doc_terms.pop(doc_id).items():
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+                self._ranked.pop(term, None)
+                continue
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                entry = (-self._saturated(tf, norm), doc_id) if norm is not None else None
+                i = bisect.bisect_left(ranked, entry) if entry is not None else len(ranked)
+                if i < len(ranked) and ranked[i] == entry:
+                    del ranked[i]
+                else:
+                    # no deberia pasar; se vuelve a ordenar en la proxima busqueda
+                    del self._ranked[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+        del self._docs[doc_id]
+        if not self._docs:
+            self._avg_len = None
+            self._ranked = {}
+
+    def _get_norms(self) -> dict:
+        avg_len = self._total_len / len(self._docs) or 1.0
+        if self._avg_len is None or abs(avg_len - self._avg_len) > NORM_REBUILD_DRIFT * self._avg_len:
+            self._avg_len = avg_len
+            self._norms = {d: self._norm(length) for d, length in self._doc_len.items()}
+            self._ranked = {}
+        return self._norms
+
+    def warm(self) -> None:
+        """Calcula las normas de una vez (para no pagarlo en la primera busqueda)"""
+        if self._docs:
+            self._get_norms()
+
+    def replace(self, other: "SearchIndex") -> None:
+        """Toma todo el contenido de otro indice, por ejemplo uno armado en otro hilo"""
+        self.__dict__.update(other.__dict__)
+
+    def use_packed(self, packed: "PackedSearchIndex") -> None:
+        """Busca sobre un indice empaquetado (memoria compartida) y suelta el propio"""
+        self.replace(SearchIndex(self.k1, self.b))
+        self._packed = packed
+
+    def pack(self) -> bytes:
+        """Indice de solo lectura para PackedSearchIndex, con las normas exactas"""
+        doc_ids = list(self._docs)
+        number = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        avg_len = (self._total_len / len(doc_ids) or 1.0) if doc_ids else 1.0
+        norms = [self.k1 * (1 - self.b + self.b * self._doc_len[d] / avg_len) for d in doc_ids]
+        term_number = {term: i for i, term in enumerate(self._terms)}
+
+        # postings de cada termino ordenados por puntaje (sin idf, que es el mismo para todo el termino)
+        posting_offsets, posting_docs, posting_scores = array("I", [0]), array("I"), array("d")
+        forward = [[] for _ in doc_ids]
+        for term in self._terms:
+            t = term_number[term]
+            scored = sorted((-self._saturated(tf, norms[number[d]]), number[d])
+                            for d, tf in self._postings[term].items())
+            for negative, n in scored:
+                posting_docs.append(n)
+                posting_scores.append(-negative)
+                forward[n].append((t, -negative))
+            posting_offsets.append(len(posting_docs))
+
+        # y por documento sus terminos, para revisar pocos candidatos sin recorrer postings
+        doc_term_offsets, doc_terms, doc_term_scores = array("I", [0]), array("I"), array("d")
+        for entries in forward:
+            for t, score in entries:
+                doc_terms.append(t)
+                doc_term_scores.append(score)
+            doc_term_offsets.append(len(doc_terms))
+
+        terms_blob = "".join(self._terms).encode("utf-8")
+        term_offsets = array("I", [0])
+        for term in self._terms:
+            term_offsets.append(term_offsets[-1] + len(term.encode("utf-8")))
+        records = [json.dumps(self._docs[d], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                   for d in doc_ids]
+        record_offsets = array("Q", [0])
+        for record in records:
+            record_offsets.append(record_offsets[-1] + len(record))
+
+        sections = [record_offsets, term_offsets, posting_offsets, posting_docs, posting_scores,
+                    doc_term_offsets, doc_terms, doc_term_scores, terms_blob, b"".join(records)]
+        chunks = [PACK_HEADER.pack(PACK_MAGIC, len(doc_ids), len(self._terms), len(posting_docs))]
+        size = PACK_HEADER.size
+        for section in sections:
+            data = section.tobytes() if isinstance(section, array) else section
+            padding = -size % 8
+            chunks += [b"\0" * padding, data]
+            size += padding + len(data)
+        return b"".join(chunks)
+
+    def sync(self, products: Iterable[dict]) -> int:
+        """Aplica solo las diferencias con el catalogo dado; retorna cuantos cambiaron"""
+        seen = set()
+        changed = 0
+        for product in products:
+            seen.add(product["id"])
+            if self._docs.get(product["id"]) != product:
+                self.upsert(product)
+                changed += 1
+        for doc_id in [d for d in self._docs if d not in seen]:
+            self.remove(doc_id)
+            changed += 1
+        return changed
+
+    def _expand(self, token: str, prefix: bool) -> list:
+        """Terminos del indice que calzan con el token: [(termino, factor)]"""
+        matches = [(token, 1.0)] if token in self._postings else []
+        if prefix:
+            start = bisect.bisect_left(self._terms, token)
+            for term in self._terms[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+                if not term.startswith(token):
+                    break
+                if term != token:
+                    matches.append((term, PREFIX_PENALTY))
+        return matches
+
+    def _idf(self, postings: dict) -> float:
+        n_docs = len(self._docs)
+        return math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+
+    def _top_postings(self, term: str, k: int) -> list:
+        """Los k documentos con mayor puntaje para el termino: [(puntaje, id)]"""
+        postings = self._postings[term]
+        idf = self._idf(postings)
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            norms, k1 = self._norms, self.k1
+            if len(postings) < RANKED_MIN_POSTINGS:
+                scored = [(idf * tf * (k1 + 1) / (tf + norms[d]), d) for d, tf in postings.items()]
+                return scored if len(scored) <= k else heapq.nlargest(k, scored)
+            ranked = self._ranked[term] = sorted((-self._saturated(tf, norms[d]), d) for d, tf in postings.items())
+        return [(-saturated * idf, d) for saturated, d in ranked[:k]]
+
+    def _search_single(self, matches: list, limit: int) -> list:
+        # un solo token: el top-k sale de los primeros k de cada termino, sin puntuar todo
+        best = {}
+        for term, factor in matches:
+            for score, doc_id in self._top_postings(term, limit):
+                score *= factor
+                if score > best.get(doc_id, 0.0):
+                    best[doc_id] = score
+        top = heapq.nlargest(limit, best.items(), key=lambda item: item[1])
+        return [self._docs[doc_id] for doc_id, _ in top]
+
+    def search(self, query: str, limit: int = 20, prefix: bool = True) -> list:
+        if self._packed is not None:
+            return self._packed.search(query, limit, prefix)
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self._docs:
+            return []
+        norms = self._get_norms()
+        k1 = self.k1
+
+        expansions = []
+        for i, token in enumerate(tokens):
+            matches = self._expand(token, prefix and i == len(tokens) - 1)
+            if not matches:
+                return []
+            expansions.append(matches)
+        if len(expansions) == 1:
+            return self._search_single(expansions[0], limit)
+        # los tokens mas selectivos primero: asi los siguientes solo puntuan candidatos
+        expansions.sort(key=lambda matches: sum(len(self._postings[t]) for t, _ in matches))
+
+        scores: Optional[dict] = None
+        first = expansions[0]
+        if sum(len(self._postings[t]) for t, _ in first) > MAX_CANDIDATES:
+            # hasta el token mas selectivo es muy comun: partir de sus mejores documentos
+            scores = {}
+            for term, factor in first:
+                for score, doc_id in self._top_postings(term, MAX_CANDIDATES):
+                    score *= factor
+                    if score > scores.get(doc_id, 0.0):
+                        scores[doc_id] = score
+            if len(scores) > MAX_CANDIDATES:
+                scores = dict(heapq.nlargest(MAX_CANDIDATES, scores.items(), key=lambda item: item[1]))
+            expansions = expansions[1:]
+
+        for matches in expansions:
+            token_scores = {}
+            if scores is not None and len(matches) > 1 and len(scores) * 16 < sum(len(self._postings[t]) for t, _ in matches):
+                # pocos candidatos y muchos terminos por prefijo: revisar los terminos de cada candidato
+                weights = {term: self._idf(self._postings[term]) * factor for term, factor in matches}
+                for doc_id in scores:
+                    for term, tf in self._doc_terms[doc_id].items():
+                        idf = weights.get(term)
+                        if idf is not None:
+                            score = idf * tf * (k1 + 1) / (tf + norms[doc_id])
+                            if score > token_scores.get(doc_id, 0.0):
+                                token_scores[doc_id] = score
+                matches = ()
+            for term, factor in matches:
+                postings = self._postings[term]
+                idf = self._idf(postings) * factor
+                if scores is not None and len(scores) < len(postings):
+                    items = ((d, postings[d]) for d in scores if d in postings)
+                else:
+                    items = postings.items()
+                for doc_id, tf in items:
+                    score = idf * tf * (k1 + 1) / (tf + norms[doc_id])
+                    # un token que calza con varios terminos cuenta solo el mejor
+                    if score > token_scores.get(doc_id, 0.0):
+                        token_scores[doc_id] = score
+            # todos los tokens tienen que calzar (AND)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {d: s + token_scores[d] for d, s in scores.items() if d in token_scores}
+            if not scores:
+                return []
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [self._docs[doc_id] for doc_id, _ in best]
+
+
+
+class _PackedTerms:
+    """Terminos ordenados del indice empaquetado, como secuencia para bisect"""
+
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+
+class PackedSearchIndex:
+    """Indice de solo lectura sobre los bytes de SearchIndex.pack() (sin copiarlos).
+
+    Mismo ranking que SearchIndex; no arma objetos por producto, solo
+    decodifica los productos que devuelve cada busqueda.
+    """
+
+    def __init__(self, buf: memoryview):
+        magic, n_docs, n_terms, n_postings = PACK_HEADER.unpack_from(buf)
+        if magic != PACK_MAGIC:
+            raise ValueError("indice de busqueda invalido")
+        position = PACK_HEADER.size
+
+        def section(fmt: str, count: int) -> memoryview:
+            nonlocal position
+            position += -position % 8
+            size = count * struct.calcsize(fmt)
+            view = buf[position:position + size]
+            position += size
+            return view.cast(fmt) if fmt != "B" else view
+
+        self._n_docs = n_docs
+        self._record_offsets = section("Q", n_docs + 1)
+        term_offsets = section("I", n_terms + 1)
+        self._posting_offsets = section("I", n_terms + 1)
+        self._posting_docs = section("I", n_postings)
+        self._posting_scores = section("d", n_postings)
+        self._doc_term_offsets = section("I", n_docs + 1)
+        self._doc_terms = section("I", n_postings)
+        self._doc_term_scores = section("d", n_postings)
+        self._terms = _PackedTerms(section("B", term_offsets[n_terms]), term_offsets)
+        self._records = section("B", self._record_offsets[n_docs])
+
+    def __len__(self):
+        return self._n_docs
+
+    def _record(self, n: int) -> dict:
+        return json.loads(bytes(self._records[self._record_offsets[n]:self._record_offsets[n + 1]]))
+
+    def _df(self, t: int) -> int:
+        return self._posting_offsets[t + 1] - self._posting_offsets[t]
+
+    def _idf(self, t: int) -> float:
+        df = self._df(t)
+        return math.log(1 + (self._n_docs - df + 0.5) / (df + 0.5))
+
+    def _expand(self, token: str, prefix: bool) -> list:
+        """Terminos que calzan con el token: [(numero de termino, factor)]"""
+        terms = self._terms
+        start = bisect.bisect_left(terms, token)
+        matches = [(start, 1.0)] if start < len(terms) and terms[start] == token else []
+        if prefix:
+            for t in range(start, min(len(terms), start + MAX_PREFIX_EXPANSIONS + 1)):
+                term = terms[t]
+                if not term.startswith(token):
+                    break
+                if term != token:
+                    matches.append((t, PREFIX_PENALTY))
+        return matches
+
+    def _top(self, matches: list, k: int) -> dict:
+        """Mejor puntaje por documento entre los k primeros de cada termino"""
+        best = {}
+        for t, factor in matches:
+            weight = self._idf(t) * factor
+            start = self._posting_offsets[t]
+            end = min(self._posting_offsets[t + 1], start + k)
+            for n, score in zip(self._posting_docs[start:end], self._posting_scores[start:end]):
+                score *= weight
+                if score > best.get(n, 0.0):
+                    best[n] = score
+        return best
+
+    def search(self, query: str, limit: int = 20, prefix: bool = True) -> list:
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self._n_docs:
+            return []
+        expansions = []
+        for i, token in enumerate(tokens):
+            matches = self._expand(token, prefix and i == len(tokens) - 1)
+            if not matches:
+                return []
+            expansions.append(matches)
+
+        if len(expansions) == 1:
+            scores = self._top(expansions[0], limit)
+        else:
+            # los tokens mas selectivos primero: asi los siguientes solo puntuan candidatos
+            expansions.sort(key=lambda matches: sum(self._df(t) for t, _ in matches))
+            scores = None
+            if sum(self._df(t) for t, _ in expansions[0]) > MAX_CANDIDATES:
+                scores = self._top(expansions[0], MAX_CANDIDATES)
+                if len(scores) > MAX_CANDIDATES:
+                    scores = dict(heapq.nlargest(MAX_CANDIDATES, scores.items(), key=lambda item: item[1]))
+                expansions = expansions[1:]
+            for matches in expansions:
+                token_scores = {}
+                if scores is not None and len(scores) < sum(self._df(t) for t, _ in matches):
+                    # pocos candidatos: revisar los terminos de cada uno
+                    weights = {t: self._idf(t) * factor for t, factor in matches}
+                    for n in scores:
+                        start, end = self._doc_term_offsets[n], self._doc_term_offsets[n + 1]
+                        for t, score in zip(self._doc_terms[start:end], self._doc_term_scores[start:end]):
+                            weight = weights.get(t)
+                            if weight is not None and score * weight > token_scores.get(n, 0.0):
+                                token_scores[n] = score * weight
+                else:
+                    token_scores = self._top(matches, self._n_docs)
+                # todos los tokens tienen que calzar (AND)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {n: s + token_scores[n] for n, s in scores.items() if n in token_scores}
+                if not scores:
+                    return []
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [self._record(n) for n, _ in best]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+
+import database
+from services.order_ids import order_ids
+
+load_dotenv()
+
+# Sesiones del lado del servidor (coleccion "sessions").
+#
+# - Cada login crea una sesion (sid). El refresh token lleva sid + jti y solo
+#   el jti vigente de la sesion sirve: cada /refresh lo rota. Si llega un jti
+#   ya usado alguien mas tiene una copia del token -> se revoca toda la sesion.
+# - Los access tokens llevan el sid. Revocar una sesion (logout, reuso) agrega
+#   una entrada en "revocations" que vive lo mismo que un access token; cada
+#   worker mantiene esas entradas en memoria y las sincroniza de a poco (solo
+#   lo nuevo) cada REVOCATION_SYNC_INTERVAL segundos, asi revisar un token no
+#   agrega una consulta a Mongo por request.
+
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+# dos pestañas que refrescan a la vez: el jti anterior no cuenta como robo durante estos segundos
+REFRESH_REUSE_GRACE = float(os.getenv("REFRESH_REUSE_GRACE", "10"))
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "2"))
+# los _id se generan en cada cliente: se relee un poco hacia atras por si llego uno tarde
+REVOCATION_SYNC_OVERLAP = timedelta(seconds=float(os.getenv("REVOCATION_SYNC_OVERLAP", "30")))
+
+
+class SessionError(Exception):
+    pass
+
+
+def utcnow() -> datetime:
+    # expires_at tiene indice TTL: Mongo interpreta las fechas como UTC, nunca hora local
+    return datetime.now(timezone.utc)
+
+
+def as_utc(value: datetime) -> datetime:
+    # pymongo devuelve fechas naive (en UTC) salvo que el cliente use tz_aware=True
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def sessions_collection():
+    return database.db["sessions"]
+
+
+def revocations_collection():
+    return database.db["revocations"]
+
+
+class RevocationSet:
+    """sid revocados -> hasta cuando (epoch); la consulta es un dict.get"""
+
+    def __init__(self, interval: float = REVOCATION_SYNC_INTERVAL):
+        self.interval = interval
+        self._revoked: dict = {}
+        self._synced_at: Optional[datetime] = None  # UTC, para comparar con los ObjectId
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"syncs": 0, "loaded": 0, "hits": 0}
+
+    def is_revoked(self, sid: str) -> bool:
+        until = self._revoked.get(sid)
+        if until is None:
+            return False
+        if until <= time.time():
+            # ya no queda ningun access token de esa sesion vigente
+            del self._revoked[sid]
+            return False
+        self.stats["hits"] += 1
+        return True
+
+    def add(self, sid: str, expires_at: datetime) -> None:
+        self._revoked[sid] = max(self._revoked.get(sid, 0), as_utc(expires_at).timestamp())
+
+    async def sync(self) -> int:
+        """Trae las revocaciones nuevas desde la ultima vez (la primera vez, todas las vigentes)"""
+        started = utcnow()
+        query = {"expires_at": {"$gt": started}}
+        if self._synced_at is not None:
+            query["_id"] = {"$gt": ObjectId.from_datetime(self._synced_at - REVOCATION_SYNC_OVERLAP)}
+        loaded = 0
+        async for doc in revocations_collection().find(query, {"sid": 1, "expires_at": 1}):
+            self.add(doc["sid"], doc["expires_at"])
+            loaded += 1
+        self._synced_at = started
+        now = time.time()
+        for sid in [sid for sid, until in self._revoked.items() if until <= now]:
+            del self._revoked[sid]
+        self.stats["syncs"] += 1
+        self.stats["loaded"] += loaded
+        return loaded
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                # el loop no puede morir: sin sync este worker no veria los logouts de los demas
+                print(f"Error sincronizando revocaciones: {type(e).__name__}: {str(e)}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "revoked": len(self._revoked),
+                "synced_at": self._synced_at.isoformat() if self._synced_at else None}
+
+
+revocations = RevocationSet()
+
+
+class SessionStore:
+    def __init__(self, session_ttl: timedelta = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+                 access_ttl: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+                 reuse_grace: float = REFRESH_REUSE_GRACE):
+        self.session_ttl = session_ttl
+        self.access_ttl = access_ttl
+        self.reuse_grace = reuse_grace
+
+    async def create(self, email: str) -> tuple:
+        """Sesion nueva para un login; retorna (sid, jti, expira)"""
+        now = utcnow()
+        sid, jti = "SES" + order_ids.next_id(), uuid.uuid4().hex
+        expires_at = now + self.session_ttl
+        await sessions_collection().insert_one({
+            "_id": sid, "email": email, "jti": jti, "previous_jti": None,
+            "created_at": now, "rotated_at": now, "expires_at": expires_at,
+            "rotations": 0, "revoked_at": None,
+        })
+        return sid, jti, expires_at
+
+    async def rotate(self, sid: str, jti: str) -> tuple:
+        """Cambia el jti vigente; retorna (email, jti nuevo, expira) o lanza SessionError"""
+        now = utcnow()
+        new_jti = uuid.uuid4().hex
+        session = await sessions_collection().find_one_and_update(
+            {"_id": sid, "jti": jti, "revoked_at": None, "expires_at": {"$gt": now}},
+            {"$set": {"jti": new_jti, "previous_jti": jti, "rotated_at": now}, "$inc": {"rotations": 1}},
+            projection={"email": 1, "expires_at": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if session is not None:
+            return session["email"], new_jti, as_utc(session["expires_at"])
+
+        session = await sessions_collection().find_one(
+            {"_id": sid}, {"jti": 1, "previous_jti": 1, "rotated_at": 1, "revoked_at": 1, "expires_at": 1})
+        if session is None or session["revoked_at"] is not None or as_utc(session["expires_at"]) <= now:
+            raise SessionError("Sesion cerrada o vencida")
+        recent = (now - as_utc(session["rotated_at"])).total_seconds() < self.reuse_grace
+        if not (jti == session.get("previous_jti") and recent):
+            # un refresh token ya rotado volvio a usarse: se revoca la familia completa
+            await self.revoke(sid, "reuse")
+        raise SessionError("Refresh token ya utilizado")
+
+    async def revoke(self, sid: str, reason: str) -> bool:
+        now = utcnow()
+        expires_at = now + self.access_ttl
+        result = await sessions_collection().update_one(
+            {"_id": sid, "revoked_at": None},
+            {"$set": {"revoked_at": now, "revoked_reason": reason}},
+        )
+        # este worker lo ve de inmediato, los demas en la proxima sincronizacion
+        revocations.add(sid, expires_at)
+        if result.modified_count:
+            await revocations_collection().insert_one(
+                {"sid": sid, "reason": reason, "created_at": now, "expires_at": expires_at})
+        return bool(result.modified_count)
+
+
+session_store = SessionStore()
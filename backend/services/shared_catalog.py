@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+import struct
+import sys
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+from services.catalog_snapshot import CatalogSnapshot, EncodedBody
+from services.search import PackedSearchIndex, SearchIndex
+
+# Snapshot del catalogo en memoria compartida, para correr varios workers
+# (serve.py). Un proceso constructor arma el snapshot y lo publica; los
+# workers lo mapean y usan todo directo desde ahi (memoryview, sin copiarlo):
+# los cuerpos ya serializados de las primeras paginas y el buscador completo
+# (postings, normas y cada producto serializado, ver PackedSearchIndex). Un
+# worker no decodifica el catalogo: solo los productos que devuelve una
+# busqueda, asi su memoria no crece con el tamaño del catalogo.
+#
+#   <nombre>-ctl       segmento chico de control: generacion + segmento vigente
+#   <nombre>-<n>       un segmento por version publicada, inmutable
+#
+# Formato de un segmento de version:
+#   MAGIC (8 bytes) | largo del indice (uint32) | indice JSON | datos
+# El indice guarda la version, [offset, largo] del buscador empaquetado y por
+# cada cuerpo su etag, cursor y [offset, largo] dentro de los datos. Los datos
+# parten alineados a 8 bytes (el buscador tiene arreglos de numeros).
+
+MAGIC = b"CATSNAP2"
+HEADER = struct.Struct("<8sI")
+# generacion (impar mientras se escribe), version del catalogo, largo del nombre
+CONTROL = struct.Struct("<QqH")
+CONTROL_SIZE = 256
+KEEP_SEGMENTS = 2
+
+
+_open_lock = threading.Lock()
+
+
+def _open_segment(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # antes de 3.13 abrir un segmento tambien lo registra en el resource tracker,
+    # que lo borraria al salir el worker: solo el constructor es dueño de los segmentos
+    with _open_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+# ---- formato ----
+
+def pack_snapshot(snapshot: CatalogSnapshot) -> bytes:
+    chunks, offset = [], 0
+
+    def add(data) -> list:
+        nonlocal offset
+        padding = -offset % 8
+        chunks.append(b"\0" * padding)
+        offset += padding
+        chunks.append(data)
+        span = [offset, len(data)]
+        offset += len(data)
+        return span
+
+    def add_body(encoded: EncodedBody) -> dict:
+        return {"etag": encoded.etag, "next_cursor": encoded.next_cursor,
+                "body": add(encoded.body), "gzip": add(encoded.gzip_body)}
+
+    search = SearchIndex()
+    search.sync(snapshot.products)
+    index = {
+        "version": snapshot.version,
+        "search": add(search.pack()),
+        "products_page": add_body(snapshot.products_page),
+        "categories": add_body(snapshot.categories),
+        "empty_page": add_body(snapshot.empty_page),
+        "category_pages": {key: add_body(encoded) for key, encoded in snapshot.category_pages.items()},
+    }
+    index_bytes = json.dumps(index, separators=(",", ":")).encode("utf-8")
+    # espacios al final (JSON valido) para que los datos queden alineados
+    index_bytes += b" " * (-(HEADER.size + len(index_bytes)) % 8)
+    return HEADER.pack(MAGIC, len(index_bytes)) + index_bytes + b"".join(chunks)
+
+
+def unpack_snapshot(buf: memoryview) -> CatalogSnapshot:
+    """Snapshot cuyos cuerpos son vistas sobre `buf` (no se copian)"""
+    magic, index_len = HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("segmento de catalogo invalido")
+    start = HEADER.size + index_len
+    index = json.loads(bytes(buf[HEADER.size:start]))
+
+    def view(span) -> memoryview:
+        return buf[start + span[0]:start + span[0] + span[1]]
+
+    def body(entry) -> EncodedBody:
+        return EncodedBody(view(entry["body"]), view(entry["gzip"]), entry["etag"], entry["next_cursor"])
+
+    return CatalogSnapshot(
+        version=index["version"],
+        # los productos no se decodifican: quedan dentro del buscador empaquetado
+        products=(),
+        search=PackedSearchIndex(view(index["search"])),
+        products_page=body(index["products_page"]),
+        categories=body(index["categories"]),
+        category_pages={key: body(entry) for key, entry in index["category_pages"].items()},
+        empty_page=body(index["empty_page"]),
+    )
+
+
+# ---- constructor ----
+
+class SharedCatalogPublisher:
+    """Publica snapshots en memoria compartida (un solo proceso por servidor)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.control = shared_memory.SharedMemory(name=f"{name}-ctl", create=True, size=CONTROL_SIZE)
+        self.control.buf[:CONTROL.size] = CONTROL.pack(0, -1, 0)
+        self.generation = 0
+        self.segments = []  # los ultimos KEEP_SEGMENTS publicados
+        self.published = 0
+
+    def publish(self, snapshot: CatalogSnapshot) -> str:
+        data = pack_snapshot(snapshot)
+        self.published += 1
+        segment = shared_memory.SharedMemory(name=f"{self.name}-{self.published}", create=True, size=len(data))
+        segment.buf[:len(data)] = data
+
+        # seqlock: generacion impar mientras se cambia el puntero
+        name = segment.name.lstrip("/").encode()
+        buf = self.control.buf
+        self.generation += 1
+        struct.pack_into("<Q", buf, 0, self.generation)
+        buf[CONTROL.size:CONTROL.size + len(name)] = name
+        struct.pack_into("<QqH", buf, 0, self.generation, snapshot.version, len(name))
+        self.generation += 1
+        struct.pack_into("<Q", buf, 0, self.generation)
+
+        self.segments.append(segment)
+        # los workers que ya lo mapearon lo siguen viendo; solo se borra el nombre
+        while len(self.segments) > KEEP_SEGMENTS:
+            old = self.segments.pop(0)
+            old.close()
+            old.unlink()
+        return segment.name
+
+    def close(self) -> None:
+        for segment in self.segments + [self.control]:
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self.segments = []
+
+
+async def run_publisher(publisher: SharedCatalogPublisher, interval: float, stop) -> None:
+    """Reconstruye y publica cada vez que cambia la version del catalogo"""
+    from services import catalog
+    from services.catalog_snapshot import build_snapshot
+
+    published_version = None
+    while not stop.is_set():
+        try:
+            version = await catalog.get_catalog_version()
+            if version != published_version:
+                products = [p async for p in catalog.iter_all_products()]
+                snapshot = await asyncio.to_thread(build_snapshot, products, version)
+                publisher.publish(snapshot)
+                published_version = version
+                print(f"Catalogo v{version} publicado ({len(products)} productos)")
+        except Exception as e:
+            print(f"Error publicando snapshot del catalogo: {str(e)}")
+        await asyncio.to_thread(stop.wait, interval)
+
+
+# ---- workers ----
+
+class SharedCatalogReader:
+    def __init__(self, name: str):
+        self.name = name
+        self.control: Optional[shared_memory.SharedMemory] = None
+        self.generation = None
+        self.segment: Optional[shared_memory.SharedMemory] = None
+        self._retired = []
+
+    def _read_control(self):
+        if self.control is None:
+            try:
+                self.control = _open_segment(f"{self.name}-ctl")
+            except FileNotFoundError:
+                return None  # el constructor todavia no arranca
+        buf = self.control.buf
+        for _ in range(100):
+            generation, version, name_len = CONTROL.unpack_from(buf)
+            if generation % 2:
+                continue
+            name = bytes(buf[CONTROL.size:CONTROL.size + name_len]).decode()
+            if struct.unpack_from("<Q", buf)[0] == generation:
+                return generation, version, name
+        return None
+
+    def changed(self) -> bool:
+        """Lectura barata del segmento de control (no toca el snapshot)"""
+        control = self._read_control()
+        return control is not None and control[0] != self.generation and control[1] >= 0
+
+    def load(self) -> Optional[CatalogSnapshot]:
+        control = self._read_control()
+        if control is None or control[1] < 0 or control[0] == self.generation:
+            return None
+        generation, _, name = control
+        try:
+            segment = _open_segment(name)
+        except FileNotFoundError:
+            return None  # ya lo reemplazaron, se toma el siguiente en la proxima vuelta
+        snapshot = unpack_snapshot(segment.buf)
+        if self.segment is not None:
+            self._retired.append(self.segment)
+        self.segment, self.generation = segment, generation
+        self.close_retired()
+        return snapshot
+
+    def close(self) -> None:
+        """Al apagar el worker, despues de soltar el snapshot"""
+        if self.segment is not None:
+            self._retired.append(self.segment)
+            self.segment = None
+        if self.control is not None:
+            self._retired.append(self.control)
+            self.control = None
+        self.close_retired()
+
+    def close_retired(self) -> None:
+        # un segmento viejo se cierra cuando ningun snapshot (ni request en curso) lo usa
+        still_used = []
+        for segment in self._retired:
+            try:
+                segment.close()
+            except BufferError:
+                still_used.append(segment)
+        self._retired = still_used
+
+
+def shared_catalog_reader() -> Optional[SharedCatalogReader]:
+    """Lector si el proceso corre como worker de serve.py"""
+    name = os.getenv("CATALOG_SHM_NAME")
+    return SharedCatalogReader(name) if name else None
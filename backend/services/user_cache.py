@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+from jose import jwt
+
+from services.cache import TTLCache
+from services.repositories import UserProfile, users
+
+load_dotenv()
+
+# Cache compartido por get_current_user y get_current_user_from_cookie:
+# - el payload de cada JWT ya validado se recuerda hasta su exp
+# - el usuario se guarda por su "sub" (email) con TTL corto y se invalida
+#   cuando se modifica (register, vinculo con Google)
+# - varias consultas simultaneas del mismo usuario hacen una sola lectura a Mongo
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+
+class UserCache:
+    def __init__(self, ttl: float = USER_CACHE_TTL, maxsize: int = USER_CACHE_SIZE,
+                 token_maxsize: int = TOKEN_CACHE_SIZE):
+        self._users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._tokens = TTLCache(maxsize=token_maxsize)
+        self._inflight: dict = {}
+        self._generation = 0  # cambia con cada invalidacion
+        self.stats = {"token_hits": 0, "token_misses": 0, "user_hits": 0, "user_misses": 0,
+                      "coalesced": 0, "invalidations": 0}
+
+    def decode_token(self, token: str, secret_key: str, algorithm: str) -> dict:
+        """jwt.decode memoizado hasta el exp del token (lanza JWTError igual que jwt.decode)"""
+        found, payload = self._tokens.get(token)
+        if found:
+            self.stats["token_hits"] += 1
+            return payload
+        self.stats["token_misses"] += 1
+        payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+        exp = payload.get("exp")
+        if exp is not None:
+            remaining = exp - time.time()
+            if remaining > 0:
+                self._tokens.set(token, payload, ttl=remaining)
+        return payload
+
+    async def get_user(self, email: str) -> Optional[UserProfile]:
+        found, user = self._users.get(email)
+        if found:
+            self.stats["user_hits"] += 1
+            return user
+
+        task = self._inflight.get(email)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["user_misses"] += 1
+            task = asyncio.ensure_future(self._load(email))
+            self._inflight[email] = task
+            task.add_done_callback(lambda t: self._on_done(email, t))
+        # UserProfile es inmutable: se puede entregar el mismo objeto a todas las rutas
+        return await asyncio.shield(task)
+
+    def _on_done(self, email: str, task: asyncio.Task) -> None:
+        if self._inflight.get(email) is task:
+            del self._inflight[email]
+        if not task.cancelled():
+            task.exception()
+
+    async def _load(self, email: str) -> Optional[UserProfile]:
+        generation = self._generation
+        user = await users.find_profile(email)
+        if user is not None:
+            # si hubo una invalidacion mientras se leia, el dato puede venir viejo
+            if generation == self._generation:
+                self._users.set(email, user)
+        return user
+
+    def invalidate(self, email: str) -> None:
+        self._users.pop(email)
+        self._inflight.pop(email, None)
+        self._generation += 1
+        self.stats["invalidations"] += 1
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "users_cached": len(self._users), "tokens_cached": len(self._tokens)}
+
+
+user_cache = UserCache()
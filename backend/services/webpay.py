@@ -0,0 +1,22 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuracion de WebPay (Transbank), compartida por las rutas de pago y la reconciliacion
+
+WEBPAY_CONFIG = {
+    "commerce_code": os.getenv("WEBPAY_COMMERCE_CODE", "597055555532"),
+    "api_key": os.getenv("WEBPAY_API_KEY", "579B532A7440BB0C9079DED94D31EA1615BACEB56610332264630D42D0A36B1C"),
+    "base_url": "https://webpay3gint.transbank.cl" if os.getenv("WEBPAY_ENVIRONMENT") != "LIVE" else "https://webpay3g.transbank.cl"
+}
+
+
+def webpay_headers():
+    # Headers requeridos
+    return {
+        "Tbk-Api-Key-Id": WEBPAY_CONFIG["commerce_code"],
+        "Tbk-Api-Key-Secret": WEBPAY_CONFIG["api_key"],
+        "Content-Type": "application/json"
+    }
@@ -0,0 +1,65 @@
+import os
+
+# la config se lee de variables de entorno al importar los modulos
+os.environ.setdefault("RECONCILE_ENABLED", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-secret")
+os.environ.setdefault("ADMIN_TOKEN", "test-admin")
+
+import pytest
+from pymongo import IndexModel
+
+import database
+from bench.common import use_memory_db
+from services.http_clients import http_clients
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def mongomock_indexes() -> dict:
+    """INDEXES de la app con los parciales como sparse.
+
+    mongomock ignora partialFilterExpression y los aplicaria a todos los
+    documentos; sparse es lo mas cercano que entiende (los indices de
+    produccion no cambian).
+    """
+    indexes = {}
+    for collection, models in database.INDEXES.items():
+        indexes[collection] = []
+        for model in models:
+            options = dict(model.document)
+            keys = list(options.pop("key").items())
+            if options.pop("partialFilterExpression", None) is not None:
+                options["sparse"] = True
+            indexes[collection].append(IndexModel(keys, **options))
+    return indexes
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    """Mongo en memoria con los indices de la app (unicos incluidos)"""
+    memory_db = use_memory_db("test")
+    monkeypatch.setattr(database, "INDEXES", mongomock_indexes())
+    await database.ensure_indexes()
+    yield memory_db
+
+
+@pytest.fixture
+async def upstream():
+    """Conecta transportes falsos a http_clients y los quita al terminar"""
+    installed = []
+
+    def install(name, transport):
+        http_clients.set_transport(name, transport)
+        installed.append(name)
+
+    # los clientes que dejo abiertos otro test se cierran antes de cambiar el transporte
+    await http_clients.aclose()
+    yield install
+    await http_clients.aclose()
+    for name in installed:
+        http_clients.set_transport(name, None)
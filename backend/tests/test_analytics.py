@@ -0,0 +1,19 @@
+import httpx
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(db):
+    import main
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+        yield c
+
+
+async def test_sales_report_requires_admin_token(client):
+    assert (await client.get("/api/analytics/sales")).status_code == 403
+    assert (await client.get("/api/analytics/sales", headers={"X-Admin-Token": "otro"})).status_code == 403
+    response = await client.get("/api/analytics/sales", headers={"X-Admin-Token": "test-admin"})
+    assert response.status_code == 200
@@ -0,0 +1,71 @@
+import httpx
+import pytest
+
+from bench.harness import cookie_header, prepare_users
+from bench.standins import WebpayStandIn
+from services.carts import CartStore, cart_store
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(db, upstream):
+    import main
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+        yield c
+
+
+@pytest.fixture
+def webpay(upstream):
+    standin = WebpayStandIn(latency=0)
+    upstream("webpay", httpx.MockTransport(standin.handler))
+    return standin
+
+
+@pytest.fixture
+async def user(db):
+    await db["products"].insert_many([{"_id": "P1", "name": "Uno", "price": 500},
+                                      {"_id": "P2", "name": "Dos", "price": 300}])
+    (vu,) = await prepare_users(db, 1)
+    cart_store._cache.clear()
+    return {"email": vu["email"], "headers": cookie_header(vu["token"])}
+
+
+async def test_checkout_charges_the_cart_changed_by_another_worker(client, webpay, user, db):
+    await client.post("/api/cart/items", json={"product_id": "P1", "quantity": 1}, headers=user["headers"])
+    # otra replica cambio el carrito: el cache de este proceso quedo viejo
+    await CartStore().set_quantity(user["email"], "P1", 3)
+
+    response = await client.post("/api/cart/checkout", headers=user["headers"])
+    assert response.status_code == 200
+    assert response.json()["amount"] == 1500
+    assert webpay.created[response.json()["token"]]["amount"] == 1500
+
+
+async def test_authorized_payment_clears_the_cart(client, webpay, user):
+    await client.post("/api/cart/items", json={"product_id": "P1", "quantity": 2}, headers=user["headers"])
+    token = (await client.post("/api/cart/checkout", headers=user["headers"])).json()["token"]
+
+    assert (await client.post("/api/webpay/commit", data={"token_ws": token})).status_code == 200
+    assert (await client.get("/api/cart", headers=user["headers"])).json()["items"] == []
+
+
+async def test_failed_payment_keeps_the_cart(client, webpay, user):
+    webpay.fail_rate = 1.0
+    await client.post("/api/cart/items", json={"product_id": "P1", "quantity": 2}, headers=user["headers"])
+    token = (await client.post("/api/cart/checkout", headers=user["headers"])).json()["token"]
+
+    assert (await client.post("/api/webpay/commit", data={"token_ws": token})).status_code == 200
+    items = (await client.get("/api/cart", headers=user["headers"])).json()["items"]
+    assert items == [{"product_id": "P1", "quantity": 2}]
+
+
+async def test_cart_changed_while_paying_is_not_cleared(client, webpay, user):
+    await client.post("/api/cart/items", json={"product_id": "P1", "quantity": 1}, headers=user["headers"])
+    token = (await client.post("/api/cart/checkout", headers=user["headers"])).json()["token"]
+    await client.post("/api/cart/items", json={"product_id": "P2", "quantity": 1}, headers=user["headers"])
+
+    assert (await client.post("/api/webpay/commit", data={"token_ws": token})).status_code == 200
+    items = (await client.get("/api/cart", headers=user["headers"])).json()["items"]
+    assert [item["product_id"] for item in items] == ["P1", "P2"]
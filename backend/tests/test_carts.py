@@ -0,0 +1,41 @@
+import pytest
+
+from services.carts import CartStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def workers(db):
+    # dos procesos de serve.py, cada uno con su cache
+    return CartStore(), CartStore()
+
+
+async def test_changes_from_another_worker_are_seen_immediately(workers):
+    a, b = workers
+    await a.add_item("u@x.cl", "P1", 1)
+    assert (await b.get("u@x.cl"))["items"] == [{"product_id": "P1", "quantity": 1}]
+
+    await a.set_quantity("u@x.cl", "P1", 4)
+    await a.add_item("u@x.cl", "P2", 1)
+    assert (await b.get("u@x.cl"))["items"] == [{"product_id": "P1", "quantity": 4},
+                                                {"product_id": "P2", "quantity": 1}]
+
+    await a.clear("u@x.cl")
+    assert (await b.get("u@x.cl"))["items"] == []
+    assert b.stats["stale"] == 2
+
+
+async def test_unchanged_cart_is_served_from_the_cache(workers, db):
+    a, b = workers
+    await a.add_item("u@x.cl", "P1", 2)
+    first = await b.get("u@x.cl")
+    assert await b.get("u@x.cl") is first
+    assert (b.stats["misses"], b.stats["hits"], b.stats["stale"]) == (1, 1, 0)
+
+
+async def test_cart_created_by_another_worker_replaces_a_cached_empty_cart(workers):
+    a, b = workers
+    assert (await b.get("nuevo@x.cl"))["items"] == []
+    await a.add_item("nuevo@x.cl", "P1", 1)
+    assert (await b.get("nuevo@x.cl"))["items"] == [{"product_id": "P1", "quantity": 1}]
@@ -0,0 +1,47 @@
+import base64
+import json
+
+import httpx
+import pytest
+
+from services import catalog
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(db):
+    import main
+
+    await catalog.seed_sample_products()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+        yield c
+
+
+def raw_cursor(value, last_id) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, last_id]).encode()).decode().rstrip("=")
+
+
+async def test_cursor_pages_through_the_catalog(client):
+    first = await client.get("/products", params={"limit": 2, "sort": "price"})
+    second = await client.get("/products", params={"limit": 2, "sort": "price",
+                                                   "cursor": first.headers["x-next-cursor"]})
+    assert second.status_code == 200
+    prices = [p["price"] for p in first.json() + second.json()]
+    assert prices == sorted(prices) and len(second.json()) == 2
+
+
+@pytest.mark.parametrize("cursor", [
+    raw_cursor({"$exists": True}, "1"),
+    raw_cursor({"$where": "1"}, "1"),
+    raw_cursor(["a"], "1"),
+    raw_cursor(100, {"$gt": ""}),
+    raw_cursor(100, None),
+    "no-es-base64!",
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+])
+@pytest.mark.parametrize("sort", ["price", "id"])
+async def test_hand_made_cursors_are_a_400(client, cursor, sort):
+    response = await client.get("/products", params={"cursor": cursor, "sort": sort})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cursor inválido"
@@ -0,0 +1,58 @@
+import gzip
+import json
+
+import pytest
+from starlette.requests import Request
+
+from services.catalog_snapshot import build_snapshot, snapshot_response
+
+PRODUCTS = [{"id": str(i), "name": f"Producto {i}", "category": "Snacks", "price": 100 * i} for i in range(1, 4)]
+
+
+@pytest.fixture
+def encoded():
+    return build_snapshot(PRODUCTS, version=1).products_page
+
+
+def get(encoded, **headers):
+    scope = {"type": "http", "method": "GET", "path": "/products",
+             "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]}
+    return snapshot_response(Request(scope), encoded)
+
+
+def test_gzip_and_identity_have_different_etags(encoded):
+    plain = get(encoded)
+    gzipped = get(encoded, accept_encoding="gzip, deflate")
+
+    assert "content-encoding" not in plain.headers
+    assert json.loads(plain.body) == PRODUCTS
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(gzipped.body)) == PRODUCTS
+    assert plain.headers["etag"] != gzipped.headers["etag"]
+    assert gzipped.headers["etag"].endswith('-gz"')
+
+
+def test_etag_of_one_encoding_does_not_validate_the_other(encoded):
+    plain_etag = get(encoded).headers["etag"]
+    gzip_etag = get(encoded, accept_encoding="gzip").headers["etag"]
+
+    assert get(encoded, if_none_match=plain_etag).status_code == 304
+    assert get(encoded, accept_encoding="gzip", if_none_match=gzip_etag).status_code == 304
+    assert get(encoded, accept_encoding="gzip", if_none_match=plain_etag).status_code == 200
+    assert get(encoded, if_none_match=gzip_etag).status_code == 200
+    # un proxy que comprime puede debilitar el ETag
+    assert get(encoded, accept_encoding="gzip", if_none_match=f"W/{gzip_etag}").status_code == 304
+
+
+@pytest.mark.parametrize("accept_encoding, gzipped", [
+    ("gzip", True),
+    ("br, gzip;q=0.5", True),
+    ("*", True),
+    ("gzip;q=0", False),
+    ("gzip;q=0.0, identity", False),
+    ("*;q=0", False),
+    ("br", False),
+])
+def test_q_values_are_respected(encoded, accept_encoding, gzipped):
+    response = get(encoded, accept_encoding=accept_encoding)
+    assert (response.headers.get("content-encoding") == "gzip") is gzipped
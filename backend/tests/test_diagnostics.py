@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(db):
+    import main
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+        yield c
+
+
+@pytest.mark.parametrize("path", ["/diagnostics/http-clients", "/diagnostics/reconciler", "/products/cache/stats"])
+async def test_diagnostics_require_admin_token(client, path):
+    assert (await client.get(path)).status_code == 403
+    assert (await client.get(path, headers={"X-Admin-Token": "test-admin"})).status_code == 200
+
+
+async def test_metrics_stay_open_for_prometheus(client):
+    assert (await client.get("/metrics")).status_code == 200
+
+
+def test_slow_request_recorder_keeps_the_slowest():
+    from services.profiling import SlowRequestRecorder
+
+    recorder = SlowRequestRecorder(threshold_ms=0, keep=3)
+    for duration in [50, 900, 10, 700, 20, 800, 30]:
+        recorder.record({"duration_ms": duration})
+
+    assert [e["duration_ms"] for e in recorder.slowest()] == [900, 800, 700]
+
+
+async def test_streams_are_timed_to_their_first_chunk(monkeypatch):
+    from starlette.applications import Starlette
+    from starlette.responses import StreamingResponse
+    from starlette.routing import Route
+
+    from services.profiling import ProfilingMiddleware, slow_requests
+
+    async def events(request):
+        async def stream():
+            yield b"data: 1\n\n"
+            await asyncio.sleep(0.3)  # el cliente sigue escuchando
+            yield b"data: 2\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    app = ProfilingMiddleware(Starlette(routes=[Route("/events", events)]))
+    monkeypatch.setattr(slow_requests, "threshold_ms", 0)
+    slow_requests.clear()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        assert (await client.get("/events")).status_code == 200
+
+    [entry] = slow_requests.slowest()
+    slow_requests.clear()
+    assert entry["streaming"] is True
+    assert entry["duration_ms"] < 300
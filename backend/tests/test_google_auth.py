@@ -0,0 +1,101 @@
+import time
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from bench.standins import GoogleStandIn
+from services import google_auth
+from services.google_auth import GoogleKeyCache, GoogleTokenError, cache_ttl, verify_id_token
+
+pytestmark = pytest.mark.anyio
+
+AUDIENCE = "test-client"
+
+
+@pytest.fixture
+def google(upstream, monkeypatch):
+    standin = GoogleStandIn(latency=0, client_id=AUDIENCE)
+    upstream("google", httpx.MockTransport(standin.handler))
+    # cache nuevo por test: sin llaves de otros tests y sin espera minima entre refrescos
+    monkeypatch.setattr(google_auth, "google_keys", GoogleKeyCache(min_refresh=0))
+    return standin
+
+
+def sign(google, signing_key=None, kid=None, access_token=None, **overrides):
+    now = int(time.time())
+    claims = {"iss": "https://accounts.google.com", "aud": AUDIENCE, "sub": "g-1", "email": "a@gmail.test",
+              "email_verified": True, "name": "A", "iat": now, "exp": now + 3600, **overrides}
+    claims = {k: v for k, v in claims.items() if v is not None}
+    return jwt.encode(claims, signing_key or google.signing_key, algorithm="RS256",
+                      headers={"kid": kid or google.kid}, access_token=access_token)
+
+
+async def test_valid_token_returns_claims(google):
+    claims = await verify_id_token(sign(google, access_token="at-1"), AUDIENCE, access_token="at-1")
+    assert (claims["email"], claims["sub"]) == ("a@gmail.test", "g-1")
+
+
+@pytest.mark.parametrize("overrides", [
+    {"aud": "otro-cliente"},
+    {"iss": "https://evil.example.com"},
+    {"exp": int(time.time()) - 60},
+    {"email_verified": False},
+    {"email": None},
+])
+async def test_invalid_claims_are_rejected(google, overrides):
+    with pytest.raises(GoogleTokenError):
+        await verify_id_token(sign(google, **overrides), AUDIENCE)
+
+
+async def test_at_hash_must_match_the_access_token(google):
+    with pytest.raises(GoogleTokenError):
+        await verify_id_token(sign(google, access_token="at-1"), AUDIENCE, access_token="at-2")
+
+
+async def test_signature_from_an_unpublished_key_is_rejected(google):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    # mismo kid que la llave publicada, firma de otra llave
+    forged = sign(google, signing_key=jwk.construct(pem, "RS256"))
+    with pytest.raises(GoogleTokenError):
+        await verify_id_token(forged, AUDIENCE)
+
+
+@pytest.mark.parametrize("token", ["", "no-es-un-jwt"])
+async def test_malformed_tokens_are_rejected(google, token):
+    with pytest.raises(GoogleTokenError):
+        await verify_id_token(token, AUDIENCE)
+
+
+async def test_keys_are_cached_and_refetched_when_google_rotates(google):
+    for _ in range(3):
+        await verify_id_token(sign(google), AUDIENCE)
+    assert google.certs_calls == 1
+
+    google.rotate()
+    await verify_id_token(sign(google), AUDIENCE)
+    assert google.certs_calls == 2
+    assert google_auth.google_keys.stats["refreshes"] == 2
+
+
+async def test_unknown_kid_does_not_refetch_within_min_refresh(google, monkeypatch):
+    monkeypatch.setattr(google_auth, "google_keys", GoogleKeyCache(min_refresh=60))
+    await verify_id_token(sign(google), AUDIENCE)
+
+    for _ in range(3):
+        with pytest.raises(GoogleTokenError):
+            await verify_id_token(sign(google, kid="desconocido"), AUDIENCE)
+    assert google.certs_calls == 1
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("public, max-age=21450, must-revalidate, no-transform", 21450.0),
+    ("no-cache", 3600.0),
+    (None, 3600.0),
+])
+def test_cache_ttl_reads_max_age(header, expected):
+    assert cache_ttl(header, 3600.0) == expected
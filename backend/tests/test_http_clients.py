@@ -0,0 +1,28 @@
+import httpx
+import pytest
+
+from services.http_clients import HttpClientRegistry, UpstreamConfig
+
+pytestmark = pytest.mark.anyio
+
+
+def handler(request):
+    return httpx.Response(200, json={"ok": True})
+
+
+async def test_transport_cannot_replace_an_open_client():
+    registry = HttpClientRegistry({"webpay": UpstreamConfig(retries=0)})
+    registry.set_transport("webpay", httpx.MockTransport(handler))
+    client = registry.get("webpay")
+
+    with pytest.raises(RuntimeError):
+        registry.set_transport("webpay", None)
+    # el cliente abierto sigue siendo el que usa el registro
+    assert registry.get("webpay") is client
+    assert (await registry.request("webpay", "GET", "http://webpay.test/status")).json() == {"ok": True}
+
+    await registry.aclose()
+    assert client.is_closed
+    registry.set_transport("webpay", None)
+    assert registry.get("webpay") is not client
+    await registry.aclose()
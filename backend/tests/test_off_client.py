@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from services.off_client import OpenFoodFactsClient
+
+pytestmark = pytest.mark.anyio
+
+PRODUCT = {"status": 1, "product": {"product_name": "Galletas"}}
+
+
+def off_client(handler, **kwargs):
+    return OpenFoodFactsClient(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)), **kwargs)
+
+
+async def test_concurrent_lookups_share_one_upstream_request():
+    calls = []
+    release = asyncio.Event()
+
+    async def handler(request):
+        calls.append(request.url.path)
+        await release.wait()
+        return httpx.Response(200, json=PRODUCT)
+
+    client = off_client(handler)
+    lookups = [asyncio.ensure_future(client.get_product("780001")) for _ in range(10)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*lookups)
+
+    assert len(calls) == 1
+    assert all(r == PRODUCT["product"] for r in results)
+    assert client.stats["coalesced"] == 9
+    # ya en cache: no vuelve a salir
+    assert await client.get_product("780001") == PRODUCT["product"]
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("response", [
+    httpx.Response(404),
+    httpx.Response(200, json={"status": 0, "status_verbose": "product not found"}),
+])
+async def test_not_found_is_cached_negatively(response):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return response
+
+    client = off_client(handler)
+    assert await client.get_product("780002") is None
+    assert await client.get_product("780002") is None
+    assert len(calls) == 1
+    assert client.stats["negative_hits"] == 1
+
+
+async def test_negative_entries_expire_with_their_own_ttl():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return httpx.Response(404)
+
+    client = off_client(handler, negative_ttl=0.01)
+    assert await client.get_product("780003") is None
+    await asyncio.sleep(0.02)
+    assert await client.get_product("780003") is None
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("response", [
+    httpx.Response(503),
+    httpx.Response(200, content=b"<html>mantenimiento</html>"),
+    httpx.Response(200, json=["no", "es", "un", "objeto"]),
+])
+async def test_upstream_errors_raise_http_error_and_are_not_cached(response):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return response
+
+    client = off_client(handler)
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPError):
+            await client.get_product("780004")
+    assert len(calls) == 2
+    assert client.stats["upstream_errors"] == 2
+
+
+async def test_coalesced_waiters_all_get_the_upstream_error():
+    async def handler(request):
+        await asyncio.sleep(0.01)
+        raise httpx.ConnectError("sin red", request=request)
+
+    client = off_client(handler)
+    results = await asyncio.gather(*(client.get_product("780005") for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(r, httpx.ConnectError) for r in results)
+    assert client.stats["upstream_requests"] == 1
+
+
+async def test_invalid_body_is_a_502_and_does_not_break_the_lookup_stream(db, upstream):
+    import main
+    from services.off_client import off_client as shared_client
+
+    async def handler(request):
+        barcode = request.url.path.rsplit("/", 1)[-1].removesuffix(".json")
+        if barcode == "7800100":
+            return httpx.Response(200, content=b"not json")
+        return httpx.Response(200, json=PRODUCT)
+
+    upstream("off", httpx.MockTransport(handler))
+    shared_client._cache.clear()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        response = await client.get("/products/7800100")
+        assert response.status_code == 502
+
+        response = await client.post("/products/lookup", json={"barcodes": ["7800100", "7800101"]})
+        assert response.status_code == 200
+        lines = [line for line in response.text.splitlines() if line]
+        results = {r["barcode"]: r for r in map(json.loads, lines)}
+        assert (results["7800100"]["ok"], results["7800100"]["error"]) == (False, "upstream_error")
+        assert results["7800101"]["ok"] is True
@@ -0,0 +1,28 @@
+import pytest
+
+from services.metrics import password_hash_duration
+from services.password_hasher import PasswordHasher
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(workers=1, queue_size=1)
+    yield hasher
+    hasher.shutdown()
+
+
+async def test_failed_hashes_are_not_counted_as_completed(hasher):
+    errors = password_hash_duration.get("verify_and_update", "error")
+    errors_before = errors.count
+
+    hashed = await hasher.hash("secreto")
+    assert await hasher.verify("secreto", hashed)
+    with pytest.raises(ValueError):
+        await hasher.verify("secreto", "no-es-un-hash")
+
+    assert hasher.get_stats()["completed"] == 2
+    assert hasher.get_stats()["failed"] == 1
+    assert hasher.get_stats()["pending"] == 0
+    assert errors.count == errors_before + 1
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from services.payment_events import CHANGE_STREAMS_UNSUPPORTED, PaymentEventHub
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def hub():
+    hub = PaymentEventHub(poll_interval=0.01, retry_min=0.02, retry_max=0.2)
+    yield hub
+    await hub.stop()
+
+
+async def insert_payment(db, token, status="pending"):
+    await db["transactions"].insert_one({"token": token, "buy_order": f"ORD-{token}", "amount": 1000,
+                                         "status": status, "created_at": datetime.now()})
+
+
+async def test_polling_delivers_changes_made_by_other_processes(db, hub):
+    await insert_payment(db, "tok-1")
+    queue = hub.subscribe("tok-1")
+    # el Mongo de los tests no tiene change streams
+    hub.start()
+    assert (await asyncio.wait_for(queue.get(), 1))["status"] == "pending"
+
+    await db["transactions"].update_one({"token": "tok-1"}, {"$set": {"status": "AUTHORIZED"}})
+    assert (await asyncio.wait_for(queue.get(), 1))["status"] == "AUTHORIZED"
+    # sin cambios no se vuelve a publicar
+    await asyncio.sleep(0.05)
+    assert queue.empty()
+    assert hub.get_stats()["watch_errors"] >= 1
+
+
+async def test_tokens_without_subscribers_are_not_polled(db, hub):
+    await insert_payment(db, "tok-2")
+    queue = hub.subscribe("tok-2")
+    assert await hub.poll_once() == 1
+    hub.unsubscribe("tok-2", queue)
+    assert await hub.poll_once() == 0
+    assert hub._polled == {}
+
+
+async def test_watch_is_restarted_with_backoff(db, hub, monkeypatch):
+    attempts = []
+    opened = asyncio.Event()
+
+    async def follow():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) < 4:
+            raise OperationFailure("connection reset")
+        hub.stats["streams_opened"] += 1
+        opened.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(hub, "_follow_change_stream", follow)
+    hub.start()
+    await asyncio.wait_for(opened.wait(), 2)
+
+    gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+    assert gaps[0] >= 0.02 and gaps[1] >= 0.04 and gaps[2] >= 0.08
+    assert hub.stats["watch_errors"] == 3 and not hub.polling
+
+
+async def test_standalone_mongo_waits_the_longest_backoff(db, hub, monkeypatch):
+    attempts = []
+
+    async def follow():
+        attempts.append(1)
+        raise OperationFailure("only supported on replica sets", code=CHANGE_STREAMS_UNSUPPORTED)
+
+    monkeypatch.setattr(hub, "_follow_change_stream", follow)
+    hub.start()
+    await asyncio.sleep(0.1)
+    assert len(attempts) == 1 and hub.polling
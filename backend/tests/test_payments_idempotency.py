@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from bench.standins import WebpayStandIn
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(db, upstream):
+    import main
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+        yield c
+
+
+@pytest.fixture
+def webpay(upstream):
+    standin = WebpayStandIn(latency=0.05)
+    upstream("webpay", httpx.MockTransport(standin.handler))
+    return standin
+
+
+def create(client, key, amount=1000, **body):
+    return client.post("/api/create-payment", json={"amount": amount, **body}, headers={"Idempotency-Key": key})
+
+
+async def test_concurrent_creates_with_same_key_call_webpay_once(client, webpay, db):
+    first, second = await asyncio.gather(create(client, "k-1"), create(client, "k-1"))
+
+    assert first.status_code == second.status_code == 200
+    assert first.json()["token"] == second.json()["token"]
+    assert len(webpay.created) == 1
+    # uno crea el pago, el otro recibe la misma respuesta
+    assert sorted(str(r.headers.get("idempotent-replayed")) for r in (first, second)) == ["None", "true"]
+    assert await db["transactions"].count_documents({"idempotency_key": "k-1"}) == 1
+
+
+async def test_same_key_with_other_amount_is_rejected(client, webpay):
+    assert (await create(client, "k-2")).status_code == 200
+    assert (await create(client, "k-2", amount=2000)).status_code == 422
+    assert len(webpay.created) == 1
+
+
+async def test_existing_buy_order_with_new_key_is_a_conflict_not_a_hang(client, webpay):
+    assert (await create(client, "k-3", buy_order="ORD-1")).status_code == 200
+
+    response = await asyncio.wait_for(create(client, "k-4", buy_order="ORD-1"), timeout=2)
+    assert response.status_code == 409
+    assert len(webpay.created) == 1
+
+
+async def test_retry_repeating_buy_order_and_key_is_replayed(client, webpay):
+    first = await create(client, "k-5", buy_order="ORD-2")
+    again = await create(client, "k-5", buy_order="ORD-2")
+
+    assert again.status_code == 200
+    assert again.headers.get("idempotent-replayed") == "true"
+    assert again.json()["token"] == first.json()["token"]
+    assert len(webpay.created) == 1
+
+
+async def test_stale_creating_record_is_taken_over(client, webpay, db):
+    # intento que murio entre el insert y la llamada a Webpay
+    await db["transactions"].insert_one({
+        "buy_order": "ORD-3", "session_id": "S", "amount": 1000, "status": "creating",
+        "idempotency_key": "k-6", "created_at": datetime.now() - timedelta(minutes=5),
+    })
+
+    response = await asyncio.wait_for(create(client, "k-6"), timeout=2)
+    assert response.status_code == 200
+    assert response.headers.get("idempotent-replayed") is None
+    assert len(webpay.created) == 1
+    doc = await db["transactions"].find_one({"idempotency_key": "k-6"})
+    assert doc["status"] == "pending" and doc["buy_order"] != "ORD-3"
+
+
+async def test_recent_creating_record_is_waited_for(client, webpay, db, monkeypatch):
+    import routes.webpay_routes as webpay_routes
+
+    monkeypatch.setattr(webpay_routes, "IDEMPOTENCY_WAIT_ATTEMPTS", 3)
+    monkeypatch.setattr(webpay_routes, "IDEMPOTENCY_WAIT_INTERVAL", 0.01)
+    await db["transactions"].insert_one({
+        "buy_order": "ORD-4", "session_id": "S", "amount": 1000, "status": "creating",
+        "idempotency_key": "k-7", "created_at": datetime.now(),
+    })
+
+    response = await create(client, "k-7")
+    assert response.status_code == 409
+    assert response.headers["retry-after"] == "1"
+    assert len(webpay.created) == 0
+
+
+def test_token_index_skips_null_tokens():
+    import database
+
+    [token_index] = [m.document for m in database.INDEXES["transactions"] if m.document["name"] == "token_unique"]
+    # sparse indexaria token: null (Webpay respondio sin token) y el segundo pago chocaria
+    assert token_index["partialFilterExpression"] == {"token": {"$type": "string"}}
+    assert "sparse" not in token_index
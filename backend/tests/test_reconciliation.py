@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from bench.standins import WebpayStandIn
+from services import inventory
+from services.reconciliation import EXPIRED_STATUS, PaymentReconciler
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def webpay(upstream):
+    standin = WebpayStandIn(latency=0)
+    upstream("webpay", httpx.MockTransport(standin.handler))
+    return standin
+
+
+@pytest.fixture
+def reconciler():
+    return PaymentReconciler(stale_after=60, expire_after=3600, rate=0)
+
+
+async def pending_payment(db, token, webpay=None, webpay_status=None, age=timedelta(minutes=10), amount=1000):
+    """Transaccion pendiente con 2 unidades reservadas; Webpay la conoce con `webpay_status`"""
+    reservation_id = await inventory.reserve([{"product_id": "P1", "quantity": 2}], buy_order=f"ORD-{token}")
+    created_at = datetime.now() - age
+    await db["transactions"].insert_one({
+        "token": token, "buy_order": f"ORD-{token}", "amount": amount, "status": "pending",
+        "reservation_id": reservation_id, "user_email": f"{token}@example.com", "created_at": created_at,
+    })
+    # el carrito con el que se hizo el checkout
+    await db["carts"].insert_one({"_id": f"{token}@example.com", "items": [{"product_id": "P1", "quantity": 2}],
+                                  "updated_at": created_at})
+    if webpay is not None:
+        webpay.created[token] = {"amount": amount, "buy_order": f"ORD-{token}"}
+        if webpay_status is not None:
+            webpay.results[token] = webpay_status
+    return reservation_id
+
+
+async def daily_sales(db):
+    return [doc async for doc in db["sales_daily"].find()]
+
+
+async def test_authorized_and_failed_payments_are_settled(db, webpay, reconciler):
+    await inventory.set_stock("P1", 10)
+    authorized = await pending_payment(db, "tok-ok", webpay, "AUTHORIZED", amount=1500)
+    failed = await pending_payment(db, "tok-failed", webpay, "FAILED")
+
+    result = await reconciler.run_once()
+
+    assert result == {"checked": 2, "updated": 2, "expired": 0, "errors": 0}
+    assert (await db["transactions"].find_one({"token": "tok-ok"}))["status"] == "AUTHORIZED"
+    assert (await db["transactions"].find_one({"token": "tok-failed"}))["status"] == "FAILED"
+    assert (await db["reservations"].find_one({"_id": authorized}))["status"] == "confirmed"
+    assert (await db["reservations"].find_one({"_id": failed}))["status"] == "released"
+    # 2 vendidas, las 2 del pago fallido volvieron
+    assert (await inventory.get_stock("P1"))["available"] == 8
+    # solo el pago autorizado vacia el carrito
+    assert (await db["carts"].find_one({"_id": "tok-ok@example.com"}))["items"] == []
+    assert len((await db["carts"].find_one({"_id": "tok-failed@example.com"}))["items"]) == 1
+    [sales] = await daily_sales(db)
+    assert (sales["count"], sales["authorized_count"], sales["authorized_amount"], sales["rejected_count"]) \
+        == (2, 1, 1500, 1)
+
+
+async def test_initialized_payments_wait_and_then_expire(db, webpay, reconciler):
+    await pending_payment(db, "tok-recent", webpay)
+    await pending_payment(db, "tok-abandoned", webpay, age=timedelta(hours=2))
+
+    result = await reconciler.run_once()
+
+    assert result == {"checked": 2, "updated": 0, "expired": 1, "errors": 0}
+    recent = await db["transactions"].find_one({"token": "tok-recent"})
+    assert recent["status"] == "pending" and recent["reconciled_at"] is not None
+    assert (await db["transactions"].find_one({"token": "tok-abandoned"}))["status"] == EXPIRED_STATUS
+
+
+async def test_commit_that_wins_the_race_is_not_recorded_twice(db, webpay, reconciler, monkeypatch):
+    import services.reconciliation as reconciliation
+
+    await pending_payment(db, "tok-race", webpay, "AUTHORIZED")
+    original = reconciler._fetch_status
+
+    async def commit_meanwhile(token, limiter, semaphore):
+        # commit_payment termina mientras el reconciliador consultaba a Webpay
+        await db["transactions"].update_one({"token": token}, {"$set": {"status": "AUTHORIZED"}})
+        return await original(token, limiter, semaphore)
+
+    recorded = []
+
+    async def record_sale(doc):
+        recorded.append(doc["token"])
+
+    monkeypatch.setattr(reconciler, "_fetch_status", commit_meanwhile)
+    monkeypatch.setattr(reconciliation, "record_sale", record_sale)
+
+    result = await reconciler.run_once()
+
+    assert result["updated"] == 0
+    assert recorded == []
+
+
+@pytest.mark.parametrize("body", [b"<html>oops</html>", b'["AUTHORIZED"]', b'"AUTHORIZED"', b"42", b"null"])
+async def test_unexpected_webpay_body_skips_only_that_payment(db, upstream, reconciler, body):
+    await pending_payment(db, "tok-garbage")
+    await pending_payment(db, "tok-fine", age=timedelta(hours=2))
+
+    async def handler(request):
+        if request.url.path.endswith("tok-garbage"):
+            return httpx.Response(200, content=body, headers={"Content-Type": "application/json"})
+        return httpx.Response(200, json={"status": "INITIALIZED"})
+
+    upstream("webpay", httpx.MockTransport(handler))
+    result = await reconciler.run_once()
+
+    assert result == {"checked": 2, "updated": 0, "expired": 1, "errors": 1}
+    # queda marcada como revisada: la siguiente pasada no la vuelve a poner primera
+    garbage = await db["transactions"].find_one({"token": "tok-garbage"})
+    assert garbage["status"] == "pending" and "reconciled_at" in garbage
+    assert (await reconciler.run_once())["checked"] == 0
+
+
+async def test_worker_survives_unexpected_errors(db, reconciler, monkeypatch):
+    calls = []
+
+    async def run_once():
+        calls.append(1)
+        raise KeyError("status")
+
+    reconciler.interval = 0.01
+    monkeypatch.setattr(reconciler, "run_once", run_once)
+    task = asyncio.create_task(reconciler._run())
+    await asyncio.sleep(0.05)
+    assert not task.done()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert len(calls) > 1
+    assert reconciler.stats["errors"] == len(calls)
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+import services.search as search
+from services import catalog_snapshot
+from services.search import SearchIndex
+
+
+def product(i, name="leche entera", description=""):
+    return {"id": f"{i:04d}", "name": name, "category": "Lacteos", "description": description}
+
+
+@pytest.fixture
+def index(monkeypatch):
+    # listas ordenadas desde pocos documentos, para ejercitarlas con un catalogo chico
+    monkeypatch.setattr(search, "RANKED_MIN_POSTINGS", 5)
+    index = SearchIndex()
+    index.sync([product(i, description="x " * (i % 7)) for i in range(200)])
+    assert [p["id"] for p in index.search("leche", 3)]
+    return index
+
+
+def assert_ranked_is_sorted(index):
+    for term, ranked in index._ranked.items():
+        expected = sorted((-index._saturated(tf, index._norms[d]), d) for d, tf in index._postings[term].items())
+        assert ranked == expected, term
+
+
+def test_upsert_only_recomputes_the_changed_document(index):
+    norms = dict(index._norms)
+    ranked = index._ranked["leche"]
+
+    index.upsert(product(5, description="leche descremada"))
+    index.upsert(product(500))
+    index.remove("0007")
+
+    assert index._ranked["leche"] is ranked
+    assert {d: n for d, n in index._norms.items() if d not in ("0005", "0500")} == \
+        {d: n for d, n in norms.items() if d not in ("0005", "0007")}
+    assert_ranked_is_sorted(index)
+    assert index.search("descremada")[0]["id"] == "0005"
+    assert "0007" not in {p["id"] for p in index.search("leche", 500)}
+
+
+def test_norms_are_recomputed_when_the_average_length_drifts(index):
+    reference = index._avg_len
+    for i in range(200, 400):
+        index.upsert(product(i, description="muy " * 30))
+    index.search("leche")
+
+    assert index._avg_len != reference
+    assert index._avg_len == pytest.approx(index._total_len / len(index))
+    assert_ranked_is_sorted(index)
+
+
+def test_removing_everything_resets_the_index(index):
+    for i in range(200):
+        index.remove(f"{i:04d}")
+    assert index.search("leche") == []
+    index.upsert(product(1))
+    assert [p["id"] for p in index.search("lec")] == ["0001"]
+
+
+@pytest.mark.anyio
+async def test_initial_sync_runs_off_the_event_loop(monkeypatch):
+    threads = []
+    build = catalog_snapshot.build_search_index
+
+    def tracked(products):
+        threads.append(threading.current_thread())
+        return build(products)
+
+    fresh = SearchIndex()
+    monkeypatch.setattr(catalog_snapshot, "search_index", fresh)
+    monkeypatch.setattr(catalog_snapshot, "build_search_index", tracked)
+
+    await catalog_snapshot.sync_search_index([product(1), product(2)])
+    assert threads and threads[0] is not threading.main_thread()
+    assert len(fresh) == 2 and fresh._avg_len is not None
+
+    # lo siguiente ya es incremental, sobre el mismo objeto
+    await catalog_snapshot.sync_search_index([product(1), product(3, name="yogurt")])
+    assert len(threads) == 1
+    assert [p["id"] for p in fresh.search("yog")] == ["0003"]
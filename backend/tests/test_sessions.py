@@ -0,0 +1,72 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.sessions import RevocationSet, SessionError, SessionStore, as_utc
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def store():
+    return SessionStore(session_ttl=timedelta(days=1), access_ttl=timedelta(minutes=30), reuse_grace=0)
+
+
+async def test_expiry_dates_are_written_in_utc(db, store):
+    sid, _, expires_at = await store.create("a@b.cl")
+    await store.revoke(sid, "logout")
+
+    expected = datetime.now(timezone.utc)
+    session = await db["sessions"].find_one({"_id": sid})
+    revocation = await db["revocations"].find_one({"sid": sid})
+    # el indice TTL las lee como UTC: tienen que coincidir con la hora UTC, no con la local
+    assert abs(as_utc(session["expires_at"]) - (expected + timedelta(days=1))) < timedelta(seconds=5)
+    assert abs(as_utc(revocation["expires_at"]) - (expected + timedelta(minutes=30))) < timedelta(seconds=5)
+
+
+async def test_rotation_and_reuse(db, store):
+    sid, jti, _ = await store.create("a@b.cl")
+    email, new_jti, expires_at = await store.rotate(sid, jti)
+    assert email == "a@b.cl" and expires_at.tzinfo is not None
+
+    # el jti anterior vuelve a usarse fuera de la gracia: se revoca la sesion completa
+    with pytest.raises(SessionError):
+        await store.rotate(sid, jti)
+    with pytest.raises(SessionError):
+        await store.rotate(sid, new_jti)
+
+
+async def test_other_worker_sees_revocations_until_they_expire(db, store):
+    sid, _, _ = await store.create("a@b.cl")
+    await store.revoke(sid, "logout")
+
+    other = RevocationSet()
+    assert await other.sync() == 1
+    assert other.is_revoked(sid)
+    other.add("old", datetime.now(timezone.utc) - timedelta(seconds=1))
+    assert not other.is_revoked("old")
+
+
+async def test_naive_utc_dates_from_mongo_are_not_read_as_local_time():
+    revoked = RevocationSet()
+    # asi llegan las fechas desde pymongo (tz_aware=False)
+    revoked.add("sid", datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=1))
+    assert revoked._revoked["sid"] == pytest.approx(time.time() + 60, abs=5)
+
+
+async def test_sync_loop_survives_unexpected_errors(monkeypatch):
+    revoked = RevocationSet(interval=0.01)
+    calls = []
+
+    async def sync():
+        calls.append(1)
+        raise ValueError("documento inesperado")
+
+    monkeypatch.setattr(revoked, "sync", sync)
+    revoked.start()
+    await asyncio.sleep(0.05)
+    assert not revoked._task.done()
+    await revoked.stop()
+    assert len(calls) > 1
@@ -0,0 +1,59 @@
+import uuid
+
+import pytest
+
+from services.catalog_snapshot import CatalogSnapshotManager, build_snapshot
+from services.search import SearchIndex, search_index
+from services.shared_catalog import SharedCatalogPublisher, SharedCatalogReader
+
+pytestmark = pytest.mark.anyio
+
+
+def products(count, extra=""):
+    return [{"id": f"{i:04d}", "name": f"Leche {extra}{i % 7}", "category": ["Lacteos", "Snacks"][i % 2],
+             "description": "entera" if i % 3 else "descremada sin lactosa", "price": 100 + i}
+            for i in range(count)]
+
+
+@pytest.fixture
+def publisher():
+    publisher = SharedCatalogPublisher(f"test-{uuid.uuid4().hex[:8]}")
+    yield publisher
+    publisher.close()
+
+
+@pytest.fixture
+async def worker(publisher):
+    # usa el search_index del modulo; stop() lo deja vacio de nuevo
+    manager = CatalogSnapshotManager()
+    manager.use_shared(SharedCatalogReader(publisher.name))
+    yield manager
+    await manager.stop()
+
+
+async def test_worker_searches_the_shared_index_without_decoding_the_catalog(publisher, worker):
+    catalog = products(120)
+    publisher.publish(build_snapshot(catalog, version=1))
+    snapshot = await worker.refresh()
+
+    assert snapshot.version == 1 and snapshot.products == ()
+    assert len(search_index) == 120 and search_index._docs == {}
+    local = SearchIndex()
+    local.sync(catalog)
+    for query in ("leche", "lac", "descremada lact", "leche 3", "snacks ent", "nada"):
+        assert {p["id"] for p in search_index.search(query, 200)} == {p["id"] for p in local.search(query, 200)}
+    assert search_index.search("sin lactosa", 1)[0] in catalog
+
+
+async def test_new_version_replaces_the_index_and_releases_the_old_segment(publisher, worker):
+    publisher.publish(build_snapshot(products(10), version=1))
+    await worker.refresh()
+    old_segment = worker.shared.segment
+
+    publisher.publish(build_snapshot(products(12, extra="nueva "), version=2))
+    snapshot = await worker.refresh()
+
+    assert snapshot.version == 2 and len(search_index) == 12
+    assert search_index.search("nueva")[0]["name"].startswith("Leche nueva")
+    # nadie mas usa el segmento anterior: ya se pudo cerrar
+    assert worker.shared._retired == [] and old_segment.buf is None
@@ -8,48 +8,52 @@ const PaymentResult = () => {
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    const checkPaymentStatus = async () => {
-      try {
-        const token = searchParams.get('token');
-        const statusParam = searchParams.get('status');
-        
-        if (statusParam === 'success') {
-          setStatus('success');
-        } else if (statusParam === 'failure') {
-          setStatus('failure');
-        } else if (token) {
-          // Si tenemos token, consultar el estado en el backend
-          try {
-            const response = await fetch(`http://localhost:8000/api/transactions/${token}`, {
-              credentials: 'include'
-            });
-            
-            if (response.ok) {
-              const transactionData = await response.json();
-              if (transactionData.status === 'AUTHORIZED') {
-                setStatus('success');
-              } else {
-                setStatus('failure');
-              }
-            } else {
-              setStatus('pending');
-            }
-          } catch (error) {
-            console.error('Error consultando transacción:', error);
-            setStatus('pending');
-          }
-        } else {
-          setStatus('pending');
-        }
-      } catch (error) {
-        console.error('Error procesando resultado:', error);
+    const token = searchParams.get('token');
+    const statusParam = searchParams.get('status');
+
+    if (statusParam === 'success') {
+      setStatus('success');
+      setLoading(false);
+      return;
+    }
+    if (statusParam === 'failure') {
+      setStatus('failure');
+      setLoading(false);
+      return;
+    }
+    if (!token) {
+      setStatus('pending');
+      setLoading(false);
+      return;
+    }
+
+    // El backend avisa por SSE apenas cambia el estado de la transacción
+    const source = new EventSource(`http://localhost:8000/api/transactions/${token}/events`, {
+      withCredentials: true
+    });
+
+    source.addEventListener('status', (event) => {
+      const transactionData = JSON.parse((event as MessageEvent).data);
+      if (transactionData.status === 'AUTHORIZED') {
+        setStatus('success');
+        source.close();
+      } else if (transactionData.status && transactionData.status !== 'pending' && transactionData.status !== 'creating') {
+        setStatus('failure');
+        source.close();
+      } else {
         setStatus('pending');
-      } finally {
-        setLoading(false);
       }
+      setLoading(false);
+    });
+
+    source.onerror = () => {
+      console.error('Error escuchando el estado de la transacción');
+      setStatus((current) => current ?? 'pending');
+      setLoading(false);
+      source.close();
     };
 
-    checkPaymentStatus();
+    return () => source.close();
   }, [searchParams]);
 
   if (loading) {